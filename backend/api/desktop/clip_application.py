@@ -1,7 +1,8 @@
 from api.views_extension import (
     get_next_clip_item,
     get_nearest_item,
-    get_thumbnail,
+    ThumbnailCache,
+    get_preview_movie,
     edit_item,
     delete_items_desktop,
     start_file,
@@ -99,7 +100,7 @@ class ClipApplication(QtWidgets.QMainWindow):
         self.swap = False
         self._last_item_id = None
         self._last_nearest_item_id = None
-        self._video_widgets = []
+        self.focused_video = None  # (player, preview) swapped in for a clicked video
         self._screen_geometry = None
         self.show_videos = SHOW_VIDEOS
         self.videos_to_play = self._get_videos_to_play()
@@ -274,9 +275,36 @@ class ClipApplication(QtWidgets.QMainWindow):
                     self._clear_layout(child_layout)
 
     def _clear_video_players(self):
-        for widget in self._video_widgets:
+        if self.focused_video is not None:
+            widget, preview = self.focused_video
             widget.close()
-        self._video_widgets = []
+            preview.deleteLater()  # Out of the layout, so not cleared with it
+        self.focused_video = None
+
+    def focus_video(self, item, preview):
+        # Swaps a video's preview for a full player, one at a time like the view
+        # application, putting the previous video back to its preview
+        self.unfocus_video()
+
+        widget = VlcVideoWidget()
+        widget.setFixedSize(preview.size())
+        widget.mousePressEvent = lambda event: start_file(item.id)
+        preview.parentWidget().layout().replaceWidget(preview, widget)
+        preview.hide()
+        widget.set_media(item.getpath())
+        widget.play()
+        self.focused_video = (widget, preview)
+
+    def unfocus_video(self):
+        if self.focused_video is None:
+            return
+
+        widget, preview = self.focused_video
+        self.focused_video = None
+        widget.parentWidget().layout().replaceWidget(widget, preview)
+        preview.show()
+        widget.close()
+        widget.deleteLater()
 
     def _get_widget(self, item_id, frame_layout, align):
         item = Item.objects.filter(id=item_id).get()
@@ -288,20 +316,19 @@ class ClipApplication(QtWidgets.QMainWindow):
             new_width = self.max_width_of_crop
             new_height = int(round(new_width * item.height / item.width))
 
-        use_video_player = (
-            item.filetype == int(FileType.Video) and self.videos_to_play > 0
-        )
-        if use_video_player:
-            widget = VlcVideoWidget()
+        # Videos loop their preview, and get a full player when clicked
+        movie = None
+        if item.filetype == int(FileType.Video) and self.videos_to_play > 0:
+            widget = QtWidgets.QLabel()
             widget.setFixedSize(new_width, new_height)
-            widget.set_media(item.getpath())
-            widget.play()
-            self._video_widgets.append(widget)
+            movie = get_preview_movie(item, new_width, new_height, widget)
             self.videos_to_play -= 1
-        else:
-            resized_image = get_thumbnail(item.id, new_width, new_height)
 
-        if not use_video_player:
+        if movie is not None:
+            widget.setMovie(movie)
+            movie.start()
+        else:
+            resized_image = ThumbnailCache.get(item.id, new_width, new_height)
             qimage = ImageQt.ImageQt(resized_image)
             pixmap = QtGui.QPixmap.fromImage(qimage)
             pixmap = pixmap.scaled(
@@ -324,6 +351,10 @@ class ClipApplication(QtWidgets.QMainWindow):
                 widget.setStyleSheet("background-color: #1C1D21; border: none;")
 
         widget.setStyleSheet("background-color: #1C1D21; border: none;")
+        if item.filetype == int(FileType.Video) and self.show_videos:
+            widget.mousePressEvent = lambda event, widget=widget: self.focus_video(
+                item, widget
+            )
         frame_layout.addWidget(widget, 1, align)
 
         type_to_str_map = {0: "image", 1: "video"}
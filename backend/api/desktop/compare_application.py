@@ -1,7 +1,8 @@
 from api.views_extension import (
     get_random_compare_item,
     get_comparison_items,
-    get_thumbnail,
+    ThumbnailCache,
+    get_preview_movie,
     delete_items_desktop,
 )
 from api.models import Item, FileType
@@ -95,7 +96,7 @@ class CompareApplication(QtWidgets.QMainWindow):
 
         self.item = None
         self.comparison_item_ids = []
-        self.video_widgets = {}
+        self.focused_video = None  # (player, preview) swapped in for a clicked video
 
         self.setWindowTitle("Compare application")
         screen = QtGui.QGuiApplication.primaryScreen()
@@ -185,9 +186,37 @@ class CompareApplication(QtWidgets.QMainWindow):
                 widget.deleteLater()
 
     def _clear_video_players(self):
-        for widget in list(self.video_widgets.values()):
-            widget.close()
-        self.video_widgets = {}
+        if self.focused_video is not None:
+            video_widget, preview = self.focused_video
+            video_widget.close()
+            preview.deleteLater()  # Out of the layout, so not cleared with it
+        self.focused_video = None
+
+    def focus_video(self, item_id, preview):
+        # Swaps a video's preview for a full player, one at a time like the view
+        # application, putting the previous video back to its preview
+        self.unfocus_video()
+
+        item = Item.objects.filter(id=item_id).get()
+        video_widget = VlcVideoWidget()
+        video_widget.setFixedSize(preview.size())
+        video_widget.mousePressEvent = lambda event: self.open_item(item_id)
+        preview.parentWidget().layout().replaceWidget(preview, video_widget)
+        preview.hide()
+        video_widget.set_media(item.getpath())
+        video_widget.play()
+        self.focused_video = (video_widget, preview)
+
+    def unfocus_video(self):
+        if self.focused_video is None:
+            return
+
+        video_widget, preview = self.focused_video
+        self.focused_video = None
+        video_widget.parentWidget().layout().replaceWidget(video_widget, preview)
+        preview.show()
+        video_widget.close()
+        video_widget.deleteLater()
 
     def _resize_thumbnail(self, thumbnail, target_height):
         resample = getattr(Image, "Resampling", Image).LANCZOS
@@ -215,20 +244,34 @@ class CompareApplication(QtWidgets.QMainWindow):
         image_container_layout = QtWidgets.QVBoxLayout(image_container)
         image_container_layout.setContentsMargins(0, 0, 0, 0)
         if item.filetype == int(FileType.Video) and allow_video:
-            video_widget = VlcVideoWidget()
-            video_widget.setFixedSize(new_width, new_height)
-            video_widget.set_media(item.getpath())
-            video_widget.play()
-            video_widget.mousePressEvent = (
-                lambda event, item_id=item_id: self.open_item(item_id)
+            # The preview loops until clicked, which swaps in a full player
+            preview = QtWidgets.QLabel()
+            preview.setFixedSize(new_width, new_height)
+            preview.setStyleSheet("background-color: #1C1D21;")
+            movie = get_preview_movie(item, new_width, new_height, preview)
+            if movie is not None:
+                preview.setMovie(movie)
+                movie.start()
+            else:
+                thumbnail = ThumbnailCache.get(item.id, new_width, new_height)
+                thumbnail = self._resize_thumbnail(thumbnail, new_height)
+                preview.setPixmap(
+                    QtGui.QPixmap.fromImage(ImageQt.ImageQt(thumbnail)).scaled(
+                        new_width,
+                        new_height,
+                        QtCore.Qt.KeepAspectRatio,
+                        QtCore.Qt.SmoothTransformation,
+                    )
+                )
+            preview.mousePressEvent = lambda event, item_id=item_id: self.focus_video(
+                item_id, preview
             )
             image_container_layout.addWidget(
-                video_widget, 0, QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter
+                preview, 0, QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter
             )
-            self.video_widgets[item_id] = video_widget
             media_width = new_width
         else:
-            resized_image = get_thumbnail(item.id, new_width, new_height)
+            resized_image = ThumbnailCache.get(item.id, new_width, new_height)
             resized_image = self._resize_thumbnail(resized_image, new_height)
             qimage = ImageQt.ImageQt(resized_image)
             pixmap = QtGui.QPixmap.fromImage(qimage)
@@ -2,6 +2,8 @@ from api.views_extension import (
     get_next_crop_item,
     crop_and_resize_from_view,
     delete_items_desktop,
+    check_for_crops,
+    CropPrefetcher,
 )
 from api.utils.process_images import apply_rgb_curves
 from api.utils.process_images import rotate_image_90
@@ -515,8 +517,11 @@ def start_crop_application():
         max_height_in_crop = int(geometry.height() * 0.7)
     else:
         max_height_in_crop = 700
-    if get_next_crop_item(max_height_in_crop) is None:
+    if not check_for_crops():
         return True, True
+
+    # Bounds for the following items are computed while the operator crops
+    CropPrefetcher.start(max_height_in_crop)
     window = CropApplication()
     window.showMaximized()
     window.raise_()
@@ -1,7 +1,7 @@
 from api.views_extension import (
     get_top_x_unlabelled_ids,
     get_all_labels,
-    edit_item,
+    edit_items,
     ThumbnailCache,
 )
 from api.models import FileState
@@ -200,7 +200,7 @@ class LabelApplication(QtWidgets.QMainWindow):
         if not self.ids:
             return
 
-        first_thumb = ThumbnailCache.__getitem__(self.ids[0])
+        first_thumb = ThumbnailCache.get(self.ids[0])
         target_side = max(first_thumb.width, first_thumb.height)
         columns = self._compute_columns(target_side)
 
@@ -218,7 +218,7 @@ class LabelApplication(QtWidgets.QMainWindow):
             frame_layout.setContentsMargins(4, 4, 4, 4)
             frame_layout.setSpacing(4)
 
-            thumbnail = ThumbnailCache.__getitem__(item_id)
+            thumbnail = ThumbnailCache.get(item_id)
             thumbnail = self._pad_thumbnail(thumbnail, target_side)
             qimage = ImageQt.ImageQt(thumbnail)
             pixmap = QtGui.QPixmap.fromImage(qimage)
@@ -397,10 +397,10 @@ class LabelApplication(QtWidgets.QMainWindow):
     def modify_items(self, label):
         if label == "":
             return
-        for item_id in list(self.selected_ids):
-            edit_item(
-                item_id=item_id, new_label=label, new_state=int(FileState.NeedsClip)
-            )
+        edit_items(
+            self.selected_ids, new_label=label, new_state=int(FileState.NeedsClip)
+        )
+        for item_id in self.selected_ids:
             self.id_data.pop(item_id, None)
 
         self.selected_ids = set()
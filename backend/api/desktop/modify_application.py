@@ -1,6 +1,6 @@
 from api.views_extension import (
     get_top_x_needsmodify_ids,
-    get_thumbnail,
+    ThumbnailCache,
     edit_item,
     delete_items_desktop,
     start_file,
@@ -144,7 +144,7 @@ class ModifyApplication(QtWidgets.QMainWindow):
         if not self.ids:
             return
 
-        first_thumb = get_thumbnail(self.ids[0])
+        first_thumb = ThumbnailCache.get(self.ids[0])
         target_side = max(first_thumb.width, first_thumb.height)
         columns = self._compute_columns(target_side)
 
@@ -160,7 +160,7 @@ class ModifyApplication(QtWidgets.QMainWindow):
             card_layout.setContentsMargins(4, 4, 4, 4)
             card_layout.setSpacing(4)
 
-            thumbnail = first_thumb if i == 0 else get_thumbnail(item_id)
+            thumbnail = first_thumb if i == 0 else ThumbnailCache.get(item_id)
             thumbnail = self._pad_thumbnail(thumbnail, target_side)
             qimage = ImageQt.ImageQt(thumbnail)
             pixmap = QtGui.QPixmap.fromImage(qimage)
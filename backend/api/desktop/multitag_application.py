@@ -288,7 +288,7 @@ class MultiTagApplication(QtWidgets.QMainWindow):
             self.page_label.setText("0 / 0")
             return
 
-        first_thumb = ThumbnailCache.__getitem__(ids[0])
+        first_thumb = ThumbnailCache.get(ids[0])
         target_side = max(first_thumb.width, first_thumb.height)
         columns = self._compute_columns(target_side)
 
@@ -306,7 +306,7 @@ class MultiTagApplication(QtWidgets.QMainWindow):
             card_layout.setContentsMargins(4, 4, 4, 4)
             card_layout.setSpacing(4)
 
-            thumbnail = first_thumb if i == 0 else ThumbnailCache.__getitem__(item_id)
+            thumbnail = first_thumb if i == 0 else ThumbnailCache.get(item_id)
 
             thumbnail = self._pad_thumbnail(thumbnail, target_side)
             qimage = ImageQt.ImageQt(thumbnail)
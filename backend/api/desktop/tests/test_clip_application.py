@@ -1,9 +1,10 @@
 from PIL import Image
 import pytest
 
+from api import views_extension
 from api.models import FileType, FileState
 from api.desktop import clip_application as clip_app
-from PySide6 import QtWidgets
+from PySide6 import QtCore, QtWidgets
 
 
 class _FakeItem:
@@ -41,7 +42,7 @@ def clip_window(monkeypatch, qtbot):
     monkeypatch.setattr(clip_app, "get_next_clip_item", lambda *a, **k: 1)
     monkeypatch.setattr(clip_app, "get_nearest_item", lambda *a, **k: 2)
     monkeypatch.setattr(
-        clip_app, "get_thumbnail", lambda *a, **k: Image.new("RGB", (10, 10))
+        clip_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
     )
     monkeypatch.setattr(clip_app, "edit_item", lambda *a, **k: None)
     monkeypatch.setattr(clip_app, "delete_items_desktop", lambda *a, **k: None)
@@ -75,7 +76,7 @@ def test_nearest_missing_auto_approves(monkeypatch, qtbot):
     )
     monkeypatch.setattr(clip_app, "get_nearest_item", lambda *a, **k: -1)
     monkeypatch.setattr(
-        clip_app, "get_thumbnail", lambda *a, **k: Image.new("RGB", (10, 10))
+        clip_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
     )
     approved = []
     monkeypatch.setattr(clip_app, "edit_item", lambda **kwargs: approved.append(kwargs))
@@ -119,3 +120,69 @@ def test_toggle_videos_updates_state_and_button(clip_window):
     assert clip_window.show_videos is True
     assert clip_window.videos_to_play == 2
     assert clip_window.toggle_videos_button.text() == "Hide Videos"
+
+
+def test_one_video_player_at_a_time(monkeypatch, qtbot, tmp_path):
+    items = [
+        _FakeItem(1, filetype=FileType.Video),
+        _FakeItem(2, filetype=FileType.Video),
+    ]
+    for item in items:
+        item.getpath = lambda: ""
+
+    preview_path = tmp_path / "preview.webp"
+    frames = [Image.new("RGB", (80, 40), color) for color in ("red", "blue")]
+    frames[0].save(preview_path, save_all=True, append_images=frames[1:], loop=0)
+
+    monkeypatch.setattr(clip_app, "SHOW_VIDEOS", True)
+    monkeypatch.setattr(clip_app, "get_next_clip_item", lambda *a, **k: 1)
+    monkeypatch.setattr(clip_app, "get_nearest_item", lambda *a, **k: 2)
+    monkeypatch.setattr(
+        views_extension.VideoPreviewStore, "get_clip", lambda item: str(preview_path)
+    )
+
+    players = []
+
+    class _FakePlayer(QtWidgets.QFrame):
+        def __init__(self):
+            super().__init__()
+            self.closed = False
+            players.append(self)
+
+        def set_media(self, path):
+            self.path = path
+
+        def play(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(clip_app, "VlcVideoWidget", _FakePlayer)
+
+    class _FakeItemModel:
+        objects = _FakeManager(items)
+
+    monkeypatch.setattr(clip_app, "Item", _FakeItemModel)
+
+    window = clip_app.ClipApplication()
+    qtbot.addWidget(window)
+    QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+
+    previews = [
+        label
+        for label in window.findChildren(QtWidgets.QLabel)
+        if label.movie() is not None
+    ]
+    assert len(previews) == 2
+
+    # The previous video goes back to its preview
+    previews[0].mousePressEvent(None)
+    assert len(players) == 1 and previews[0].isHidden()
+
+    previews[1].mousePressEvent(None)
+    assert len(players) == 2 and players[0].closed
+    assert not previews[0].isHidden() and previews[1].isHidden()
+
+    window.load_items()
+    assert players[1].closed
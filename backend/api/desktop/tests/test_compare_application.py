@@ -1,8 +1,10 @@
 from PIL import Image
 import pytest
 
+from api import views_extension
 from api.models import FileType
 from api.desktop import compare_application as compare_app
+from PySide6 import QtCore, QtWidgets
 
 
 class _FakeItem:
@@ -39,7 +41,7 @@ def compare_window(monkeypatch, qtbot):
     )
     monkeypatch.setattr(compare_app, "get_comparison_items", lambda *a, **k: [2, 3])
     monkeypatch.setattr(
-        compare_app, "get_thumbnail", lambda *a, **k: Image.new("RGB", (10, 10))
+        compare_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
     )
     monkeypatch.setattr(compare_app, "delete_items_desktop", lambda *a, **k: None)
 
@@ -77,3 +79,77 @@ def test_next_loads_new_item(monkeypatch, compare_window):
     compare_window.next()
 
     assert compare_window.item.id == 11
+
+
+def test_one_video_player_at_a_time(monkeypatch, qtbot, tmp_path):
+    items = [
+        _FakeItem(1),
+        _FakeItem(2, filetype=FileType.Video),
+        _FakeItem(3, filetype=FileType.Video),
+    ]
+    for item in items:
+        item.getpath = lambda: ""
+
+    preview_path = tmp_path / "preview.webp"
+    frames = [Image.new("RGB", (80, 40), color) for color in ("red", "blue")]
+    frames[0].save(preview_path, save_all=True, append_images=frames[1:], loop=0)
+
+    monkeypatch.setattr(
+        compare_app, "get_random_compare_item", lambda *a, **k: items[0]
+    )
+    monkeypatch.setattr(compare_app, "get_comparison_items", lambda *a, **k: [2, 3])
+    monkeypatch.setattr(
+        compare_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
+    )
+    monkeypatch.setattr(
+        views_extension.VideoPreviewStore, "get_clip", lambda item: str(preview_path)
+    )
+
+    players = []
+
+    class _FakePlayer(QtWidgets.QFrame):
+        def __init__(self):
+            super().__init__()
+            self.closed = False
+            players.append(self)
+
+        def set_media(self, path):
+            self.path = path
+
+        def play(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(compare_app, "VlcVideoWidget", _FakePlayer)
+
+    class _FakeItemModel:
+        objects = _FakeManager(items)
+
+    monkeypatch.setattr(compare_app, "Item", _FakeItemModel)
+
+    window = compare_app.CompareApplication()
+    qtbot.addWidget(window)
+    # Small enough that every card fits the unshown window
+    window.max_height_in_crop = window.min_height_in_crop = 10
+    window.load_items()
+    QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+
+    previews = [
+        label
+        for label in window.findChildren(QtWidgets.QLabel)
+        if label.movie() is not None
+    ]
+    assert len(previews) == 2
+
+    # The previous video goes back to its preview
+    previews[0].mousePressEvent(None)
+    assert len(players) == 1 and previews[0].isHidden()
+
+    previews[1].mousePressEvent(None)
+    assert len(players) == 2 and players[0].closed
+    assert not previews[0].isHidden() and previews[1].isHidden()
+
+    window.load_items()
+    assert players[1].closed
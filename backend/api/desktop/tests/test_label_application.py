@@ -19,11 +19,11 @@ def label_window(tmp_path, monkeypatch, qtbot):
     _make_image(tmp_path)
     monkeypatch.setattr(label_app, "get_top_x_unlabelled_ids", lambda *a, **k: [1])
     monkeypatch.setattr(label_app, "get_all_labels", lambda *a, **k: [{"label": "cat"}])
-    monkeypatch.setattr(label_app, "edit_item", lambda *a, **k: None)
+    monkeypatch.setattr(label_app, "edit_items", lambda *a, **k: None)
 
     class _FakeThumbnailCache:
         @staticmethod
-        def __getitem__(_item_id):
+        def get(_item_id, *args):
             return Image.new("RGB", (10, 10))
 
     monkeypatch.setattr(label_app, "ThumbnailCache", _FakeThumbnailCache)
@@ -44,13 +44,14 @@ def test_label_suggestions_render(label_window):
 def test_modify_items_calls_edit(monkeypatch, label_window):
     captured = {}
 
-    def _capture(**kwargs):
-        captured.update(kwargs)
+    def _capture(item_ids, **kwargs):
+        captured.update(kwargs, item_ids=set(item_ids))
 
-    monkeypatch.setattr(label_app, "edit_item", _capture)
-    label_window.selected_ids = {1}
+    monkeypatch.setattr(label_app, "edit_items", _capture)
+    label_window.selected_ids = {1, 2}
     label_window.modify_items("dog")
 
+    assert captured["item_ids"] == {1, 2}
     assert captured["new_label"] == "dog"
     assert captured["new_state"] == int(FileState.NeedsClip)
 
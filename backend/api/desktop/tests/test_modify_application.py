@@ -40,7 +40,7 @@ def modify_window(tmp_path, monkeypatch, qtbot):
 
     monkeypatch.setattr(modify_app, "get_top_x_needsmodify_ids", lambda *a, **k: [1])
     monkeypatch.setattr(
-        modify_app, "get_thumbnail", lambda *a, **k: Image.new("RGB", (10, 10))
+        modify_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
     )
     monkeypatch.setattr(modify_app, "delete_items_desktop", lambda *a, **k: None)
     monkeypatch.setattr(modify_app, "edit_item", lambda *a, **k: None)
@@ -16,7 +16,7 @@ def multitag_window(monkeypatch, qtbot):
 
     class _FakeThumbnailCache:
         @staticmethod
-        def __getitem__(_item_id):
+        def get(_item_id, *args):
             return Image.new("RGB", (10, 10))
 
     monkeypatch.setattr(multitag_app, "ThumbnailCache", _FakeThumbnailCache)
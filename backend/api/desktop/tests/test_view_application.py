@@ -1,9 +1,10 @@
 from PIL import Image
 import pytest
 
+from api import views_extension
 from api.models import FileType
 from api.desktop import view_application as view_app
-from PySide6 import QtWidgets
+from PySide6 import QtCore, QtGui, QtWidgets
 
 
 class _FakeItem:
@@ -41,14 +42,16 @@ def view_window(monkeypatch, qtbot):
     items = [_FakeItem(1), _FakeItem(2), _FakeItem(3)]
     manager = _FakeManager(items)
 
+    monkeypatch.setattr(view_app, "get_items_from_tags", lambda *a, **k: items)
     monkeypatch.setattr(
-        view_app, "get_items_and_paths_from_tags", lambda *a, **k: {1: {}, 2: {}, 3: {}}
+        view_app,
+        "get_tag_values",
+        lambda objects, tag_name: {item.id: ["cat"] for item in objects},
     )
-    monkeypatch.setattr(view_app, "get_tags", lambda *a, **k: {"label": ["cat"]})
-    monkeypatch.setattr(view_app, "get_tag", lambda *a, **k: 1)
     monkeypatch.setattr(
-        view_app, "get_thumbnail", lambda *a, **k: Image.new("RGB", (10, 10))
+        view_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
     )
+    monkeypatch.setattr(view_app.ThumbnailCache, "peek", lambda *a, **k: None)
     monkeypatch.setattr(view_app, "delete_items_desktop", lambda *a, **k: None)
     monkeypatch.setattr(view_app, "edit_item", lambda *a, **k: None)
 
@@ -67,6 +70,27 @@ def test_builds_bins(view_window):
     assert view_window.bins
 
 
+def test_bins_built_without_per_item_queries(view_window, monkeypatch):
+    def _no_queries(*args, **kwargs):
+        raise AssertionError("Item queried while building bins")
+
+    monkeypatch.setattr(view_window, "get_new_size", lambda width, height: (200, 100))
+    monkeypatch.setattr(view_app.Item.objects, "get", _no_queries)
+    monkeypatch.setattr(view_app.Item.objects, "filter", _no_queries)
+
+    view_window.page_width = 500
+    view_window.orderby_metric = "id"
+    view_window.items_per_bin = 0
+    view_window.get_ids_and_build_bins()
+
+    assert [b["ids"] for b in view_window.bins["cat"]] == [[1, 2], [3]]
+
+    view_window.items_per_bin = 1
+    view_window.get_ids_and_build_bins()
+
+    assert [b["ids"] for b in view_window.bins["cat"]] == [[1], [2], [3]]
+
+
 def test_toggle_thumbnail_mode(view_window):
     current = view_window.thumbnail_mode
     view_window.toggle_thumbnail_mode()
@@ -80,6 +104,38 @@ def test_modify_mode_gates_actions(view_window):
     assert any(not b.isEnabled() for b in buttons)
 
 
+def test_thumbnails_load_in_background(view_window, qtbot):
+    qtbot.waitUntil(lambda: not view_window.thumbnail_labels)
+
+    labels = [
+        label
+        for label in view_window.items_scroll_contents.findChildren(QtWidgets.QLabel)
+        if label.pixmap() is not None and not label.pixmap().isNull()
+    ]
+    assert len(labels) == len(view_window.page_data[0][2]["ids"])
+
+
+def test_neighbouring_pages_are_prefetched(view_window):
+    view_window.orderby_metric = "id"
+    view_window.items_per_bin = 1
+    view_window.get_ids_and_build_bins()
+
+    requests = []
+    view_window.thumbnail_loader.request = (
+        lambda item_id, width, height, priority=view_app.VISIBLE_PRIORITY: (
+            requests.append((item_id, priority))
+        )
+    )
+    view_window.load_items()
+
+    assert [r[0] for r in requests if r[1] == view_app.PREFETCH_PRIORITY] == [2]
+
+    requests.clear()
+    view_window.increment_page()
+
+    assert [r[0] for r in requests if r[1] == view_app.PREFETCH_PRIORITY] == [1, 3]
+
+
 def test_videos_currently_played_limits_playback(monkeypatch, qtbot):
     items = [
         _FakeItem(1, filetype=FileType.Video),
@@ -87,14 +143,16 @@ def test_videos_currently_played_limits_playback(monkeypatch, qtbot):
     ]
     manager = _FakeManager(items)
 
+    monkeypatch.setattr(view_app, "get_items_from_tags", lambda *a, **k: items)
     monkeypatch.setattr(
-        view_app, "get_items_and_paths_from_tags", lambda *a, **k: {1: {}, 2: {}}
+        view_app,
+        "get_tag_values",
+        lambda objects, tag_name: {item.id: ["cat"] for item in objects},
     )
-    monkeypatch.setattr(view_app, "get_tags", lambda *a, **k: {"label": ["cat"]})
-    monkeypatch.setattr(view_app, "get_tag", lambda *a, **k: 1)
     monkeypatch.setattr(
-        view_app, "get_thumbnail", lambda *a, **k: Image.new("RGB", (10, 10))
+        view_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
     )
+    monkeypatch.setattr(view_app.ThumbnailCache, "peek", lambda *a, **k: None)
     monkeypatch.setattr(view_app, "delete_items_desktop", lambda *a, **k: None)
     monkeypatch.setattr(view_app, "edit_item", lambda *a, **k: None)
 
@@ -121,3 +179,79 @@ def test_videos_currently_played_limits_playback(monkeypatch, qtbot):
     window.load_items()
 
     assert calls == [(1, False), (2, True)]
+
+
+def test_video_previews_play_until_focused(monkeypatch, qtbot, tmp_path):
+    items = [
+        _FakeItem(1, filetype=FileType.Video),
+        _FakeItem(2, filetype=FileType.Video),
+    ]
+    manager = _FakeManager(items)
+
+    preview_path = tmp_path / "preview.webp"
+    frames = [Image.new("RGB", (80, 40), color) for color in ("red", "blue")]
+    frames[0].save(preview_path, save_all=True, append_images=frames[1:], loop=0)
+
+    monkeypatch.setattr(view_app, "get_items_from_tags", lambda *a, **k: items)
+    monkeypatch.setattr(
+        view_app,
+        "get_tag_values",
+        lambda objects, tag_name: {item.id: ["cat"] for item in objects},
+    )
+    monkeypatch.setattr(
+        views_extension.VideoPreviewStore, "get_clip", lambda item: str(preview_path)
+    )
+    monkeypatch.setattr(
+        view_app.ThumbnailCache, "get", lambda *a, **k: Image.new("RGB", (10, 10))
+    )
+    monkeypatch.setattr(view_app.ThumbnailCache, "peek", lambda *a, **k: None)
+
+    players = []
+
+    class _FakePlayer(QtWidgets.QFrame):
+        def __init__(self):
+            super().__init__()
+            self.closed = False
+            players.append(self)
+
+        def set_media(self, path):
+            self.path = path
+
+        def play(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(view_app, "VlcVideoWidget", _FakePlayer)
+
+    class _FakeItemModel:
+        objects = manager
+
+    monkeypatch.setattr(view_app, "Item", _FakeItemModel)
+
+    window = view_app.ViewApplication()
+    qtbot.addWidget(window)
+    window.orderby_metric = "id"
+    window.items_per_window = 2
+    window.get_ids_and_build_bins()
+    window.load_items()
+    # The first page's widgets, from the constructor, are gone
+    QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+
+    previews = [
+        label
+        for label in window.items_scroll_contents.findChildren(QtWidgets.QLabel)
+        if label.movie() is not None
+    ]
+    assert len(previews) == 2
+    assert all(label.movie().state() == QtGui.QMovie.Running for label in previews)
+    assert players == []
+
+    # One player at a time, the previous tile goes back to its preview
+    previews[0].mousePressEvent(None)
+    assert len(players) == 1 and previews[0].isHidden()
+
+    previews[1].mousePressEvent(None)
+    assert len(players) == 2 and players[0].closed
+    assert not previews[0].isHidden() and previews[1].isHidden()
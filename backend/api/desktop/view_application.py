@@ -1,8 +1,8 @@
 from api.views_extension import (
-    get_thumbnail,
-    get_items_and_paths_from_tags,
-    get_tag,
-    get_tags,
+    ThumbnailCache,
+    get_preview_movie,
+    get_items_from_tags,
+    get_tag_values,
     TAG_STYLE_OPTIONS,
     delete_items_desktop,
     edit_item,
@@ -21,6 +21,10 @@ from api.utils.overrides import get_view_default_tags
 
 SORT_METRIC_OPTIONS = ("alphabetical", "random")
 VIDEOS_CURRENTLY_PLAYED = 2
+THUMBNAIL_WORKERS = 4
+MIN_ITEM_WIDTH = 108  # Leaves room for an item's buttons
+VISIBLE_PRIORITY = 1  # Thumbnails on the current page load before prefetched ones
+PREFETCH_PRIORITY = 0
 
 
 class VlcVideoWidget(QtWidgets.QFrame):
@@ -92,6 +96,74 @@ class VlcVideoWidget(QtWidgets.QFrame):
             self._instance.release()
 
 
+def load_thumbnail_image(item_id, width, height):
+    # Runs on a worker thread, so only QImage is used (QPixmap is GUI thread only)
+    thumbnail = ThumbnailCache.get(item_id, width, height)
+    qimage = ImageQt.ImageQt(thumbnail).copy()  # Detached from the PIL buffer
+    return qimage.scaled(
+        width, height, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation
+    )
+
+
+class ThumbnailTask(QtCore.QRunnable):
+    def __init__(self, loader, key):
+        super().__init__()
+        self.setAutoDelete(False)  # Kept alive by the loader until it reports back
+        self.loader = loader
+        self.key = key
+        self.started = False
+
+    def run(self):
+        self.started = True
+        try:
+            qimage = load_thumbnail_image(*self.key)
+        except Exception as e:
+            print(f"Could not load thumbnail for item {self.key[0]}: {e}")
+            qimage = QtGui.QImage()
+
+        self.loader.loaded.emit(*self.key, qimage)
+
+
+class ThumbnailLoader(QtCore.QObject):
+    """
+    Decodes and scales thumbnails on a thread pool, emitting loaded(item_id, width,
+    height, qimage) on the Qt thread. Requests for a size already in flight are
+    shared, and a null QImage is emitted if loading fails.
+    """
+
+    loaded = QtCore.Signal(int, int, int, QtGui.QImage)
+
+    def __init__(self, parent=None, max_workers=THUMBNAIL_WORKERS):
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.in_flight = {}  # (item_id, width, height) -> ThumbnailTask
+        self.loaded.connect(self._finished)
+
+    def request(self, item_id, width, height, priority=VISIBLE_PRIORITY):
+        key = (item_id, width, height)
+        if key in self.in_flight:
+            return
+
+        task = ThumbnailTask(self, key)
+        self.in_flight[key] = task
+        self.pool.start(task, priority)
+
+    def clear(self):
+        # Drops queued requests, letting the running ones finish
+        self.pool.clear()
+        self.in_flight = {
+            key: task for key, task in self.in_flight.items() if task.started
+        }
+
+    def shutdown(self):
+        self.clear()
+        self.pool.waitForDone()
+
+    def _finished(self, item_id, width, height, _qimage):
+        self.in_flight.pop((item_id, width, height), None)
+
+
 class ViewApplication(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
@@ -113,6 +185,7 @@ class ViewApplication(QtWidgets.QMainWindow):
         self.orderby_usenull = True
         self.modify_mode = False
         self.thumbnail_mode = False
+        self.focused_video = None  # (item_id, preview label) swapped for a player
 
         self.chosen_tags = get_view_default_tags()
         self.current_page = 0
@@ -120,6 +193,11 @@ class ViewApplication(QtWidgets.QMainWindow):
         self.page_data = []
         self.sorted_bin_metrics = []
 
+        # Placeholders waiting on a thumbnail, by (item_id, width, height)
+        self.thumbnail_labels = defaultdict(list)
+        self.thumbnail_loader = ThumbnailLoader(self)
+        self.thumbnail_loader.loaded.connect(self.on_thumbnail_loaded)
+
         self.setWindowTitle("View application")
         screen = QtGui.QGuiApplication.primaryScreen()
         if screen:
@@ -278,37 +356,110 @@ class ViewApplication(QtWidgets.QMainWindow):
             if player:
                 player.close()
                 self.id_data[item_id].pop("video_widget", None)
+        self.focused_video = None
+
+    def focus_video(self, item_id, label):
+        # Swaps a video's preview for a full player, one at a time, so the grid
+        # only holds a VLC instance for the video being watched
+        self.unfocus_video()
+
+        widget = VlcVideoWidget()
+        widget.setFixedSize(label.size())
+        widget.mousePressEvent = lambda event: self.open_id(item_id)
+        label.parentWidget().layout().replaceWidget(label, widget)
+        label.hide()
+        widget.set_media(self.id_data[item_id]["item"].getpath())
+        widget.play()
+
+        self.id_data[item_id]["video_widget"] = widget
+        self.focused_video = (item_id, label)
+
+    def unfocus_video(self):
+        if self.focused_video is None:
+            return
+
+        item_id, label = self.focused_video
+        self.focused_video = None
+        widget = self.id_data.get(item_id, {}).pop("video_widget", None)
+        if widget is None:
+            return
+
+        widget.parentWidget().layout().replaceWidget(widget, label)
+        label.show()
+        widget.close()
+        widget.deleteLater()
 
     def get_widget(self, item_id, force_thumbnail=False):
-        item = Item.objects.filter(id=item_id).get()
+        item = self.id_data[item_id]["item"]
         new_width, new_height = self.get_new_size(item.width, item.height)
 
+        label = QtWidgets.QLabel()
+        label.setFixedSize(new_width, new_height)
+        label.setStyleSheet("background-color: #1C1D21;")
+
+        # Videos loop their preview, and get a player when clicked
         if (
             item.filetype == int(FileType.Video)
             and not self.thumbnail_mode
             and not force_thumbnail
         ):
-            widget = VlcVideoWidget()
-            widget.setFixedSize(new_width, new_height)
-            widget.set_media(item.getpath())
-            widget.play()
-            self.id_data[item_id]["video_widget"] = widget
-            return widget
-
-        resized_image = get_thumbnail(item.id, new_width, new_height)
-        qimage = ImageQt.ImageQt(resized_image)
-        pixmap = QtGui.QPixmap.fromImage(qimage)
-        pixmap = pixmap.scaled(
-            new_width,
-            new_height,
+            movie = get_preview_movie(item, new_width, new_height, label)
+            if movie is not None:
+                label.setMovie(movie)
+                movie.start()
+                return label
+
+        # Cached thumbnails are shown straight away, others load in the background
+        cached = ThumbnailCache.peek(item.id, new_width, new_height)
+        if cached is not None:
+            label.setPixmap(self.get_pixmap(cached, new_width, new_height))
+        else:
+            label.setStyleSheet("background-color: #24262B;")
+            self.thumbnail_labels[(item.id, new_width, new_height)].append(label)
+            self.thumbnail_loader.request(item.id, new_width, new_height)
+
+        return label
+
+    def get_pixmap(self, image, width, height):
+        pixmap = QtGui.QPixmap.fromImage(ImageQt.ImageQt(image))
+        return pixmap.scaled(
+            width,
+            height,
             QtCore.Qt.KeepAspectRatio,
             QtCore.Qt.SmoothTransformation,
         )
-        label = QtWidgets.QLabel()
-        label.setPixmap(pixmap)
-        label.setFixedSize(new_width, new_height)
-        label.setStyleSheet("background-color: #1C1D21;")
-        return label
+
+    def on_thumbnail_loaded(self, item_id, width, height, qimage):
+        labels = self.thumbnail_labels.pop((item_id, width, height), [])
+        if qimage.isNull():
+            return
+
+        pixmap = QtGui.QPixmap.fromImage(qimage)
+        for label in labels:
+            label.setPixmap(pixmap)
+            label.setStyleSheet("background-color: #1C1D21;")
+
+    def prefetch_pages(self):
+        # Warms the thumbnail cache for the pages either side of the current one
+        pages = (
+            self.current_page - self.page_increment_rate,
+            self.current_page + self.page_increment_rate,
+        )
+
+        for page in pages:
+            for r in range(
+                max(page, 0), min(page + self.items_per_window, self.max_page)
+            ):
+                for item_id in self.page_data[r][2]["ids"]:
+                    item = self.id_data[item_id]["item"]
+                    if item.filetype == int(FileType.Video) and not self.thumbnail_mode:
+                        continue
+
+                    new_width, new_height = self.get_new_size(item.width, item.height)
+                    if ThumbnailCache.peek(item.id, new_width, new_height) is None:
+                        self.thumbnail_loader.request(
+                            item.id, new_width, new_height, PREFETCH_PRIORITY
+                        )
 
     def get_ids_and_build_bins(self):
         tags = defaultdict(list)
@@ -319,8 +470,10 @@ class ViewApplication(QtWidgets.QMainWindow):
         if not self.orderby_usenull:
             tags[(self.orderby_metric, TagConditions.IsNotNull.value)].append("")
 
-        data = get_items_and_paths_from_tags(tags)
-        self.item_ids = list(data.keys())
+        # One query for the items and one per tag used, rather than several per item
+        objects = get_items_from_tags(tags)
+        items = {item.id: item for item in objects}
+        self.item_ids = list(items.keys())
         self.bins = defaultdict(list)
         ids = [item_id for item_id in self.item_ids]
 
@@ -328,30 +481,32 @@ class ViewApplication(QtWidgets.QMainWindow):
             if self.orderby_metric == "random":
                 random.shuffle(ids)
             else:
-                ids.sort(key=lambda x: get_tag(x, self.orderby_metric), reverse=True)
+                order_values = get_tag_values(objects, self.orderby_metric)
+                ids.sort(key=lambda x: sorted(order_values.get(x, [])), reverse=True)
+
+        if self.bin_group_metric != "":
+            group_values = get_tag_values(objects, self.bin_group_metric)
+
+        # Bins that can still take an item, in creation order. Every item is at
+        # least MIN_ITEM_WIDTH wide, so full bins are dropped rather than rescanned
+        open_bins = defaultdict(list)
 
         for item_id in ids:
-            item = Item.objects.filter(id=item_id).get()
+            item = items[item_id]
             item_type = int(item.filetype)
             new_width, new_height = self.get_new_size(item.width, item.height)
-            new_width = max(new_width, 108)
+            new_width = max(new_width, MIN_ITEM_WIDTH)
 
             if self.bin_group_metric != "":
-                tag_data = get_tags(item_id)
-                if self.bin_group_metric not in tag_data:
+                if item_id not in group_values:
                     continue
-                metric = tag_data[self.bin_group_metric][0]
+                metric = group_values[item_id][0]
             else:
                 metric = ""
 
             bin_placed = False
-            for bin_obj in self.bins[metric]:
+            for i, bin_obj in enumerate(open_bins[metric]):
                 if bin_obj["width"] + new_width <= self.page_width:
-                    if (
-                        self.items_per_bin > 0
-                        and len(bin_obj["ids"]) + 1 > self.items_per_bin
-                    ):
-                        continue
                     if self.max_bin_videos > 0 and not self.thumbnail_mode:
                         if (
                             item_type == int(FileType.Video)
@@ -362,6 +517,9 @@ class ViewApplication(QtWidgets.QMainWindow):
                     bin_obj["ids"].append(item_id)
                     bin_obj["video_count"] += item_type
                     bin_placed = True
+
+                    if self.is_bin_full(bin_obj):
+                        del open_bins[metric][i]
                     break
 
             if not bin_placed:
@@ -373,7 +531,11 @@ class ViewApplication(QtWidgets.QMainWindow):
                 }
                 self.bins[metric].append(bin_obj)
 
+                if not self.is_bin_full(bin_obj):
+                    open_bins[metric].append(bin_obj)
+
             self.id_data[item_id] = {
+                "item": item,
                 "width": new_width,
                 "height": new_height,
                 "metric": metric,
@@ -399,8 +561,15 @@ class ViewApplication(QtWidgets.QMainWindow):
         )
         self.current_page = max(0, self.current_page)
 
+    def is_bin_full(self, bin_obj):
+        if self.items_per_bin > 0 and len(bin_obj["ids"]) >= self.items_per_bin:
+            return True
+        return bin_obj["width"] + MIN_ITEM_WIDTH > self.page_width
+
     def load_items(self):
         self.clear_video_players()
+        self.thumbnail_loader.clear()
+        self.thumbnail_labels.clear()
         while self.items_scroll_layout.count():
             item = self.items_scroll_layout.takeAt(0)
             widget = item.widget()
@@ -459,7 +628,7 @@ class ViewApplication(QtWidgets.QMainWindow):
                 print_button.clicked.connect(
                     partial(
                         print,
-                        f"{item_id} {Item.objects.filter(id=item_id).get().label}",
+                        f"{item_id} {self.id_data[item_id]['item'].label}",
                     )
                 )
 
@@ -476,7 +645,7 @@ class ViewApplication(QtWidgets.QMainWindow):
                     btn.setStyleSheet("padding: 0; margin: 0;")
                     button_row.addWidget(btn)
 
-                item_type = Item.objects.filter(id=item_id).get().filetype
+                item_type = self.id_data[item_id]["item"].filetype
                 force_thumbnail = False
                 if (
                     item_type == int(FileType.Video)
@@ -487,7 +656,11 @@ class ViewApplication(QtWidgets.QMainWindow):
                 media = self.get_widget(item_id, force_thumbnail=force_thumbnail)
                 if item_type == int(FileType.Video) and not force_thumbnail:
                     videos_started += 1
-                if isinstance(media, QtWidgets.QLabel):
+                if item_type == int(FileType.Video) and not self.thumbnail_mode:
+                    media.mousePressEvent = lambda event, item_id=item_id, media=media: (
+                        self.focus_video(item_id, media)
+                    )
+                elif isinstance(media, QtWidgets.QLabel):
                     media.mousePressEvent = lambda event, item_id=item_id: self.open_id(
                         item_id
                     )
@@ -522,6 +695,7 @@ class ViewApplication(QtWidgets.QMainWindow):
             f"{self.current_page + 1 if self.max_page > 0 else 0} / "
             f"{self.max_page - self.items_per_window + 1 if self.max_page > 0 else 0}"
         )
+        self.prefetch_pages()
 
     def load_chosen_tags(self):
         while self.tag_scroll_layout.count():
@@ -1015,6 +1189,7 @@ class ViewApplication(QtWidgets.QMainWindow):
 
     def closeEvent(self, event):
         self.clear_video_players()
+        self.thumbnail_loader.shutdown()
         if not self.completed:
             self.window_closed_manually = True
         super().closeEvent(event)
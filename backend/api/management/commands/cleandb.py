@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from api.models import Item, FileState, Rules
+from api.models import Item, FileState, Rules, CompiledRules
 from api.utils.key_paths import ITEMS_PATH
 import os
 
@@ -37,5 +37,6 @@ def clean_db():
     for rule in Rules.objects.all():
         if rule.label not in distinct_labels:
             rule.delete()
+    CompiledRules.invalidate()
 
     return True
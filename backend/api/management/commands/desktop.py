@@ -5,6 +5,9 @@ from api.views_extension import (
     check_for_modify,
     check_for_unlabelled,
     check_for_clips,
+    convert_legacy_embeddings,
+    start_model_warmup,
+    EmbeddingWorker,
 )
 from api.desktop.crop_application import start_crop_application
 from api.desktop.label_application import start_label_application
@@ -25,16 +28,28 @@ from api.utils.overrides import SERVICE_REQUIRED_TAGS
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--warmup",
+            action="store_true",
+            help="Load the CLIP and bounding box models in the background at startup",
+        )
+
     def handle(self, **options):
-        desktop()
+        desktop(warmup=options["warmup"])
 
 
-def desktop():
+def desktop(warmup=False):
     live_mode = True
 
+    if warmup:
+        start_model_warmup()
+
+    convert_legacy_embeddings()
     preprocess_watchdog_listener()
 
     Thread(target=run_watchdog_listener, daemon=True).start()
+    Thread(target=EmbeddingWorker.run, daemon=True).start()
 
     command = ""
     while command != "exit":
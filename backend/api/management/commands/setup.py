@@ -2,6 +2,7 @@ from django.contrib.auth.models import User
 import sys
 from manage import main as manage_main
 from django.core.management.base import BaseCommand
+from api.views_extension import convert_legacy_embeddings, remove_duplicate_tags
 import hashlib
 
 
@@ -22,10 +23,15 @@ class Command(BaseCommand):
 
         manage_main()
 
+        # Must run before the unique constraint on Tags is migrated
+        remove_duplicate_tags()
+
         sys.argv = ["manage.py", "migrate"]
 
         manage_main()
 
+        convert_legacy_embeddings()
+
         username = input("Enter username: ")
         password = input("Enter password: ")
         password = hash_password(password.encode("utf-8"))
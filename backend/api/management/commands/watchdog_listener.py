@@ -12,7 +12,16 @@ from api.models import (
 )
 from api.utils.key_paths import MEDIA_PATH, READER_PATHS
 from threading import Lock
-from api.views_extension import edit_item, get_dimensions, upload_item, VideoRemover
+from api.views_extension import (
+    edit_item,
+    get_dimensions,
+    upload_item,
+    VideoRemover,
+    EmbeddingStore,
+    ThumbnailStore,
+    RenditionStore,
+    VideoPreviewStore,
+)
 from api.management.commands.cleandb import clean_db
 
 
@@ -163,7 +172,12 @@ class EventProcessor:
         item, _ = try_get_item(path)
         if item is not None:
             if not os.path.exists(item.getpath()):
+                item_id = item.id
                 item.delete()
+                EmbeddingStore.remove((item_id,))
+                ThumbnailStore.invalidate((item_id,))
+                RenditionStore.invalidate((item_id,))
+                VideoPreviewStore.invalidate((item_id,))
 
 
 class MyEventHandler(FileSystemEventHandler):
@@ -186,6 +200,10 @@ class MyEventHandler(FileSystemEventHandler):
             if not path or "." not in path:
                 continue
 
+            # Dropbox and thumbnail caches, as in read_directory
+            if ".cache" in path.replace("\\", "/").split("/"):
+                continue
+
             # Types are deleted, created, modified
             self.event_processor.add(
                 path, "deleted" if event.event_type == "deleted" else "created"
@@ -1,13 +1,24 @@
+from threading import Thread
+
 from django_extensions.management.commands.runserver_plus import (
     Command as RunserverPlusCommand,
 )
 from api.management.commands.watchdog_listener import preprocess_watchdog_listener
+from api.views_extension import EmbeddingWorker, start_model_warmup
 from api.utils.key_paths import READER_PATHS, CERT_PATH, KEY_FILE_PATH
 
 
 class Command(RunserverPlusCommand):
     started = False
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--warmup",
+            action="store_true",
+            help="Load the CLIP and bounding box models in the background at startup",
+        )
+
     def inner_run(self, *args, **options):
         args[0]["cert_path"] = CERT_PATH
         args[0]["key_file_path"] = KEY_FILE_PATH
@@ -16,9 +27,15 @@ class Command(RunserverPlusCommand):
         if not Command.started:
             Command.started = True
 
+            if args[0].get("warmup"):
+                start_model_warmup()
+
             # Does nothing if path does not exist
             preprocess_watchdog_listener(
                 READER_PATHS,
             )
 
+            # Re-embeds items edited through the api
+            Thread(target=EmbeddingWorker.run, daemon=True).start()
+
         return super().inner_run(*args, **options)
@@ -1,7 +1,14 @@
 from django.db import models
+from django.db.models import Count, Max
 from enum import IntEnum, Enum
 from api.utils.key_paths import MEDIA_PATH
 from pathlib import Path
+from threading import Lock
+import time
+
+RULES_REFRESH_INTERVAL = (
+    5  # Seconds between checks for rules changed by another process
+)
 
 
 class FileState(IntEnum):
@@ -33,7 +40,24 @@ class Item(models.Model):
     filetype = models.IntegerField()
     width = models.IntegerField()
     height = models.IntegerField()
-    embedding = models.TextField(null=True)
+    embedding = models.BinaryField(null=True)  # Raw float32 bytes
+    embedding_stale = models.BooleanField(
+        default=False
+    )  # Waiting on an EmbeddingJobs row
+    embedded_at = models.FloatField(null=True)  # Unix time the embedding was written
+
+    class Meta:
+        indexes = [
+            # The next item in a state, ordered by label then id
+            models.Index(fields=["state", "label", "id"], name="item_state_label_id"),
+            # Embeddings written by another process since the last check
+            models.Index(fields=["embedded_at"], name="item_embedded_at"),
+            models.Index(
+                fields=["embedding_stale"],
+                condition=models.Q(embedding_stale=True),
+                name="item_embedding_stale",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.label} {self.filetype} ({self.width}x{self.height})"
@@ -68,6 +92,27 @@ class Tags(models.Model):
     name = models.CharField(max_length=100)
     value = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [
+            # Tag searches, covering the item ids they return
+            models.Index(
+                fields=["name", "value", "item_id"], name="tags_name_value_item"
+            ),
+        ]
+        constraints = [
+            # Also indexes an item's tags by name
+            models.UniqueConstraint(
+                fields=["item_id", "name", "value"], name="tags_unique_item_name_value"
+            ),
+        ]
+
+
+# Items waiting to be re-embedded by the background embedding worker
+class EmbeddingJobs(models.Model):
+    item_id = models.ForeignKey(Item, on_delete=models.CASCADE)
+    claimed_by = models.CharField(max_length=64, null=True)  # Worker embedding it
+    claimed_at = models.FloatField(null=True)  # Unix time of the claim
+
 
 def print_labelplus():
     labelplus_value_set = set(
@@ -85,13 +130,72 @@ class Rules(models.Model):
     tag_name = models.CharField(max_length=100)
     tag_value = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["label"], name="rules_label"),
+        ]
+
+
+class CompiledRules:
+    """
+    Every rule compiled to label -> {tag_name: [tag_value]}, as applied to items. A
+    later rule for the same tag name wins. Rebuilt after add_rule and remove_rule,
+    and when another process (such as a shell) has changed the rules.
+    """
+
+    table = None
+    signature = None  # (count, max id) of the rules the table was built from
+    checked_at = 0.0
+
+    lock = Lock()
+
+    @classmethod
+    def get(cls, label):
+        return {
+            tag_name: list(tag_values)
+            for tag_name, tag_values in cls.get_table().get(label, {}).items()
+        }
+
+    @classmethod
+    def get_table(cls):
+        with cls.lock:
+            now = time.monotonic()
+            if cls.table is None or now - cls.checked_at > RULES_REFRESH_INTERVAL:
+                # Rule ids are never reused, so any add or remove changes this
+                signature = tuple(
+                    Rules.objects.aggregate(Count("id"), Max("id")).values()
+                )
+                if cls.table is None or signature != cls.signature:
+                    cls.table = cls._compile()
+                    cls.signature = signature
+                cls.checked_at = now
+
+            return cls.table
+
+    @classmethod
+    def _compile(cls):
+        table = {}
+        for label, tag_name, tag_value in Rules.objects.order_by("id").values_list(
+            "label", "tag_name", "tag_value"
+        ):
+            table.setdefault(label, {})[tag_name] = [tag_value]
+        return table
+
+    @classmethod
+    def invalidate(cls):
+        with cls.lock:
+            cls.table = None
+
 
 def print_methods():
     print("""
     print_rules(label=None, tag_name=None, tag_value=None, tag_first=True)
     print_missing_rules(tag_name)
-    add_rule(label, tag_name, tag_value)
     remove_rule(label, tag_name, tag_value)
+
+    api.views_extension
+    add_rule(label, tag_name, tag_value)
+    reapply_rules(labels=None)
     """)
 
 
@@ -113,48 +217,33 @@ def print_rules(label=None, tag_name=None, tag_value=None, tag_first=True):
 
 
 def print_missing_rules(tag_name):
-    labels = Item.objects.filter(
-        state__in=[
-            int(FileState.Complete),
-            int(FileState.NeedsTags),
-            int(FileState.NeedsClip),
-        ]
-    ).values_list("label", flat=True)
-    distinct_set = set()
-    distinct_labels = []
-    for label in reversed(labels):
-        if label not in distinct_set:
-            distinct_set.add(label)
-            distinct_labels.append(label)
-
-    for label in distinct_labels:
-        if len(Rules.objects.filter(label=label, tag_name=tag_name)) == 0:
-            print(label)
-
-
-def add_rule(label, tag_name, tag_value):
-    tag_name = tag_name.strip()
-    tag_value = tag_value.strip()
-
-    if (
-        len(Rules.objects.filter(label=label, tag_name=tag_name, tag_value=tag_value))
-        > 0
-    ):
-        return
-
-    Rules.objects.create(
-        label=label,
-        tag_name=tag_name,
-        tag_value=tag_value,
+    # Labels in use without a rule for tag_name, most recently used first
+    labels = (
+        Item.objects.filter(
+            state__in=[
+                int(FileState.Complete),
+                int(FileState.NeedsTags),
+                int(FileState.NeedsClip),
+            ]
+        )
+        .exclude(label__in=Rules.objects.filter(tag_name=tag_name).values("label"))
+        .values("label")
+        .annotate(last_id=Max("id"))
+        .order_by("-last_id")
+        .values_list("label", flat=True)
     )
 
+    for label in labels:
+        print(label)
+
 
 def remove_rule(label, tag_name, tag_value):
-    rules = Rules.objects.filter(label=label, tag_name=tag_name, tag_value=tag_value)
-    for rule in rules:
-        rule.delete()
+    removed, _ = Rules.objects.filter(
+        label=label, tag_name=tag_name, tag_value=tag_value
+    ).delete()
+    CompiledRules.invalidate()
 
-    return len(rules) > 0
+    return removed > 0
 
 
 def create_item(label: str, filetype: int, state: int, width: int, height: int) -> int:
@@ -169,6 +258,21 @@ def create_item(label: str, filetype: int, state: int, width: int, height: int)
     return item
 
 
+IMAGE_EXTENSIONS = ("png", "gif", "jpg", "jpeg", "webp")
+VIDEO_EXTENSIONS = ("mp4", "mov")
+
+
+def get_filetype(extension):
+    extension = extension.lower()
+
+    if extension in IMAGE_EXTENSIONS:
+        return int(FileType.Image)
+    elif extension in VIDEO_EXTENSIONS:
+        return int(FileType.Video)
+
+    raise Exception(f"Error {extension} not recogniseed")
+
+
 def get_file_properties(path):
     local_path = path[len(MEDIA_PATH) :].replace("\\", "/").split("/")
     if local_path[0] == "":
@@ -180,27 +284,7 @@ def get_file_properties(path):
         print(local_path)
         raise e
 
-    item_type = item_type.lower()
-
-    image_item_types = ("png", "gif", "jpg", "jpeg", "webp")
-    video_item_types = ("mp4", "mov")
-
-    item_type_map = {
-        image_item_types: int(FileType.Image),
-        video_item_types: int(FileType.Video),
-    }
-
-    new_item_type = None
-
-    for types in item_type_map:
-        if item_type in types:
-            new_item_type = item_type_map[types]
-            break
-
-    if new_item_type is None:
-        raise Exception(f"Error {item_type} not recogniseed")
-
-    item_type = new_item_type
+    item_type = get_filetype(item_type)
 
     category = local_path[0]
 
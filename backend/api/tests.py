@@ -1,25 +1,90 @@
+import base64
 import importlib
 import io
 import math
+import os
+import struct
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 import types
 from pathlib import Path
-from unittest.mock import patch
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from unittest import skipUnless
+from unittest.mock import MagicMock, patch
 
 import numpy as np
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from PIL import Image
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import AccessToken
 
 from api import models as api_models
 from api import views_extension
+from api.utils import ann_index, inference, uploads, video_previews, video_probe
 from api.views_extension import add_tags, crop_and_resize_from_view
 
 
+def patch_clip_model(embedding):
+    # Stands in for thumbnail decoding and the CLIP model, embedding every image as `embedding`
+    stack = ExitStack()
+    stack.enter_context(
+        patch.object(
+            views_extension.ClipModel,
+            "get_item_image",
+            return_value=Image.new("RGB", (1, 1)),
+        )
+    )
+    stack.enter_context(
+        patch.object(
+            views_extension.ClipModel,
+            "get_clip_image_embeddings",
+            side_effect=lambda images: np.tile(embedding, (len(images), 1)),
+        )
+    )
+    return stack
+
+
+def mp4_box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def build_mp4(width, height, rotation=0, mdat_size=16):
+    # A minimal MP4 with one video track, moov after mdat as most cameras write it
+    one = 1 << 16
+    matrix = {
+        0: (one, 0, 0, 0, one, 0, 0, 0, 1 << 30),
+        90: (0, one, 0, -one, 0, 0, 0, 0, 1 << 30),
+        180: (-one, 0, 0, 0, -one, 0, 0, 0, 1 << 30),
+    }[rotation]
+    tkhd = (
+        bytes(4 + 20 + 16)
+        + struct.pack(">9i", *matrix)
+        + struct.pack(">II", width << 16, height << 16)
+    )
+    hdlr = bytes(8) + b"vide" + bytes(13)
+    sample_entry = mp4_box(
+        b"avc1", bytes(24) + struct.pack(">HH", width, height) + bytes(50)
+    )
+    stsd = bytes(4) + struct.pack(">I", 1) + sample_entry
+    stbl = mp4_box(b"stbl", mp4_box(b"stsd", stsd))
+    mdia = mp4_box(b"mdia", mp4_box(b"hdlr", hdlr) + mp4_box(b"minf", stbl))
+    trak = mp4_box(b"trak", mp4_box(b"tkhd", tkhd) + mdia)
+    return (
+        mp4_box(b"ftyp", b"isom" + bytes(4) + b"isommp41")
+        + mp4_box(b"mdat", bytes(mdat_size))
+        + mp4_box(b"moov", trak)
+    )
+
+
 class ItemModelTests(TestCase):
     def setUp(self):
         super().setUp()
@@ -141,44 +206,50 @@ class RandomItemApiTests(TestCase):
         self.temp_dir = tempfile.TemporaryDirectory()
         self.addCleanup(self.temp_dir.cleanup)
 
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
+
+        views_extension.RandomSampler.invalidate()
+        self.addCleanup(views_extension.RandomSampler.invalidate)
+        views_extension.RandomQueues.clear()
+        self.addCleanup(views_extension.RandomQueues.clear)
+
     def _build_items(self, labels):
-        items = {}
-        for idx, label in enumerate(labels, start=1):
-            path = Path(self.temp_dir.name) / f"{idx}.png"
-            path.write_bytes(b"data")
-            items[idx] = {
-                "path": str(path),
-                "mime_type": "image/png",
-                "label": label,
-                "width": 1,
-                "height": 1,
-                "filetype": int(api_models.FileType.Image),
-            }
+        items = []
+        for label in labels:
+            item = api_models.Item.objects.create(
+                state=int(api_models.FileState.Complete),
+                label=label,
+                filetype=int(api_models.FileType.Image),
+                width=1,
+                height=1,
+            )
+            Path(item.getparent()).mkdir(parents=True, exist_ok=True)
+            Path(item.getpath()).write_bytes(b"data")
+            items.append(item)
         return items
 
-    def _post_random(self, method, items):
+    def _post_random(self, method, tags=()):
         captured = {}
+        get_weights = views_extension.RandomSampler.get_weights
 
-        def fake_get_items(tags):
-            captured["tags"] = tags
-            return items
-
-        def fake_choices(keys, weights=None, k=None):
-            captured["keys"] = keys
-            captured["weights"] = weights
-            return [keys[0]]
+        def fake_get_weights(candidates, method, strength):
+            captured["ids"] = list(candidates["ids"])
+            captured["weights"] = get_weights(candidates, method, strength)
+            return captured["weights"]
 
-        with (
-            patch(
-                "api.views.get_items_and_paths_from_tags", side_effect=fake_get_items
-            ),
-            patch("api.views.random.choices", side_effect=fake_choices),
+        with patch.object(
+            views_extension.RandomSampler, "get_weights", side_effect=fake_get_weights
         ):
             response = self.client.post(
                 "/api/download",
                 {
                     "type": "image",
-                    "tags": [{"name": "random", "condition": "is", "value": method}],
+                    "tags": [
+                        {"name": "random", "condition": "is", "value": method},
+                        *tags,
+                    ],
                 },
                 format="json",
             )
@@ -188,20 +259,19 @@ class RandomItemApiTests(TestCase):
 
     def test_random_item_recent_weights(self):
         items = self._build_items(["cat", "dog", "bird"])
-        response, captured = self._post_random("recent", items)
+        response, captured = self._post_random("recent")
 
         self.assertEqual(response.status_code, 200)
-        expected = [
-            1 / (3 * len(captured["keys"]) / 2 - i)
-            for i in range(len(captured["keys"]))
-        ]
+        self.assertEqual(captured["ids"], [item.id for item in items])
+        expected = [1 / (3 * len(items) / 2 - i) for i in range(len(items))]
         for actual, target in zip(captured["weights"], expected):
             self.assertTrue(math.isclose(actual, target, rel_tol=1e-6))
-        self.assertTrue(all(key[0] != "random" for key in captured["tags"]))
+        self.assertIn(int(response["X-Item-ID"]), captured["ids"])
+        self.assertEqual(response["X-Media-URL"], f"/api/media/{response['X-Item-ID']}")
 
     def test_random_item_sparse_weights(self):
-        items = self._build_items(["cat", "cat", "dog"])
-        response, captured = self._post_random("sparse", items)
+        self._build_items(["cat", "cat", "dog"])
+        response, captured = self._post_random("sparse")
 
         self.assertEqual(response.status_code, 200)
         expected = [1 / math.sqrt(2), 1 / math.sqrt(2), 1.0]
@@ -209,14 +279,184 @@ class RandomItemApiTests(TestCase):
             self.assertTrue(math.isclose(actual, target, rel_tol=1e-6))
 
     def test_random_item_dense_weights(self):
-        items = self._build_items(["cat", "cat", "dog"])
-        response, captured = self._post_random("dense", items)
+        self._build_items(["cat", "cat", "dog"])
+        response, captured = self._post_random("dense")
 
         self.assertEqual(response.status_code, 200)
         expected = [math.sqrt(2), math.sqrt(2), 1.0]
         for actual, target in zip(captured["weights"], expected):
             self.assertTrue(math.isclose(actual, target, rel_tol=1e-6))
 
+    def test_random_item_without_matches(self):
+        self._build_items(["cat"])
+        response, _ = self._post_random(
+            "uniform", [{"name": "label", "condition": "is", "value": "dog"}]
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_matches_are_cached_until_a_write(self):
+        cat, dog = self._build_items(["cat", "dog"])
+        is_ = api_models.TagConditions.Is.value
+        tags = {("label", is_): ["dog", "cow"], ("filetype", is_): ["image"]}
+        sampler = views_extension.RandomSampler
+
+        self.assertEqual(sampler.choose(tags)["id"], dog.id)
+
+        # Only the chosen item is loaded, the same query in another order is cached
+        with self.assertNumQueries(1):
+            item_info = sampler.choose(
+                {("filetype", is_): ["image"], ("label", is_): ["cow", "dog"]}
+            )
+        self.assertEqual(item_info["path"], dog.getpath())
+
+        add_tags({cat.id: {"labelplus": ["dog"]}})
+        chosen = {sampler.choose(tags)["id"] for _ in range(50)}
+        self.assertEqual(chosen, {cat.id, dog.id})
+
+    def test_draw_follows_cumulative_weights(self):
+        items = self._build_items(["cat", "cat", "dog"])
+        sampler = views_extension.RandomSampler
+        candidates = sampler.get_candidates({})
+
+        # Each item's share of the total weight is the range of draws that pick it
+        with patch.object(sampler, "rng") as rng:
+            rng.random.return_value = 0.5
+            self.assertEqual(sampler.draw(candidates, "dense"), items[1].id)
+            rng.random.return_value = 0.99
+            self.assertEqual(sampler.draw(candidates, "dense"), items[2].id)
+            rng.random.return_value = 0.0
+            self.assertEqual(sampler.draw(candidates, "recent"), items[0].id)
+
+    def _post_random_batch(self, count, tags=()):
+        return self.client.post(
+            "/api/download/batch",
+            {"type": "image", "count": count, "tags": list(tags)},
+            format="json",
+        )
+
+    def test_random_batch_draws_without_replacement(self):
+        items = self._build_items(["cat", "cat", "dog", "owl"])
+
+        with patch.object(
+            views_extension.RandomSampler,
+            "get_candidates",
+            wraps=views_extension.RandomSampler.get_candidates,
+        ) as get_candidates:
+            first = self._post_random_batch(3).json()["items"]
+            second = self._post_random_batch(1).json()["items"]
+
+        # The queue drawn for the first call serves the second
+        get_candidates.assert_called_once()
+        self.assertEqual(
+            sorted(item["id"] for item in first + second),
+            [item.id for item in items],
+        )
+        self.assertEqual(first[0]["url"], f"/api/media/{first[0]['id']}")
+        self.assertEqual(first[0]["media_type"], "image")
+
+    def test_random_batch_drops_queue_on_delete(self):
+        items = self._build_items(["cat", "dog", "owl"])
+        first = self._post_random_batch(1).json()["items"]
+
+        remaining = [item.id for item in items if item.id != first[0]["id"]]
+        views_extension.delete_items((remaining[0],))
+
+        second = self._post_random_batch(3).json()["items"]
+        self.assertEqual(
+            sorted(item["id"] for item in second),
+            sorted([first[0]["id"], remaining[1]]),
+        )
+
+    def test_random_batch_rejects_bad_count(self):
+        self._build_items(["cat"])
+        self.assertEqual(self._post_random_batch(0).status_code, 400)
+        self.assertEqual(self._post_random_batch(1000).status_code, 400)
+
+    def test_item_media_serves_file(self):
+        (item,) = self._build_items(["cat"])
+
+        response = self.client.get(f"/api/media/{item.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"data")
+        self.assertEqual(response["X-Label"], "cat")
+        response.close()
+
+        self.assertEqual(self.client.get(f"/api/media/{item.id + 1}").status_code, 404)
+
+    def test_item_media_serves_byte_ranges(self):
+        (item,) = self._build_items(["cat"])
+        Path(item.getpath()).write_bytes(b"0123456789")
+        url = f"/api/media/{item.id}"
+
+        for header, content, content_range in (
+            ("bytes=2-5", b"2345", "bytes 2-5/10"),
+            ("bytes=7-", b"789", "bytes 7-9/10"),
+            ("bytes=-3", b"789", "bytes 7-9/10"),
+            ("bytes=8-100", b"89", "bytes 8-9/10"),
+        ):
+            response = self.client.get(url, headers={"Range": header})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b"".join(response.streaming_content), content)
+            self.assertEqual(response["Content-Range"], content_range)
+            self.assertEqual(response["Content-Length"], str(len(content)))
+            self.assertEqual(response["X-Label"], "cat")
+            response.close()
+
+        response = self.client.get(url, headers={"Range": "bytes=10-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+        # Several ranges, or a last byte before the first, get the whole file
+        for header in ("bytes=0-1,4-5", "bytes=5-3"):
+            response = self.client.get(url, headers={"Range": header})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+            response.close()
+
+    def test_item_media_missing_file(self):
+        (item,) = self._build_items(["cat"])
+        os.remove(item.getpath())
+
+        self.assertEqual(self.client.get(f"/api/media/{item.id}").status_code, 404)
+        self.assertEqual(
+            self.client.get(f"/api/media/{item.id}?width=300").status_code, 404
+        )
+
+    def test_item_media_conditional_requests(self):
+        (item,) = self._build_items(["cat"])
+        url = f"/api/media/{item.id}"
+
+        response = self.client.get(url)
+        response.close()
+        etag = response["ETag"]
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.client.get(
+            url, headers={"If-Modified-Since": response["Last-Modified"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # A range for another version of the file is answered with the whole file
+        response = self.client.get(
+            url, headers={"Range": "bytes=0-1", "If-Range": '"stale"'}
+        )
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        # A replaced file has a new validator
+        modified_time = os.path.getmtime(item.getpath()) + 10
+        os.utime(item.getpath(), (modified_time, modified_time))
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        response.close()
+
 
 class ProcessImagesTests(TestCase):
     def _import_process_images(self):
@@ -236,6 +476,20 @@ class ProcessImagesTests(TestCase):
                 del sys.modules["api.utils.process_images"]
             return importlib.import_module("api.utils.process_images")
 
+    def test_bounding_box_model_loaded_on_first_use(self):
+        process_images = self._import_process_images()
+        self.assertIsNone(process_images.bounding_box_model)
+
+        dummy_ultralytics = types.ModuleType("ultralytics")
+        dummy_ultralytics.YOLO = MagicMock()
+
+        with patch.dict(sys.modules, {"ultralytics": dummy_ultralytics}):
+            first = process_images.get_bounding_box_model()
+            second = process_images.get_bounding_box_model()
+
+        self.assertIs(first, second)
+        dummy_ultralytics.YOLO.assert_called_once_with("yolov8n.pt", verbose=False)
+
     def test_crop_and_resize_white_canvas(self):
         process_images = self._import_process_images()
         image = Image.new("RGB", (200, 100), color="white")
@@ -323,6 +577,38 @@ class ProcessImagesTests(TestCase):
         self.assertLess(x1, x2)
         self.assertLess(y1, y2)
 
+    def test_clean_corners_matches_pixel_walk_bounds(self):
+        # Bounds produced by the previous getpixel implementation
+        process_images = self._import_process_images()
+        rng = np.random.default_rng(3)
+        blocks = rng.integers(0, 4, (8, 10, 3)) * 60
+        pixels = np.kron(blocks, np.ones((8, 8, 1))).astype(int)
+        pixels = np.clip(pixels + rng.integers(-3, 4, pixels.shape), 0, 255)
+        image = Image.fromarray(pixels.astype(np.uint8))
+
+        boxes = [
+            (10, 50, 5, 40),
+            (0, 80, 0, 64),
+            (33.5, 70.2, 20.7, 60.1),
+            (60, 30, 50, 10),
+        ]
+        expected = {
+            "RGB": [(7, 52, 2, 42), (2, 77, 2, 61), (30, 72, 17, 61), (27, 62, 7, 52)],
+            "L": [(7, 52, 2, 42), (2, 77, 2, 61), (30, 72, 18, 61), (27, 62, 7, 52)],
+        }
+
+        for mode, bounds in expected.items():
+            converted = image.convert(mode)
+            self.assertEqual(
+                [process_images.clean_corners(converted, box) for box in boxes], bounds
+            )
+
+        square = Image.new("RGB", (60, 50), color="white")
+        square.paste((0, 0, 0), (20, 10, 40, 30))
+        self.assertEqual(
+            process_images.clean_corners(square, (0, 60, 0, 50)), (22, 37, 47, 50)
+        )
+
     def test_crop_and_resize_clips_and_orders(self):
         process_images = self._import_process_images()
         image = Image.new("RGB", (100, 50), color="white")
@@ -447,6 +733,18 @@ class ProcessImagesTests(TestCase):
 
         self.assertEqual(clean_corners.call_count, 2)
 
+    def test_get_bounds_batch_runs_one_forward_pass(self):
+        process_images = self._import_process_images()
+        images = [Image.new("RGB", (10, 10), color="white") for _ in range(3)]
+
+        fake_model = MagicMock(return_value=[[], [], []])
+        with patch.object(process_images, "bounding_box_model", fake_model):
+            bounds = process_images.get_bounds_batch(images)
+
+        fake_model.assert_called_once_with(images, verbose=False)
+        self.assertEqual(bounds, [[], [], []])
+        self.assertEqual(process_images.get_bounds_batch([]), [])
+
     def test_clean_corners_grayscale_input(self):
         process_images = self._import_process_images()
         image = Image.new("L", (20, 10), color=128)
@@ -478,6 +776,26 @@ class ViewsExtensionTests(TestCase):
         api_models.MEDIA_PATH = self.temp_dir.name
         self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
 
+    def test_import_does_not_load_models(self):
+        # Run in a fresh interpreter, as other tests may already have imported torch
+        code = (
+            "import sys, django; django.setup(); import api.views_extension; "
+            "print(sorted({'torch', 'transformers', 'ultralytics'} & set(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=Path(__file__).resolve().parent.parent,
+            env={
+                **os.environ,
+                "DJANGO_SETTINGS_MODULE": "filestoragebackend.settings",
+            },
+            capture_output=True,
+            text=True,
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+
     def test_crop_and_resize_from_view_rotates(self):
         item = api_models.Item.objects.create(
             state=int(api_models.FileState.NeedsCrop),
@@ -537,6 +855,202 @@ class ViewsExtensionTests(TestCase):
         resized = Image.open(resized_path)
         self.assertEqual(resized.size, (1600, views_extension.MEDIA_HEIGHT))
 
+    def test_get_tag_values_matches_get_tags(self):
+        items = [
+            api_models.Item.objects.create(
+                state=int(api_models.FileState.Complete),
+                label=label,
+                filetype=int(filetype),
+                width=10,
+                height=10,
+            )
+            for label, filetype in (
+                ("cat", api_models.FileType.Image),
+                ("dog", api_models.FileType.Video),
+                ("cat", api_models.FileType.Image),
+            )
+        ]
+        api_models.Tags.objects.create(item_id=items[0], name="colour", value="red")
+        api_models.Tags.objects.create(item_id=items[0], name="colour", value="blue")
+        api_models.Tags.objects.create(item_id=items[1], name="colour", value="green")
+
+        objects = views_extension.get_items_from_tags(
+            {("label", api_models.TagConditions.Is.value): ["cat", "dog"]}
+        )
+
+        with self.assertNumQueries(1):
+            colours = views_extension.get_tag_values(objects, "colour")
+        with self.assertNumQueries(1):
+            filetypes = views_extension.get_tag_values(objects, "filetype")
+
+        for item in items:
+            tags = views_extension.get_tags(item.id)
+            self.assertEqual(colours.get(item.id), tags.get("colour"))
+            self.assertEqual(filetypes[item.id], tags["filetype"])
+
+    def test_tag_search_uses_one_statement_without_duplicates(self):
+        def create(label, *tags):
+            item = api_models.Item.objects.create(
+                state=int(api_models.FileState.Complete),
+                label=label,
+                filetype=int(api_models.FileType.Image),
+                width=10,
+                height=10,
+            )
+            for name, value in tags:
+                api_models.Tags.objects.create(item_id=item, name=name, value=value)
+            return item.id
+
+        cat = create("cat", ("colour", "red"), ("colour", "blue"))
+        dog = create("dog", ("labelplus", "cat"), ("labelplus", "kitten"))
+        fox = create("fox", ("colour", "reddish"), ("size", "small"))
+        owl = create("owl")
+
+        def search(tags):
+            with self.assertNumQueries(1):
+                return list(views_extension.get_items_and_paths_from_tags(tags))
+
+        Is = api_models.TagConditions.Is.value
+        IsNot = api_models.TagConditions.IsNot.value
+        Contains = api_models.TagConditions.Contains.value
+        DoesNotContain = api_models.TagConditions.DoesNotContain.value
+        IsNotNull = api_models.TagConditions.IsNotNull.value
+
+        self.assertEqual(search({("label", Is): ["cat", "kitten"]}), [cat, dog])
+        self.assertEqual(search({("colour", Is): ["red", "blue"]}), [cat])
+        self.assertEqual(search({("colour", IsNot): ["red"]}), [dog, fox, owl])
+        self.assertEqual(search({("colour", Contains): ["red"]}), [cat, fox])
+        self.assertEqual(search({("colour", DoesNotContain): ["red"]}), [dog, owl])
+        self.assertEqual(search({("size", IsNotNull): [""]}), [cat, dog, owl])
+        self.assertEqual(
+            search({("colour", Contains): ["red"], ("size", Is): ["small"]}), [fox]
+        )
+
+        objects = views_extension.get_items_from_tags(
+            {("label", Is): ["cat"], ("colour", IsNot): ["green"]}
+        )
+        self.assertNotIn("JOIN", str(objects.query))
+        self.assertNotIn("embedding", str(objects.query))
+
+    def test_add_tags_skips_existing_tags(self):
+        from django.db import IntegrityError, transaction
+
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.Complete),
+            label="cat",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+        )
+        add_tags({item.id: {"colour": ["red", "blue"]}})
+
+        add_tags({item.id: {"colour": ["red", "blue", "green", "green"]}})
+
+        self.assertEqual(
+            sorted(views_extension.get_tags(item.id)["colour"]),
+            ["blue", "green", "red"],
+        )
+        self.assertEqual(views_extension.remove_duplicate_tags(), 0)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            api_models.Tags.objects.create(item_id=item, name="colour", value="red")
+
+    def test_bulk_add_and_remove_tags(self):
+        items = [
+            api_models.Item.objects.create(
+                state=int(api_models.FileState.Complete),
+                label="cat",
+                filetype=int(api_models.FileType.Image),
+                width=10,
+                height=10,
+            )
+            for _ in range(50)
+        ]
+        add_tags({items[0].id: {"colour": ["red"]}})
+
+        # Checking the items, reading existing tags and one insert, in a savepoint
+        with self.assertNumQueries(5):
+            add_tags({item.id: {"colour": ["red", "blue"]} for item in items})
+
+        self.assertEqual(api_models.Tags.objects.count(), 100)
+
+        with self.assertNumQueries(3):
+            views_extension.remove_tags(
+                {
+                    **{item.id: {"colour": ["red"]} for item in items[:40]},
+                    items[40].id: {"colour": ["red", "blue"]},
+                }
+            )
+
+        self.assertEqual(
+            [views_extension.get_tags(item.id).get("colour") for item in items[38:42]],
+            [["blue"], ["blue"], None, ["red", "blue"]],
+        )
+
+        with self.assertRaises(api_models.Item.DoesNotExist):
+            add_tags({items[-1].id + 1: {"colour": ["red"]}})
+        with self.assertRaises(Exception):
+            views_extension.remove_tags({items[0].id: {"label": ["cat"]}})
+
+    def test_query_debug_prints_plan(self):
+        output = io.StringIO()
+        with (
+            patch.object(views_extension, "QUERY_DEBUG", True),
+            patch("sys.stdout", output),
+        ):
+            views_extension.get_items_from_tags(
+                {("colour", api_models.TagConditions.Is.value): ["red"]}
+            )
+
+        self.assertIn("SQL: SELECT", output.getvalue())
+        self.assertIn("Query plan:", output.getvalue())
+
+    def test_embedding_bytes_round_trip(self):
+        embedding = np.linspace(-1, 1, 16)
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsTags),
+            label="cat",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+            embedding=views_extension.ClipModel.np_to_bytes(embedding),
+        )
+
+        item.refresh_from_db()
+        decoded = views_extension.ClipModel.bytes_to_np(item.embedding)
+
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, embedding, rtol=1e-6)
+
+    def test_convert_legacy_embeddings(self):
+        from django.db import connection
+
+        embedding = np.linspace(-1, 1, 16)
+        buffer = io.BytesIO()
+        np.save(buffer, embedding, allow_pickle=False)
+        legacy_string = base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsTags),
+            label="cat",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE api_item SET embedding = %s WHERE id = %s",
+                [legacy_string, item.id],
+            )
+
+        self.assertEqual(views_extension.convert_legacy_embeddings(), 1)
+        self.assertEqual(views_extension.convert_legacy_embeddings(), 0)
+
+        item.refresh_from_db()
+        np.testing.assert_allclose(
+            views_extension.ClipModel.bytes_to_np(item.embedding), embedding, rtol=1e-6
+        )
+
 
 class DesktopPipelineTests(TestCase):
     def setUp(self):
@@ -611,9 +1125,7 @@ class DesktopPipelineTests(TestCase):
 
         add_tags({item.id: {"color": ["red"], "source": ["internal"]}})
 
-        with patch.object(
-            views_extension.ClipModel, "process_item", return_value=np.zeros(8)
-        ):
+        with patch_clip_model(np.zeros(8)):
             views_extension.ClipModel.process_unclipped_items()
 
         views_extension.edit_item(
@@ -635,6 +1147,64 @@ class DesktopPipelineTests(TestCase):
         )
         self.assertIn("dog", labelplus_values)
 
+    def test_edit_items_labels_many_items_at_once(self):
+        items = [
+            self._create_image_item(
+                api_models.FileState.NeedsLabel, size=(80, views_extension.MEDIA_HEIGHT)
+            )
+            for _ in range(20)
+        ]
+        self.addCleanup(api_models.CompiledRules.invalidate)
+        views_extension.add_rule("cat", "pet", "yes")
+        views_extension.add_rule("dog", "pet", "no")
+
+        with patch.object(
+            views_extension,
+            "apply_rules",
+            side_effect=AssertionError("Rules applied per item"),
+        ):
+            views_extension.edit_items(
+                [item.id for item in items],
+                new_label="cat",
+                new_state=int(api_models.FileState.NeedsClip),
+            )
+
+        for item in items:
+            old_path = item.getpath()
+            item.refresh_from_db()
+            self.assertEqual(item.state, int(api_models.FileState.NeedsClip))
+            self.assertEqual(item.label, "cat")
+            self.assertFalse(os.path.exists(old_path))
+            self.assertTrue(os.path.exists(item.getpath()))
+
+            tags = views_extension.get_tags(item.id)
+            self.assertEqual(tags["labelplus"], ["cat"])
+            self.assertEqual(tags["pet"], ["yes"])
+
+        # Queries don't grow with the number of items
+        more_items = [
+            self._create_image_item(
+                api_models.FileState.NeedsLabel, size=(80, views_extension.MEDIA_HEIGHT)
+            )
+            for _ in range(40)
+        ]
+        with CaptureQueriesContext(connection) as few:
+            views_extension.edit_items(
+                [item.id for item in items],
+                new_label="dog",
+                new_state=int(api_models.FileState.NeedsClip),
+            )
+        with CaptureQueriesContext(connection) as many:
+            views_extension.edit_items(
+                [item.id for item in more_items],
+                new_label="dog",
+                new_state=int(api_models.FileState.NeedsClip),
+            )
+        self.assertEqual(len(few), len(many))
+
+        with self.assertRaises(api_models.Item.DoesNotExist):
+            views_extension.edit_items([items[0].id, more_items[-1].id + 1])
+
     def test_pipeline_video_skips_crop_modify(self):
         item = self._create_video_item(api_models.FileState.NeedsLabel)
 
@@ -645,9 +1215,7 @@ class DesktopPipelineTests(TestCase):
         )
         add_tags({item.id: {"source": ["internal"]}})
 
-        with patch.object(
-            views_extension.ClipModel, "process_item", return_value=np.zeros(8)
-        ):
+        with patch_clip_model(np.zeros(8)):
             views_extension.ClipModel.process_unclipped_items()
 
         views_extension.edit_item(
@@ -691,7 +1259,7 @@ class DesktopPipelineTests(TestCase):
         self.assertEqual(image.size[1], views_extension.MEDIA_HEIGHT)
 
 
-class CleanDbTests(TestCase):
+class EmbeddingStoreTests(TestCase):
     def setUp(self):
         super().setUp()
         self.temp_dir = tempfile.TemporaryDirectory()
@@ -700,91 +1268,1495 @@ class CleanDbTests(TestCase):
         api_models.MEDIA_PATH = self.temp_dir.name
         self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
 
-        self.items_path = Path(self.temp_dir.name) / "items"
-        self.items_path.mkdir(parents=True, exist_ok=True)
-
-    def test_clean_db_removes_orphans_and_unused_folders(self):
-        from api.management.commands import cleandb
+        views_extension.EmbeddingStore.clear()
+        self.addCleanup(views_extension.EmbeddingStore.clear)
 
-        item_keep = api_models.Item.objects.create(
-            state=int(api_models.FileState.Complete),
-            label="keep",
-            filetype=int(api_models.FileType.Image),
+    def _create_item(self, label, embedding, filetype=api_models.FileType.Image):
+        embedding = np.asarray(embedding, dtype=float)
+        embedding = embedding / np.linalg.norm(embedding)
+        return api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsTags),
+            label=label,
+            filetype=int(filetype),
             width=10,
             height=10,
+            embedding=views_extension.ClipModel.np_to_bytes(embedding),
         )
-        item_missing = api_models.Item.objects.create(
-            state=int(api_models.FileState.Complete),
-            label="missing",
-            filetype=int(api_models.FileType.Image),
-            width=10,
-            height=10,
+
+    def test_nearest_item_filters_label_and_filetype(self):
+        item = self._create_item("cat", [1, 0, 0])
+        close = self._create_item("cat", [1, 0.1, 0])
+        self._create_item("cat", [0, 1, 0])
+        self._create_item("dog", [1, 0, 0])
+        self._create_item("cat", [1, 0, 0], filetype=api_models.FileType.Video)
+
+        nearest = views_extension.get_nearest_item(
+            item.id, "cat", int(api_models.FileType.Image)
         )
 
-        keep_path = Path(item_keep.getpath())
-        keep_path.parent.mkdir(parents=True, exist_ok=True)
-        keep_path.write_bytes(b"")
+        self.assertEqual(nearest, close.id)
 
-        unused_folder = self.items_path / "unused"
-        unused_folder.mkdir(parents=True, exist_ok=True)
+    def test_nearest_item_none_available(self):
+        item = self._create_item("cat", [1, 0, 0])
 
-        api_models.Rules.objects.create(
-            label="keep",
-            tag_name="source",
-            tag_value="external",
+        nearest = views_extension.get_nearest_item(
+            item.id, "cat", int(api_models.FileType.Image)
         )
-        api_models.Rules.objects.create(
-            label="missing",
-            tag_name="source",
-            tag_value="external",
+
+        self.assertEqual(nearest, -1)
+
+    def test_store_updates_incrementally(self):
+        item = self._create_item("cat", [1, 0, 0])
+        far = self._create_item("cat", [0, 1, 0])
+        views_extension.EmbeddingStore.ensure_loaded()
+
+        new_item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsClip),
+            label="cat",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
         )
+        with patch_clip_model(np.array([1, 0, 0], dtype=float)):
+            views_extension.ClipModel.process_unclipped_items()
 
-        with patch.object(cleandb, "ITEMS_PATH", str(self.items_path)):
-            result = cleandb.clean_db()
+        self.assertEqual(
+            views_extension.get_nearest_item(
+                item.id, "cat", int(api_models.FileType.Image)
+            ),
+            new_item.id,
+        )
 
-        self.assertTrue(result)
-        self.assertFalse(api_models.Item.objects.filter(id=item_missing.id).exists())
-        self.assertTrue(api_models.Item.objects.filter(id=item_keep.id).exists())
-        self.assertFalse(unused_folder.exists())
-        self.assertFalse(api_models.Rules.objects.filter(label="missing").exists())
-        self.assertTrue(api_models.Rules.objects.filter(label="keep").exists())
+        views_extension.delete_items([new_item.id])
 
+        self.assertEqual(
+            views_extension.get_nearest_item(
+                item.id, "cat", int(api_models.FileType.Image)
+            ),
+            far.id,
+        )
 
-class WatchdogListenerTests(TestCase):
-    def _import_watchdog_listener(self):
-        dummy_views_extension = types.ModuleType("api.views_extension")
+    def test_process_unclipped_items_in_batches(self):
+        items = [
+            api_models.Item.objects.create(
+                state=int(api_models.FileState.NeedsClip),
+                label="cat",
+                filetype=int(api_models.FileType.Image),
+                width=10,
+                height=10,
+            )
+            for _ in range(5)
+        ]
 
-        def edit_item(*args, **kwargs):
-            return None
+        with patch_clip_model(np.ones(4)):
+            embed = views_extension.ClipModel.get_clip_image_embeddings
+            views_extension.ClipModel.process_unclipped_items(batch_size=2)
+            batch_sizes = [len(call.args[0]) for call in embed.call_args_list]
 
-        def get_dimensions(*args, **kwargs):
-            return (10, 10)
+        self.assertEqual(batch_sizes, [2, 2, 1])
+        for item in items:
+            item.refresh_from_db()
+            np.testing.assert_array_equal(
+                views_extension.ClipModel.bytes_to_np(item.embedding), np.ones(4)
+            )
 
-        def upload_item(*args, **kwargs):
-            return None
+    def test_comparison_items_puts_same_label_first(self):
+        item = self._create_item("cat", [1, 0, 0])
+        same_label = self._create_item("cat", [0, 1, 0])
+        closest = self._create_item("dog", [1, 0.05, 0])
+        middle = self._create_item("dog", [1, 0.5, 0])
+        self._create_item("dog", [0, 0, 1])
 
-        class VideoRemover:
-            @staticmethod
-            def process():
-                return None
+        comparisons = views_extension.get_comparison_items(item.id, num_items=3)
 
-        dummy_views_extension.edit_item = edit_item
-        dummy_views_extension.get_dimensions = get_dimensions
-        dummy_views_extension.upload_item = upload_item
-        dummy_views_extension.VideoRemover = VideoRemover
+        self.assertEqual(comparisons, [same_label.id, closest.id, middle.id])
 
-        with patch.dict(sys.modules, {"api.views_extension": dummy_views_extension}):
-            if "api.management.commands.watchdog_listener" in sys.modules:
-                del sys.modules["api.management.commands.watchdog_listener"]
-            return importlib.import_module("api.management.commands.watchdog_listener")
 
-    def test_event_processor_ignores_banned_filetypes(self):
-        watchdog_listener = self._import_watchdog_listener()
-        processor = watchdog_listener.EventProcessor()
+class ThumbnailStoreTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
 
-        processor.add("C:/tmp/file.TMP", "created")
-        self.assertEqual(processor.process_times, [])
-        self.assertEqual(processor.file_assignments, {})
+        thumbnails_path = patch.object(
+            views_extension.ThumbnailStore,
+            "path",
+            f"{self.temp_dir.name}/.cache/thumbnails",
+        )
+        thumbnails_path.start()
+        self.addCleanup(thumbnails_path.stop)
+
+    def _create_image_item(self, size=(600, 300)):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsLabel),
+            label="",
+            filetype=int(api_models.FileType.Image),
+            width=size[0],
+            height=size[1],
+        )
+        path = Path(item.getpath())
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", size, color="red").save(path)
+        return item
+
+    def _thumbnail_files(self):
+        return sorted(
+            path.parent.name
+            for path in Path(views_extension.ThumbnailStore.path).glob("*/*")
+        )
+
+    def test_thumbnail_decoded_once_across_sizes(self):
+        item = self._create_image_item()
+
+        with patch.object(
+            views_extension,
+            "get_thumbnail_source",
+            wraps=views_extension.get_thumbnail_source,
+        ) as get_thumbnail_source:
+            first = views_extension.get_thumbnail(item.id)
+            second = views_extension.get_thumbnail(item.id, 300, 300)
+            third = views_extension.get_thumbnail(item.id)
+
+        get_thumbnail_source.assert_called_once()
+        self.assertEqual(first.size, (200, 100))
+        self.assertEqual(second.size, (300, 150))
+        self.assertEqual(third.size, (200, 100))
+        self.assertEqual(self._thumbnail_files(), ["200", "400", "800"])
+
+    def test_modified_file_is_regenerated(self):
+        item = self._create_image_item()
+        views_extension.get_thumbnail(item.id)
+
+        Image.new("RGB", (600, 300), color="blue").save(item.getpath())
+        modified_time = os.path.getmtime(item.getpath()) + 10
+        os.utime(item.getpath(), (modified_time, modified_time))
+
+        thumbnail = views_extension.get_thumbnail(item.id)
+
+        self.assertGreater(thumbnail.getpixel((0, 0))[2], 200)
+        self.assertEqual(len(self._thumbnail_files()), 3)
+
+    def test_concurrent_generation_of_one_item(self):
+        item = self._create_image_item()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(
+                pool.map(
+                    lambda _: views_extension.ThumbnailStore.generate(item), range(8)
+                )
+            )
+
+        self.assertTrue(all(sorted(images) == [200, 400, 800] for images in results))
+        self.assertEqual(self._thumbnail_files(), ["200", "400", "800"])
+
+    def test_large_request_decodes_original(self):
+        item = self._create_image_item(size=(1200, 1000))
+
+        thumbnail = views_extension.get_thumbnail(item.id, 1000, 1000)
+
+        self.assertEqual(thumbnail.size, (1000, 833))
+        self.assertEqual(self._thumbnail_files(), [])
+
+    def test_upload_pregenerates_and_delete_invalidates(self):
+        source = Path(self.temp_dir.name) / "upload.png"
+        Image.new("RGB", (40, 20), color="green").save(source)
+
+        views_extension.upload_image(str(source))
+        self.assertEqual(self._thumbnail_files(), ["200", "400", "800"])
+
+        item = api_models.Item.objects.get()
+        views_extension.delete_items((item.id,))
+        self.assertEqual(self._thumbnail_files(), [])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RenditionStoreTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        user = User.objects.create_user(username="tester", password="pass")
+        self.client.cookies["access_token"] = str(AccessToken.for_user(user))
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
+
+        renditions_path = patch.object(
+            views_extension.RenditionStore,
+            "path",
+            f"{self.temp_dir.name}/.cache/renditions",
+        )
+        renditions_path.start()
+        self.addCleanup(renditions_path.stop)
+        self.addCleanup(views_extension.RenditionStore.shutdown)
+
+    def _create_image_item(self, size=(1600, 800)):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.Complete),
+            label="cat",
+            filetype=int(api_models.FileType.Image),
+            width=size[0],
+            height=size[1],
+        )
+        path = Path(item.getpath())
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGBA", size, color=(255, 0, 0, 128)).save(path)
+        return item
+
+    def _rendition_files(self):
+        return sorted(
+            f"{path.parent.name}/{path.suffix}"
+            for path in Path(views_extension.RenditionStore.path).glob("*/*")
+        )
+
+    def _get(self, url):
+        response = self.client.get(url)
+        content = b"".join(response.streaming_content)
+        response.close()
+        return response, content
+
+    def test_rendition_is_encoded_once_and_cached(self):
+        item = self._create_image_item()
+        url = f"/api/media/{item.id}?width=400&image_format=webp"
+
+        response, content = self._get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        with Image.open(io.BytesIO(content)) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (480, 240)))
+            self.assertEqual(image.mode, "RGBA")
+        self.assertEqual(self._rendition_files(), ["480/.webp"])
+
+        with patch.object(views_extension.RenditionStore, "get_pool") as get_pool:
+            response, cached = self._get(url)
+        get_pool.assert_not_called()
+        self.assertEqual(cached, content)
+
+        # The original is what it was, and wider requests stop at the largest width
+        response, content = self._get(f"/api/media/{item.id}")
+        self.assertEqual(response["Content-Type"], "image/png")
+        with Image.open(io.BytesIO(content)) as image:
+            self.assertEqual(image.size, (1600, 800))
+        response, content = self._get(
+            f"/api/media/{item.id}?width=4000&image_format=jpeg"
+        )
+        with Image.open(io.BytesIO(content)) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (1080, 540)))
+
+        views_extension.delete_items((item.id,))
+        self.assertEqual(self._rendition_files(), [])
+
+    def test_slow_encode_serves_the_original(self):
+        item = self._create_image_item()
+        release = threading.Event()
+        encode_rendition = views_extension.encode_rendition
+
+        def slow_encode(*args):
+            release.wait(5)
+            encode_rendition(*args)
+
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+
+        with (
+            patch.object(views_extension, "RENDITION_TIMEOUT", 0.05),
+            patch.object(views_extension, "encode_rendition", slow_encode),
+            patch.object(views_extension.RenditionStore, "get_pool", return_value=pool),
+        ):
+            response, _ = self._get(f"/api/media/{item.id}?width=300")
+            self.assertEqual(response["Content-Type"], "image/png")
+
+            # The encode carries on for the next request
+            ((future, _),) = views_extension.RenditionStore.pending.values()
+            release.set()
+            future.result()
+            response, content = self._get(f"/api/media/{item.id}?width=300")
+
+        self.assertEqual(response["Content-Type"], "image/webp")
+        with Image.open(io.BytesIO(content)) as image:
+            self.assertEqual(image.size, (320, 160))
+
+    def test_broken_pool_is_replaced(self):
+        item = self._create_image_item()
+        item_info = views_extension.get_item_data(item.id)
+
+        class BrokenPool:
+            def submit(self, *args):
+                future = Future()
+                future.set_exception(BrokenProcessPool("A worker died"))
+                return future
+
+        views_extension.RenditionStore.pool = BrokenPool()
+        self.assertIsNone(views_extension.RenditionStore.get(item_info, 300, "webp"))
+        self.assertIsNone(views_extension.RenditionStore.pool)
+
+        # The next request starts a new pool
+        path = views_extension.RenditionStore.get(item_info, 300, "webp")
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (320, 160))
+
+    def test_bad_rendition_requests(self):
+        item = self._create_image_item()
+
+        self.assertEqual(
+            self.client.get(f"/api/media/{item.id}?image_format=gif").status_code, 400
+        )
+        self.assertEqual(
+            self.client.get(f"/api/media/{item.id}?width=-5").status_code, 400
+        )
+        self.assertEqual(
+            self.client.get(f"/api/media/{item.id}?width=wide").status_code, 400
+        )
+
+    def test_random_item_urls_ask_for_renditions(self):
+        item = self._create_image_item()
+        views_extension.RandomSampler.invalidate()
+        self.addCleanup(views_extension.RandomSampler.invalidate)
+        views_extension.RandomQueues.clear()
+        self.addCleanup(views_extension.RandomQueues.clear)
+
+        response = self.client.post(
+            "/api/download",
+            {"tags": [], "type": "image", "width": 300, "image_format": "webp"},
+            format="json",
+        )
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(
+            response["X-Media-URL"], f"/api/media/{item.id}?width=300&image_format=webp"
+        )
+        response.close()
+
+        response = self.client.post(
+            "/api/download/batch",
+            {"tags": [], "type": "image", "count": 1, "width": 720},
+            format="json",
+        )
+        self.assertEqual(
+            response.json()["items"][0]["url"], f"/api/media/{item.id}?width=720"
+        )
+
+        # Rejected up front, like the single item endpoint
+        for rendition in ({"width": "abc"}, {"width": 0}, {"image_format": "gif"}):
+            for endpoint in ("/api/download", "/api/download/batch"):
+                response = self.client.post(
+                    endpoint,
+                    {"tags": [], "type": "image", "count": 1, **rendition},
+                    format="json",
+                )
+                self.assertEqual(response.status_code, 400, (endpoint, rendition))
+
+
+class VideoPreviewStoreTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
+
+        for store, name in (
+            (views_extension.VideoPreviewStore, "previews"),
+            (views_extension.ThumbnailStore, "thumbnails"),
+        ):
+            store_path = patch.object(
+                store, "path", f"{self.temp_dir.name}/.cache/{name}"
+            )
+            store_path.start()
+            self.addCleanup(store_path.stop)
+
+    def _build_video(self, path, seconds=2):
+        import imageio_ffmpeg
+
+        subprocess.run(
+            [
+                imageio_ffmpeg.get_ffmpeg_exe(),
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "lavfi",
+                "-i",
+                "testsrc=size=640x360:rate=30",
+                "-t",
+                str(seconds),
+                "-pix_fmt",
+                "yuv420p",
+                str(path),
+            ],
+            check=True,
+        )
+
+    def _preview_files(self):
+        return sorted(
+            f"{path.parent.name}{path.suffix}"
+            for path in Path(views_extension.VideoPreviewStore.path).glob("*/*")
+        )
+
+    def test_upload_makes_poster_and_preview(self):
+        source = Path(self.temp_dir.name) / "clip.mp4"
+        self._build_video(source)
+
+        views_extension.upload_video(str(source))
+        item = api_models.Item.objects.get()
+        self.assertEqual(self._preview_files(), ["clip.webp", "poster.jpg"])
+
+        with Image.open(views_extension.VideoPreviewStore.get_clip(item)) as preview:
+            self.assertEqual(preview.size, (320, 180))
+            self.assertGreater(preview.n_frames, 1)
+
+        # Thumbnails come from the poster without opening the video
+        with patch.object(views_extension, "VideoFileClip", side_effect=AssertionError):
+            thumbnail = views_extension.get_thumbnail(item.id)
+        self.assertEqual(thumbnail.size, (200, 113))
+
+        views_extension.delete_items((item.id,))
+        self.assertEqual(self._preview_files(), [])
+
+    def test_poster_is_made_for_videos_without_one(self):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsLabel),
+            label="",
+            filetype=int(api_models.FileType.Video),
+            width=640,
+            height=360,
+        )
+        Path(item.getparent()).mkdir(parents=True, exist_ok=True)
+        # Shorter than the poster time, so the first frame is used
+        self._build_video(item.getpath(), seconds=0.2)
+
+        self.assertIsNone(views_extension.VideoPreviewStore.get_clip(item))
+        with Image.open(views_extension.VideoPreviewStore.get_poster(item)) as poster:
+            self.assertEqual(poster.size, (640, 360))
+        self.assertEqual(self._preview_files(), ["poster.jpg"])
+
+    def test_concurrent_posters_of_one_item(self):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsLabel),
+            label="",
+            filetype=int(api_models.FileType.Video),
+            width=640,
+            height=360,
+        )
+        Path(item.getparent()).mkdir(parents=True, exist_ok=True)
+        self._build_video(item.getpath(), seconds=1)
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            paths = set(
+                pool.map(
+                    lambda _: views_extension.VideoPreviewStore.get_poster(item),
+                    range(12),
+                )
+            )
+
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(self._preview_files(), ["poster.jpg"])
+
+        # Threads extracting the same poster each write their own temporary file
+        poster_path = views_extension.VideoPreviewStore.get_path(item, "poster")
+        os.remove(poster_path)
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            list(
+                pool.map(
+                    lambda _: video_previews.extract_poster(
+                        item.getpath(), poster_path
+                    ),
+                    range(12),
+                )
+            )
+        self.assertEqual(self._preview_files(), ["poster.jpg"])
+
+    def test_failed_preview_is_reported(self):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsLabel),
+            label="",
+            filetype=int(api_models.FileType.Video),
+            width=640,
+            height=360,
+        )
+        Path(item.getparent()).mkdir(parents=True, exist_ok=True)
+        Path(item.getpath()).write_bytes(b"not a video")
+
+        with patch("builtins.print") as printed:
+            views_extension.VideoPreviewStore.pregenerate(item)
+
+        printed.assert_called_once()
+        self.assertEqual(self._preview_files(), [])
+
+
+class ThumbnailCacheTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        views_extension.ThumbnailCache.clear()
+        self.addCleanup(views_extension.ThumbnailCache.clear)
+
+        # Every thumbnail is a 10x10 RGB image, 300 bytes
+        get_thumbnail = patch.object(
+            views_extension,
+            "get_thumbnail",
+            side_effect=lambda item_id, width, height: Image.new("RGB", (10, 10)),
+        )
+        self.get_thumbnail = get_thumbnail.start()
+        self.addCleanup(get_thumbnail.stop)
+
+    def test_lru_eviction_by_bytes(self):
+        with patch.object(views_extension.ThumbnailCache, "max_bytes", 900):
+            views_extension.ThumbnailCache.get(1)
+            views_extension.ThumbnailCache.get(2)
+            views_extension.ThumbnailCache.get(3)
+            views_extension.ThumbnailCache.get(1)  # 1 is now the most recently used
+            views_extension.ThumbnailCache.get(4)  # Evicts 2
+
+        self.assertEqual(
+            list(views_extension.ThumbnailCache.cache),
+            [(3, 200, 200), (1, 200, 200), (4, 200, 200)],
+        )
+
+        stats = views_extension.ThumbnailCache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 4)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["bytes"], 900)
+
+    def test_sizes_are_cached_separately(self):
+        first = views_extension.ThumbnailCache.get(1, 100, 100)
+        second = views_extension.ThumbnailCache.get(1, 300, 300)
+
+        self.assertIsNot(first, second)
+        self.assertIs(views_extension.ThumbnailCache.get(1, 100, 100), first)
+        self.assertEqual(self.get_thumbnail.call_count, 2)
+
+    def test_edit_and_delete_invalidate(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", old_media_path)
+
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsLabel),
+            label="",
+            filetype=int(api_models.FileType.Video),
+            width=10,
+            height=10,
+        )
+        views_extension.ThumbnailCache.get(item.id)
+        views_extension.ThumbnailCache.get(item.id, 50, 50)
+        views_extension.ThumbnailCache.get(item.id + 1)
+
+        views_extension.edit_item(item_id=item.id, new_width=20)
+        self.assertEqual(
+            list(views_extension.ThumbnailCache.cache), [(item.id + 1, 200, 200)]
+        )
+
+        views_extension.ThumbnailCache.get(item.id)
+        views_extension.delete_items((item.id,))
+        self.assertEqual(
+            list(views_extension.ThumbnailCache.cache), [(item.id + 1, 200, 200)]
+        )
+        self.assertEqual(views_extension.ThumbnailCache.stats()["bytes"], 300)
+
+
+class RulesTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        api_models.CompiledRules.invalidate()
+        self.addCleanup(api_models.CompiledRules.invalidate)
+
+    def _create_item(self, label, state=api_models.FileState.Complete):
+        return api_models.Item.objects.create(
+            state=int(state),
+            label=label,
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+        )
+
+    def test_add_rule_tags_existing_items(self):
+        cat = self._create_item("cat")
+        dog = self._create_item("dog")
+
+        views_extension.add_rule("cat", "pet", "yes")
+
+        self.assertEqual(views_extension.get_tags(cat.id)["pet"], ["yes"])
+        self.assertNotIn("pet", views_extension.get_tags(dog.id))
+
+        # The compiled table is reused rather than queried per item
+        with self.assertNumQueries(0):
+            self.assertEqual(api_models.CompiledRules.get("cat"), {"pet": ["yes"]})
+
+        self.assertTrue(api_models.remove_rule("cat", "pet", "yes"))
+        self.assertEqual(api_models.CompiledRules.get("cat"), {})
+
+    def test_reapply_rules_adds_missing_tags_once(self):
+        items = [self._create_item(label) for label in ("cat", "cat", "dog", "")]
+        api_models.Rules.objects.create(label="cat", tag_name="pet", tag_value="yes")
+        api_models.Rules.objects.create(label="cat", tag_name="size", tag_value="small")
+        api_models.Rules.objects.create(label="dog", tag_name="pet", tag_value="yes")
+        api_models.Tags.objects.create(item_id=items[0], name="pet", value="yes")
+
+        # Rules written directly are picked up once the table is refreshed
+        with patch.object(api_models, "RULES_REFRESH_INTERVAL", -1):
+            self.assertEqual(views_extension.reapply_rules(), 4)
+        self.assertEqual(views_extension.reapply_rules(), 0)
+
+        self.assertEqual(
+            views_extension.get_tags(items[1].id),
+            {
+                "label": ["cat"],
+                "filetype": ["image"],
+                "pet": ["yes"],
+                "size": ["small"],
+            },
+        )
+        self.assertEqual(
+            views_extension.get_tags(items[3].id).keys(), {"label", "filetype"}
+        )
+
+    def test_rules_go_through_tag_override_and_checks(self):
+        item = self._create_item("cat")
+
+        def add_tag_override(id_to_tag_dictionary):
+            return {
+                item_id: {name: [value.upper() for value in values]}
+                for item_id, tags in id_to_tag_dictionary.items()
+                for name, values in tags.items()
+            }
+
+        with (
+            patch.object(views_extension, "add_tag_override", add_tag_override),
+            patch.object(views_extension.RandomSampler, "invalidate") as invalidate,
+        ):
+            views_extension.add_rule("cat", "pet", "yes")
+
+        self.assertEqual(views_extension.get_tags(item.id)["pet"], ["YES"])
+        invalidate.assert_called_once()
+
+        with self.assertRaises(Exception):
+            views_extension.add_rule("cat", "state", "complete")
+        self.assertFalse(api_models.Rules.objects.filter(tag_name="state").exists())
+
+        # Rules written directly still can't add forbidden tags
+        api_models.Rules.objects.create(label="cat", tag_name="label", tag_value="dog")
+        api_models.CompiledRules.invalidate()
+        with self.assertRaises(Exception):
+            views_extension.reapply_rules()
+        self.assertEqual(views_extension.get_tags(item.id)["label"], ["cat"])
+
+    def test_print_missing_rules_is_one_query(self):
+        self._create_item("cat")
+        self._create_item("dog")
+        self._create_item("owl")
+        self._create_item("cat")
+        self._create_item("fox", state=api_models.FileState.NeedsLabel)
+        api_models.Rules.objects.create(label="owl", tag_name="pet", tag_value="no")
+
+        output = io.StringIO()
+        with self.assertNumQueries(1), patch("sys.stdout", output):
+            api_models.print_missing_rules("pet")
+
+        self.assertEqual(output.getvalue().split(), ["cat", "dog"])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class UploadTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        user = User.objects.create_user(username="tester", password="pass")
+        token = AccessToken.for_user(user)
+        self.client.cookies["access_token"] = str(token)
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
+
+        self.uploads_path = f"{self.temp_dir.name}/.cache/uploads"
+        for patcher in (
+            patch.object(uploads, "UPLOADS_PATH", self.uploads_path),
+            patch.object(uploads.ResumableUploads, "path", self.uploads_path),
+            patch.object(views_extension.ThumbnailStore, "pregenerate"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _upload(self, field, name, content, content_type):
+        return self.client.post(
+            "/api/upload",
+            {field: SimpleUploadedFile(name, content, content_type=content_type)},
+            format="multipart",
+        )
+
+    def test_png_upload_is_moved_into_place(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (30, 20), color="white").save(buffer, format="PNG")
+
+        with patch.object(Image.Image, "save") as save:
+            response = self._upload(
+                "image", "white.png", buffer.getvalue(), "image/png"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        save.assert_not_called()
+
+        item = api_models.Item.objects.get()
+        self.assertEqual((item.width, item.height), (30, 20))
+        self.assertEqual(Path(item.getpath()).read_bytes(), buffer.getvalue())
+        self.assertEqual(os.listdir(self.uploads_path), [])
+        self.assertEqual(os.stat(item.getpath()).st_mode & 0o777, 0o644)
+
+    def test_jpeg_upload_is_stored_as_png(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (30, 20), color="white").save(buffer, format="JPEG")
+
+        response = self._upload("image", "white.jpg", buffer.getvalue(), "image/jpeg")
+
+        self.assertEqual(response.status_code, 200)
+        item = api_models.Item.objects.get()
+        with Image.open(item.getpath()) as image:
+            self.assertEqual((image.format, image.size), ("PNG", (30, 20)))
+        self.assertEqual(os.listdir(self.uploads_path), [])
+
+    def test_video_upload_reads_dimensions_from_headers(self):
+        content = build_mp4(64, 48, rotation=90, mdat_size=4096)
+
+        with patch.object(views_extension, "VideoFileClip", side_effect=AssertionError):
+            response = self._upload("video", "clip.mp4", content, "video/mp4")
+
+        self.assertEqual(response.status_code, 200)
+        item = api_models.Item.objects.get()
+        self.assertEqual((item.width, item.height), (48, 64))
+        self.assertEqual(Path(item.getpath()).read_bytes(), content)
+        self.assertEqual(os.listdir(self.uploads_path), [])
+
+    def test_batch_upload_returns_a_result_per_file(self):
+        png, jpeg = io.BytesIO(), io.BytesIO()
+        Image.new("RGB", (30, 20), color="white").save(png, format="PNG")
+        Image.new("RGB", (40, 10), color="white").save(jpeg, format="JPEG")
+
+        response = self.client.post(
+            "/api/upload/batch",
+            {
+                "files": [
+                    SimpleUploadedFile("a.png", png.getvalue()),
+                    SimpleUploadedFile("notes.txt", b"text"),
+                    SimpleUploadedFile("b.jpg", jpeg.getvalue()),
+                    SimpleUploadedFile("c.mp4", build_mp4(64, 48)),
+                ]
+            },
+            format="multipart",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(
+            [result["name"] for result in results],
+            ["a.png", "notes.txt", "b.jpg", "c.mp4"],
+        )
+        self.assertIn("error", results[1])
+
+        items = api_models.Item.objects.in_bulk(
+            [results[0]["id"], results[2]["id"], results[3]["id"]]
+        )
+        self.assertEqual(
+            [
+                (item.filetype, item.state, item.width, item.height)
+                for item in items.values()
+            ],
+            [
+                (
+                    int(api_models.FileType.Image),
+                    int(api_models.FileState.NeedsCrop),
+                    30,
+                    20,
+                ),
+                (
+                    int(api_models.FileType.Image),
+                    int(api_models.FileState.NeedsCrop),
+                    40,
+                    10,
+                ),
+                (
+                    int(api_models.FileType.Video),
+                    int(api_models.FileState.NeedsLabel),
+                    64,
+                    48,
+                ),
+            ],
+        )
+        for item in items.values():
+            self.assertTrue(os.path.exists(item.getpath()))
+        self.assertEqual(os.listdir(self.uploads_path), [])
+
+    def test_batch_upload_removes_items_that_could_not_be_placed(self):
+        with patch.object(
+            views_extension, "place_upload", side_effect=OSError("disk full")
+        ):
+            response = self.client.post(
+                "/api/upload/batch",
+                {"files": [SimpleUploadedFile("clip.mp4", build_mp4(64, 48))]},
+                format="multipart",
+            )
+
+        self.assertEqual(
+            response.json()["results"], [{"name": "clip.mp4", "error": "disk full"}]
+        )
+        self.assertFalse(api_models.Item.objects.exists())
+
+    def test_resumable_upload_continues_after_dropped_connection(self):
+        content = build_mp4(64, 48, mdat_size=1000)
+        response = self.client.post(
+            "/api/upload/resumable",
+            {"name": "clip.mp4", "size": len(content)},
+            format="json",
+        )
+        upload_id = response.json()["upload_id"]
+        url = f"/api/upload/resumable/{upload_id}"
+
+        def put(offset, data):
+            return self.client.put(
+                url,
+                data,
+                content_type="application/offset+octet-stream",
+                headers={"Upload-Offset": str(offset)},
+            )
+
+        self.assertEqual(put(0, content[:500]).json(), {"offset": 500})
+
+        # A retry of a piece that already arrived is refused with the offset to resume from
+        response = put(0, content[:500])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["offset"], 500)
+        self.assertEqual(self.client.get(url).json()["offset"], 500)
+
+        response = put(500, content[500:])
+        self.assertEqual(response.status_code, 200)
+        item = api_models.Item.objects.get(id=response.json()["result"]["id"])
+        self.assertEqual((item.width, item.height), (64, 48))
+        self.assertEqual(Path(item.getpath()).read_bytes(), content)
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(os.listdir(self.uploads_path), [])
+
+        # A retried final piece finds the upload already ingested
+        self.assertEqual(put(len(content), b"").status_code, 404)
+        self.assertEqual(api_models.Item.objects.count(), 1)
+
+    def test_resumable_upload_completes_once(self):
+        upload_id = uploads.ResumableUploads.create("clip.mp4", 4)
+        uploads.ResumableUploads.append(upload_id, 0, io.BytesIO(b"da"))
+
+        def append():
+            try:
+                return uploads.ResumableUploads.append(upload_id, 2, io.BytesIO(b"ta"))
+            except KeyError:
+                return None
+
+        # Two copies of the final piece queue on the upload's lock
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            with uploads.ResumableUploads.upload_locks[upload_id]:
+                futures = [pool.submit(append) for _ in range(2)]
+            results = [future.result() for future in futures]
+
+        (offset, path), missing = sorted(results, key=lambda result: result is None)
+        self.assertIsNone(missing)
+        self.assertEqual(offset, 4)
+        self.assertEqual(Path(path).read_bytes(), b"data")
+
+    def test_resumable_upload_rejects_data_past_its_size(self):
+        upload_id = uploads.ResumableUploads.create("clip.mp4", 4)
+
+        with self.assertRaises(ValueError):
+            uploads.ResumableUploads.append(upload_id, 0, io.BytesIO(b"too long"))
+        self.assertEqual(uploads.ResumableUploads.get(upload_id)["offset"], 4)
+
+        with self.assertRaises(KeyError):
+            uploads.ResumableUploads.get("../clip")
+
+    def test_probe_mp4_dimensions(self):
+        path = Path(self.temp_dir.name) / "clip.mp4"
+        for rotation, expected in ((0, (64, 48)), (90, (48, 64)), (180, (64, 48))):
+            path.write_bytes(build_mp4(64, 48, rotation=rotation))
+            self.assertEqual(video_probe.probe_mp4_dimensions(str(path)), expected)
+
+        # Not an ISO base media file, left to moviepy
+        path.write_bytes(b"\x1aE\xdf\xa3" + bytes(60))
+        self.assertIsNone(video_probe.probe_mp4_dimensions(str(path)))
+
+
+class CropPrefetcherTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
+
+        views_extension.CropPrefetcher.clear()
+        self.addCleanup(views_extension.CropPrefetcher.clear)
+        self.addCleanup(
+            setattr, views_extension.CropPrefetcher, "crop_max_height", None
+        )
+        views_extension.CropPrefetcher.crop_max_height = 50
+
+    def _create_crop_item(self):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsCrop),
+            label="",
+            filetype=int(api_models.FileType.Image),
+            width=80,
+            height=40,
+        )
+        path = Path(item.getpath())
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (80, 40), color="white").save(path)
+        return item
+
+    def test_fill_batches_bounds_and_serves_next_item(self):
+        items = [self._create_crop_item() for _ in range(5)]
+
+        def fake_bounds(images):
+            return [[(1, 2, 3, 4)] for _ in images]
+
+        with (
+            patch.object(views_extension, "CROP_BATCH_SIZE", 2),
+            patch.object(
+                views_extension, "get_bounds_batch", side_effect=fake_bounds
+            ) as get_bounds_batch,
+        ):
+            views_extension.CropPrefetcher.fill()
+
+        self.assertEqual(
+            [len(call.args[0]) for call in get_bounds_batch.call_args_list], [2, 2, 1]
+        )
+        self.assertEqual(
+            set(views_extension.CropPrefetcher.prefetched), {item.id for item in items}
+        )
+
+        with patch.object(
+            views_extension, "get_crop_image_and_bounds"
+        ) as get_crop_image_and_bounds:
+            image, bounds, item_id = views_extension.get_next_crop_item(50)
+
+        get_crop_image_and_bounds.assert_not_called()
+        self.assertEqual(item_id, items[0].id)
+        self.assertEqual(bounds, [(1, 2, 3, 4)])
+        self.assertEqual(image.height, 25)
+        self.assertNotIn(items[0].id, views_extension.CropPrefetcher.prefetched)
+
+    def test_changed_file_is_recomputed(self):
+        item = self._create_crop_item()
+
+        with patch.object(
+            views_extension, "get_bounds_batch", return_value=[[(1, 2, 3, 4)]]
+        ):
+            views_extension.CropPrefetcher.fill()
+
+        modified_time = os.path.getmtime(item.getpath())
+        os.utime(item.getpath(), (modified_time + 10, modified_time + 10))
+
+        with patch.object(
+            views_extension,
+            "get_crop_image_and_bounds",
+            return_value=(Image.new("RGB", (10, 5)), []),
+        ) as get_crop_image_and_bounds:
+            _, bounds, _ = views_extension.get_next_crop_item(50)
+
+        get_crop_image_and_bounds.assert_called_once()
+        self.assertEqual(bounds, [])
+
+    def test_fill_skips_current_item(self):
+        first = self._create_crop_item()
+        second = self._create_crop_item()
+        views_extension.CropPrefetcher.take(first.id, first.getpath(), 50)
+
+        with patch.object(
+            views_extension, "get_bounds_batch", return_value=[[]]
+        ) as get_bounds_batch:
+            views_extension.CropPrefetcher.fill()
+
+        get_bounds_batch.assert_called_once()
+        self.assertEqual(list(views_extension.CropPrefetcher.prefetched), [second.id])
+
+
+class EmbeddingWorkerTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
+
+        views_extension.EmbeddingStore.clear()
+        self.addCleanup(views_extension.EmbeddingStore.clear)
+
+    def test_edit_item_queues_reembedding(self):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsTags),
+            label="cat",
+            filetype=int(api_models.FileType.Video),
+            width=10,
+            height=10,
+            embedding=views_extension.ClipModel.np_to_bytes(np.zeros(4)),
+        )
+
+        with patch.object(views_extension.ClipModel, "process_item") as process_item:
+            views_extension.edit_item(item_id=item.id, new_width=20, new_height=20)
+
+        process_item.assert_not_called()
+        item.refresh_from_db()
+        self.assertTrue(item.embedding_stale)
+        self.assertEqual(api_models.EmbeddingJobs.objects.count(), 1)
+
+        with patch_clip_model(np.ones(4)):
+            self.assertEqual(views_extension.EmbeddingWorker.process(), 1)
+
+        item.refresh_from_db()
+        self.assertFalse(item.embedding_stale)
+        self.assertEqual(api_models.EmbeddingJobs.objects.count(), 0)
+        np.testing.assert_array_equal(
+            views_extension.ClipModel.bytes_to_np(item.embedding), np.ones(4)
+        )
+
+    def test_failed_item_stays_stale(self):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsTags),
+            label="cat",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+            embedding=views_extension.ClipModel.np_to_bytes(np.zeros(4)),
+        )
+        views_extension.EmbeddingWorker.enqueue((item.id,))
+
+        # No file on disk, so loading the image fails
+        views_extension.EmbeddingWorker.drain()
+
+        item.refresh_from_db()
+        self.assertTrue(item.embedding_stale)
+        self.assertEqual(api_models.EmbeddingJobs.objects.count(), 0)
+
+    def test_stale_items_are_skipped_by_similarity_queries(self):
+        items = [
+            api_models.Item.objects.create(
+                state=int(api_models.FileState.NeedsTags),
+                label="cat",
+                filetype=int(api_models.FileType.Image),
+                width=10,
+                height=10,
+                embedding=views_extension.ClipModel.np_to_bytes(np.ones(4)),
+            )
+            for _ in range(2)
+        ]
+        store = views_extension.EmbeddingStore
+
+        views_extension.EmbeddingWorker.enqueue((items[0].id,))
+        self.assertEqual(store.get_ids().tolist(), [items[1].id])
+        self.assertEqual([i for i, _ in store.nearest(np.ones(4), k=2)], [items[1].id])
+
+        # Loaded from the database, the flag is read back
+        store.clear()
+        self.assertEqual(store.get_ids().tolist(), [items[1].id])
+
+        with patch_clip_model(np.ones(4)):
+            views_extension.EmbeddingWorker.drain()
+
+        self.assertEqual(
+            sorted(store.get_ids().tolist()), sorted(item.id for item in items)
+        )
+
+    def test_jobs_claimed_by_another_worker_are_skipped(self):
+        item = api_models.Item.objects.create(
+            state=int(api_models.FileState.NeedsTags),
+            label="cat",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+            embedding=views_extension.ClipModel.np_to_bytes(np.zeros(4)),
+        )
+        views_extension.EmbeddingWorker.enqueue((item.id,))
+        api_models.EmbeddingJobs.objects.update(
+            claimed_by="other", claimed_at=time.time()
+        )
+
+        with patch_clip_model(np.ones(4)):
+            self.assertEqual(views_extension.EmbeddingWorker.process(), 0)
+
+            # Claims left by a worker that died are taken over
+            api_models.EmbeddingJobs.objects.update(
+                claimed_at=time.time() - views_extension.EMBEDDING_CLAIM_TIMEOUT - 1
+            )
+            self.assertEqual(views_extension.EmbeddingWorker.process(), 1)
+
+        item.refresh_from_db()
+        self.assertFalse(item.embedding_stale)
+        self.assertEqual(api_models.EmbeddingJobs.objects.count(), 0)
+
+    def test_store_reads_changes_made_by_another_process(self):
+        items = [
+            api_models.Item.objects.create(
+                state=int(api_models.FileState.NeedsTags),
+                label="cat",
+                filetype=int(api_models.FileType.Image),
+                width=10,
+                height=10,
+                embedding=views_extension.ClipModel.np_to_bytes(np.zeros(4)),
+            )
+            for _ in range(2)
+        ]
+        store = views_extension.EmbeddingStore
+        views_extension.EmbeddingWorker.enqueue((items[0].id,))
+        self.assertEqual(store.get_ids().tolist(), [items[1].id])
+
+        # Another process drains the job, and queues one of its own
+        api_models.EmbeddingJobs.objects.all().delete()
+        api_models.Item.objects.filter(id=items[0].id).update(
+            embedding=views_extension.ClipModel.np_to_bytes(np.ones(4)),
+            embedded_at=time.time(),
+            embedding_stale=False,
+        )
+        api_models.Item.objects.filter(id=items[1].id).update(embedding_stale=True)
+
+        store.refresh(force=True)
+
+        self.assertEqual(store.get_ids().tolist(), [items[0].id])
+        np.testing.assert_array_equal(store.get_embedding(items[0].id), np.ones(4))
+
+
+class AnnIndexTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = str(Path(self.temp_dir.name) / "database.ivf.npz")
+
+        views_extension.EmbeddingStore.clear()
+        self.addCleanup(views_extension.EmbeddingStore.clear)
+
+    def _clustered_vectors(self, n_clusters=8, per_cluster=50, dimension=16):
+        rng = np.random.default_rng(0)
+        centres = rng.normal(size=(n_clusters, dimension))
+        vectors = np.repeat(centres, per_cluster, axis=0)
+        vectors += 0.05 * rng.normal(size=vectors.shape)
+        return ann_index.normalise(vectors).astype(np.float32)
+
+    def test_probe_finds_query_list(self):
+        vectors = self._clustered_vectors()
+        index = ann_index.IVFIndex.train(vectors, n_lists=8)
+        lists = index.assign(vectors)
+
+        self.assertEqual(len(lists), len(vectors))
+        for row in (0, 120, 399):
+            self.assertIn(lists[row], index.probe(vectors[row], n_probe=1))
+
+    def test_save_and_load_round_trip(self):
+        vectors = self._clustered_vectors()
+        index = ann_index.IVFIndex.train(vectors, n_lists=8)
+        ids = np.arange(len(vectors))
+        index.save(self.index_path, ids, index.assign(vectors))
+
+        loaded_index, loaded_ids, loaded_lists = ann_index.IVFIndex.load(
+            self.index_path
+        )
+
+        np.testing.assert_array_equal(loaded_index.centroids, index.centroids)
+        np.testing.assert_array_equal(loaded_ids, ids)
+        np.testing.assert_array_equal(loaded_lists, index.assign(vectors))
+        self.assertIsNone(ann_index.IVFIndex.load(self.index_path + ".missing"))
+
+    def test_store_trains_persists_and_matches_exact_search(self):
+        vectors = self._clustered_vectors()
+        items = [
+            api_models.Item.objects.create(
+                state=int(api_models.FileState.Complete),
+                label="cat",
+                filetype=int(api_models.FileType.Image),
+                width=10,
+                height=10,
+                embedding=views_extension.ClipModel.np_to_bytes(vector),
+            )
+            for vector in vectors
+        ]
+
+        with (
+            patch.object(views_extension, "ANN_MIN_ITEMS", 100),
+            patch.object(views_extension, "EMBEDDING_INDEX_PATH", self.index_path),
+        ):
+            store = views_extension.EmbeddingStore
+            approximate = store.nearest(vectors[0], k=5, exclude_ids=(items[0].id,))
+            exact = store.nearest(
+                vectors[0], k=5, exclude_ids=(items[0].id,), exact=True
+            )
+
+            self.assertIsNotNone(store.index)
+            self.assertTrue(Path(self.index_path).exists())
+            self.assertEqual(
+                [item_id for item_id, _ in approximate],
+                [item_id for item_id, _ in exact],
+            )
+
+            # Reloading reuses the saved centroids rather than retraining
+            centroids = store.index.centroids
+            store.clear()
+            store.ensure_loaded()
+            np.testing.assert_array_equal(store.index.centroids, centroids)
+
+            # A clip pass with nothing to embed leaves the saved index alone
+            with patch.object(ann_index.IVFIndex, "save") as save:
+                views_extension.ClipModel.process_unclipped_items()
+            save.assert_not_called()
+
+            with (
+                patch_clip_model(vectors[1]),
+                patch.object(ann_index.IVFIndex, "save") as save,
+            ):
+                views_extension.EmbeddingWorker.enqueue((items[0].id,))
+                views_extension.ClipModel.process_unclipped_items()
+            save.assert_called_once()
+
+
+@skipUnless(inference.onnxruntime_available(), "onnxruntime is not installed")
+class InferenceBackendTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.rng = np.random.default_rng(0)
+
+    def _random_image(self, width, height):
+        pixels = self.rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        return Image.fromarray(pixels)
+
+    def test_clip_onnx_embeddings_match_torch(self):
+        from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel
+
+        # A small randomly initialised model, the real weights are a download
+        config = CLIPConfig(
+            vision_config=dict(
+                hidden_size=32,
+                intermediate_size=64,
+                num_hidden_layers=2,
+                num_attention_heads=2,
+                image_size=32,
+                patch_size=8,
+            ),
+            text_config=dict(
+                hidden_size=32,
+                intermediate_size=64,
+                num_hidden_layers=1,
+                num_attention_heads=2,
+            ),
+            projection_dim=16,
+        )
+        model = CLIPModel(config).eval()
+        processor = CLIPImageProcessor(
+            size={"shortest_edge": 32}, crop_size={"height": 32, "width": 32}
+        )
+        images = [self._random_image(48, 40) for _ in range(3)]
+
+        for attr in ("model", "processor", "session"):
+            self.addCleanup(
+                setattr,
+                views_extension.ClipModel,
+                attr,
+                getattr(views_extension.ClipModel, attr),
+            )
+
+        views_extension.ClipModel.model = model
+        views_extension.ClipModel.processor = processor
+        views_extension.ClipModel.session = None
+        expected = views_extension.ClipModel.get_clip_image_embeddings(images)
+
+        path = str(Path(self.temp_dir.name) / "clip.onnx")
+        inference.export_clip_image_model(model, path)
+        views_extension.ClipModel.model = None
+        views_extension.ClipModel.session = inference.create_session(path, threads=1)
+        actual = views_extension.ClipModel.get_clip_image_embeddings(images)
+
+        self.assertEqual(actual.shape, (3, 16))
+        self.assertEqual(actual.dtype, views_extension.EMBEDDING_DTYPE)
+        np.testing.assert_allclose(actual, expected, atol=1e-5)
+
+    def test_yolo_onnx_boxes_match_torch(self):
+        import torch
+        from ultralytics import YOLO
+
+        # Random weights, with one class biased so every anchor passes the threshold
+        torch.manual_seed(0)
+        model = YOLO("yolov8n.yaml")
+        for layer in model.model.model[-1].cv3:
+            layer[-1].bias.data.fill_(-1)
+        model.model.model[-1].cv3[0][-1].bias.data[0] = 3
+
+        weights_path = str(Path(self.temp_dir.name) / "yolo.pt")
+        model.save(weights_path)
+        onnx_model = inference.OnnxYOLO(
+            inference.export_yolo_model(weights_path), threads=1
+        )
+
+        # Raw predictions on the same letterboxed input
+        image = self._random_image(360, 480)
+        tensor, _ = onnx_model.preprocess([image])
+        with torch.no_grad():
+            expected = YOLO(weights_path).model.eval()(torch.from_numpy(tensor))
+        actual = onnx_model.session.run(None, {onnx_model.input_name: tensor})[0]
+        np.testing.assert_allclose(actual, expected[0].numpy(), rtol=1e-3, atol=1e-3)
+
+        # Near-equal scores can reorder under NMS, so boxes are compared by count and score
+        expected_boxes = YOLO(weights_path)(image, verbose=False)[0].boxes
+        actual_boxes = onnx_model(image)[0].boxes
+
+        self.assertGreater(len(expected_boxes), 0)
+        self.assertEqual(len(actual_boxes), len(expected_boxes))
+        np.testing.assert_allclose(
+            np.sort(actual_boxes.conf.numpy()),
+            np.sort(expected_boxes.conf.numpy()),
+            atol=1e-4,
+        )
+
+        # Differently sized images share one padded batch
+        images = [image, self._random_image(200, 120)]
+        expected_batch = YOLO(weights_path)(images, verbose=False)
+        actual_batch = onnx_model(images)
+
+        self.assertEqual(len(actual_batch), 2)
+        for actual_result, expected_result in zip(actual_batch, expected_batch):
+            self.assertEqual(len(actual_result.boxes), len(expected_result.boxes))
+
+
+class CleanDbTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.old_media_path = api_models.MEDIA_PATH
+        api_models.MEDIA_PATH = self.temp_dir.name
+        self.addCleanup(setattr, api_models, "MEDIA_PATH", self.old_media_path)
+
+        self.items_path = Path(self.temp_dir.name) / "items"
+        self.items_path.mkdir(parents=True, exist_ok=True)
+
+    def test_clean_db_removes_orphans_and_unused_folders(self):
+        from api.management.commands import cleandb
+
+        item_keep = api_models.Item.objects.create(
+            state=int(api_models.FileState.Complete),
+            label="keep",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+        )
+        item_missing = api_models.Item.objects.create(
+            state=int(api_models.FileState.Complete),
+            label="missing",
+            filetype=int(api_models.FileType.Image),
+            width=10,
+            height=10,
+        )
+
+        keep_path = Path(item_keep.getpath())
+        keep_path.parent.mkdir(parents=True, exist_ok=True)
+        keep_path.write_bytes(b"")
+
+        unused_folder = self.items_path / "unused"
+        unused_folder.mkdir(parents=True, exist_ok=True)
+
+        api_models.Rules.objects.create(
+            label="keep",
+            tag_name="source",
+            tag_value="external",
+        )
+        api_models.Rules.objects.create(
+            label="missing",
+            tag_name="source",
+            tag_value="external",
+        )
+
+        with patch.object(cleandb, "ITEMS_PATH", str(self.items_path)):
+            result = cleandb.clean_db()
+
+        self.assertTrue(result)
+        self.assertFalse(api_models.Item.objects.filter(id=item_missing.id).exists())
+        self.assertTrue(api_models.Item.objects.filter(id=item_keep.id).exists())
+        self.assertFalse(unused_folder.exists())
+        self.assertFalse(api_models.Rules.objects.filter(label="missing").exists())
+        self.assertTrue(api_models.Rules.objects.filter(label="keep").exists())
+
+
+class WatchdogListenerTests(TestCase):
+    def _import_watchdog_listener(self):
+        dummy_views_extension = types.ModuleType("api.views_extension")
+
+        def edit_item(*args, **kwargs):
+            return None
+
+        def get_dimensions(*args, **kwargs):
+            return (10, 10)
+
+        def upload_item(*args, **kwargs):
+            return None
+
+        class VideoRemover:
+            @staticmethod
+            def process():
+                return None
+
+        class EmbeddingStore:
+            @staticmethod
+            def remove(item_ids):
+                return None
+
+        class ThumbnailStore:
+            @staticmethod
+            def invalidate(item_ids):
+                return None
+
+        dummy_views_extension.edit_item = edit_item
+        dummy_views_extension.get_dimensions = get_dimensions
+        dummy_views_extension.upload_item = upload_item
+        dummy_views_extension.VideoRemover = VideoRemover
+        dummy_views_extension.EmbeddingStore = EmbeddingStore
+        dummy_views_extension.ThumbnailStore = ThumbnailStore
+        dummy_views_extension.RenditionStore = ThumbnailStore
+        dummy_views_extension.VideoPreviewStore = ThumbnailStore
+
+        with patch.dict(sys.modules, {"api.views_extension": dummy_views_extension}):
+            if "api.management.commands.watchdog_listener" in sys.modules:
+                del sys.modules["api.management.commands.watchdog_listener"]
+            return importlib.import_module("api.management.commands.watchdog_listener")
+
+    def test_event_processor_ignores_banned_filetypes(self):
+        watchdog_listener = self._import_watchdog_listener()
+        processor = watchdog_listener.EventProcessor()
+
+        processor.add("C:/tmp/file.TMP", "created")
+        self.assertEqual(processor.process_times, [])
+        self.assertEqual(processor.file_assignments, {})
+
+    def test_event_handler_ignores_cache_paths(self):
+        watchdog_listener = self._import_watchdog_listener()
+        processor = MagicMock()
+        handler = watchdog_listener.MyEventHandler(processor)
+
+        for path in (
+            "/media/.cache/thumbnails/200/0000000001_1_8x8.webp",
+            "/media/a.png",
+        ):
+            event = types.SimpleNamespace(
+                is_directory=False, src_path=path, event_type="created"
+            )
+            handler.on_any_event(event)
+
+        processor.add.assert_called_once_with("/media/a.png", "created")
 
     def test_handle_delete_removes_missing_item(self):
         watchdog_listener = self._import_watchdog_listener()
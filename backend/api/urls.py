@@ -4,8 +4,13 @@ from api.views import (
     CookieTokenObtainPairView,
     CookieTokenRefreshView,
     FileUpload,
+    BatchFileUpload,
+    ResumableUpload,
+    ResumableUploadPart,
     CheckIsAuthenticated,
     RandomItem,
+    RandomItems,
+    ItemMedia,
     DeleteItem,
 )
 
@@ -18,7 +23,12 @@ urlpatterns = [
     path("api/token", CookieTokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh", CookieTokenRefreshView.as_view(), name="token_refresh"),
     path("api/upload", FileUpload.as_view()),
+    path("api/upload/batch", BatchFileUpload.as_view()),
+    path("api/upload/resumable", ResumableUpload.as_view()),
+    path("api/upload/resumable/<str:upload_id>", ResumableUploadPart.as_view()),
     path("api/checkauth", CheckIsAuthenticated.as_view()),
     path("api/download", RandomItem.as_view()),
+    path("api/download/batch", RandomItems.as_view()),
+    path("api/media/<int:item_id>", ItemMedia.as_view(), name="item_media"),
     path("api/delete", DeleteItem.as_view()),
 ]
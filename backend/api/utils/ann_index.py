@@ -0,0 +1,103 @@
+import os
+import numpy as np
+
+ASSIGN_CHUNK_SIZE = 8192  # Rows scored against the centroids at once
+
+
+def normalise(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class IVFIndex:
+    """
+    Inverted-file index over unit-length embeddings.
+
+    A spherical k-means coarse quantizer splits the vectors into lists, and a query
+    only needs to scan the lists whose centroids are closest to it. The index only
+    holds the centroids, the caller keeps the list id of each of its rows.
+    """
+
+    def __init__(self, centroids, trained_size):
+        self.centroids = centroids
+        self.trained_size = trained_size
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, vectors, n_lists=None, iterations=10, sample_per_list=64, seed=0):
+        rng = np.random.default_rng(seed)
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+
+        sample_size = min(len(vectors), n_lists * sample_per_list)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assignments, minlength=n_lists)
+
+            order = np.argsort(assignments, kind="stable")
+            starts = np.cumsum(counts) - counts
+            filled = counts > 0
+
+            sums = np.empty_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+
+            # Re-seed empty lists from random sample points
+            sums[~filled] = sample[rng.choice(sample_size, int((~filled).sum()))]
+
+            centroids = normalise(sums)
+
+        return cls(centroids.astype(vectors.dtype), trained_size=len(vectors))
+
+    def assign(self, vectors):
+        # List id of each vector, in chunks to bound the (rows, n_lists) score matrix
+        vectors = np.atleast_2d(vectors)
+        lists = np.empty(len(vectors), dtype=np.int32)
+
+        for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+            chunk = vectors[start : start + ASSIGN_CHUNK_SIZE]
+            lists[start : start + len(chunk)] = np.argmax(
+                chunk @ self.centroids.T, axis=1
+            )
+
+        return lists
+
+    def probe(self, query, n_probe):
+        # Ids of the n_probe lists closest to the query
+        n_probe = min(n_probe, self.n_lists)
+        scores = self.centroids @ query
+        return np.argpartition(-scores, n_probe - 1)[:n_probe]
+
+    def save(self, path, ids, lists):
+        # Written to a temporary file first so a crash never leaves a partial index
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                trained_size=self.trained_size,
+                ids=ids,
+                lists=lists,
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        # Returns (index, ids, lists), or None if there is no usable index on disk
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                index = cls(data["centroids"], int(data["trained_size"]))
+                return index, data["ids"], data["lists"]
+        except (OSError, ValueError, KeyError):
+            return None
@@ -0,0 +1,149 @@
+import ast
+import os
+import numpy as np
+
+from api.utils.key_paths import INFERENCE_THREADS, MODELS_PATH
+
+# Inference backends, selected with the INFERENCE_BACKEND environment variable
+TORCH_BACKEND = "torch"
+ONNX_BACKEND = "onnx"
+
+ONNX_OPSET = 17
+
+
+def onnxruntime_available():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_session(path, threads=INFERENCE_THREADS):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+
+    return onnxruntime.InferenceSession(
+        path, options, providers=["CPUExecutionProvider"]
+    )
+
+
+def get_model_path(model_name, extension="onnx"):
+    return os.path.join(MODELS_PATH, f"{model_name.replace('/', '--')}.{extension}")
+
+
+def get_clip_image_features(model, pixel_values):
+    # Unit-length image embeddings. transformers 5 returns the projected features
+    # as the pooler output rather than a tensor
+    features = model.get_image_features(pixel_values=pixel_values)
+    features = getattr(features, "pooler_output", features)
+    return features / features.norm(dim=-1, keepdim=True)
+
+
+def export_clip_image_model(model, path):
+    # Exports the image tower of a CLIP model, including the final normalisation,
+    # with a dynamic batch dimension. Written to a temporary file first so a crash
+    # never leaves a partial model
+    import torch
+
+    class ClipImageEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return get_clip_image_features(self.model, pixel_values)
+
+    image_size = model.config.vision_config.image_size
+    example = torch.zeros(2, 3, image_size, image_size)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+
+    with torch.no_grad():
+        torch.onnx.export(
+            ClipImageEncoder(model).eval(),
+            (example,),
+            temp_path,
+            input_names=["pixel_values"],
+            output_names=["embeddings"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embeddings": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+
+    os.replace(temp_path, path)
+
+
+def export_yolo_model(weights_path):
+    # Uses the ultralytics exporter, which writes the .onnx file next to the weights
+    from ultralytics import YOLO
+
+    return YOLO(weights_path, verbose=False).export(
+        format="onnx", dynamic=True, simplify=False, opset=ONNX_OPSET, verbose=False
+    )
+
+
+class OnnxYOLO:
+    """
+    Runs an exported YOLO detection model through onnxruntime.
+
+    Called like an ultralytics YOLO model and returns the same Results objects,
+    using the ultralytics pre and post processing so the boxes match eager PyTorch.
+    """
+
+    def __init__(self, path, threads=INFERENCE_THREADS):
+        self.session = create_session(path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"])
+        self.stride = int(metadata.get("stride", 32))
+        self.image_size = ast.literal_eval(metadata.get("imgsz", "[640, 640]"))
+
+    def preprocess(self, images):
+        # PIL RGB images to a letterboxed (B, 3, H, W) float32 tensor, and the BGR
+        # originals. As in ultralytics, images of different sizes are padded to the
+        # full model size so they can share a batch
+        from ultralytics.data.augment import LetterBox
+
+        originals = [np.asarray(image.convert("RGB"))[..., ::-1] for image in images]
+        same_shapes = len({original.shape for original in originals}) == 1
+        letterbox = LetterBox(self.image_size, auto=same_shapes, stride=self.stride)
+
+        tensor = np.stack([letterbox(image=original) for original in originals])
+        tensor = tensor[..., ::-1].transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(tensor, dtype=np.float32) / 255, originals
+
+    def __call__(self, images, verbose=False, conf=0.25, iou=0.7, max_det=300):
+        import torch
+        from ultralytics.engine.results import Results
+        from ultralytics.utils import ops
+
+        try:
+            from ultralytics.utils.nms import non_max_suppression
+        except ImportError:  # Older ultralytics releases
+            from ultralytics.utils.ops import non_max_suppression
+
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+
+        tensor, originals = self.preprocess(images)
+        outputs = self.session.run(None, {self.input_name: tensor})[0]
+
+        results = []
+        for predictions, original in zip(
+            non_max_suppression(torch.from_numpy(outputs), conf, iou, max_det=max_det),
+            originals,
+        ):
+            predictions[:, :4] = ops.scale_boxes(
+                tensor.shape[2:], predictions[:, :4], original.shape
+            )
+            results.append(
+                Results(original, path="", names=self.names, boxes=predictions[:, :6])
+            )
+
+        return results
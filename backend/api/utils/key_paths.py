@@ -21,4 +21,29 @@ KEY_FILE_PATH = os.getenv("KEY_FILE_PATH")
 UNPROCESSED_PATH = f"{MEDIA_PATH}/unprocessed"
 ITEMS_PATH = f"{MEDIA_PATH}/items"
 
+EMBEDDING_INDEX_PATH = f"{DATABASE_PATH}.ivf.npz"
+
+# Skipped by the watchdog listener, like other .cache directories
+THUMBNAILS_PATH = f"{MEDIA_PATH}/.cache/thumbnails"
+
+# Poster frames and short previews of videos, made on ingest
+PREVIEWS_PATH = f"{MEDIA_PATH}/.cache/previews"
+
+# Downscaled copies of images for the media endpoints
+RENDITIONS_PATH = f"{MEDIA_PATH}/.cache/renditions"
+
+# Uploads are streamed here, on the same filesystem as the items they're moved to
+UPLOADS_PATH = f"{MEDIA_PATH}/.cache/uploads"
+
 # Other paths are handled by a state map in models.py
+
+# Exported inference models, and the backend and thread count used to run them
+MODELS_PATH = os.getenv("MODELS_PATH") or "models"
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND") or "torch"
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS") or 0)
+
+# Memory budget of the desktop thumbnail cache
+THUMBNAIL_CACHE_MB = int(os.getenv("THUMBNAIL_CACHE_MB") or 256)
+
+# Prints the SQL and query plan of tag searches when set to 1
+QUERY_DEBUG = os.getenv("QUERY_DEBUG") == "1"
@@ -1,11 +1,48 @@
 from PIL import Image
-from ultralytics import YOLO
+from threading import Lock
 import numpy as np
+import os
+
+from api.utils.inference import ONNX_BACKEND, OnnxYOLO, export_yolo_model
+from api.utils.key_paths import INFERENCE_BACKEND
 
 MEDIA_HEIGHT = 800
 FLOOR_DIVISION = 16  # Used for border thresholding
+MOVE_CHUNK_SIZE = 32  # Edges compared at once when trimming borders
+BOUNDING_BOX_WEIGHTS = "yolov8n.pt"
+
+# Loaded on first use by get_bounding_box_model, as importing ultralytics takes seconds
+bounding_box_model = None
+bounding_box_model_lock = Lock()
+bounding_box_inference_lock = Lock()
+
+
+def get_bounding_box_model():
+    global bounding_box_model
+
+    with bounding_box_model_lock:
+        if bounding_box_model is None and INFERENCE_BACKEND == ONNX_BACKEND:
+            bounding_box_model = load_onnx_bounding_box_model()
+
+        if bounding_box_model is None:
+            from ultralytics import YOLO
+
+            bounding_box_model = YOLO(BOUNDING_BOX_WEIGHTS, verbose=False)
+
+    return bounding_box_model
+
+
+def load_onnx_bounding_box_model():
+    # Exported once next to the weights, returns None to fall back to PyTorch
+    onnx_path = os.path.splitext(BOUNDING_BOX_WEIGHTS)[0] + ".onnx"
 
-bounding_box_model = YOLO("yolov8n.pt", verbose=False)
+    try:
+        if not os.path.exists(onnx_path):
+            onnx_path = export_yolo_model(BOUNDING_BOX_WEIGHTS)
+        return OnnxYOLO(onnx_path)
+    except Exception as e:
+        print(f"Could not load ONNX bounding box model, using PyTorch: {e}")
+        return None
 
 
 def clamp(value, lower, upper):
@@ -32,27 +69,87 @@ def get_crop_image_and_bounds(path, crop_max_height, include_bounds=True):
 
 
 def get_bounds(image):
-    bounds = bounding_box_model(image, verbose=False)
+    return get_bounds_batch([image])[0]
+
+
+def get_bounds_batch(images):
+    # One forward pass over all the images, as the model takes a batch. Calls are
+    # serialised as the model can't be shared between threads
+    if not images:
+        return []
+
+    with bounding_box_inference_lock:
+        results = get_bounding_box_model()(images, verbose=False)
+
+    all_bounds = []
+
+    for image, result in zip(images, results):
+        person_bounds = []
+        other_bounds = []
+
+        for bound in result:
+            for j in range(len(bound.boxes)):
+                x1, y1, x2, y2 = bound.boxes.xyxy[j].tolist()
+
+                image_class = int(bound.boxes.cls[j])
+
+                x1, x2, y1, y2 = clean_corners(image, (x1, x2, y1, y2))
+
+                if image_class == 0:
+                    person_bounds.append((x1, x2, y1, y2))
+                else:
+                    other_bounds.append((x1, x2, y1, y2))
+
+        all_bounds.append(person_bounds + other_bounds)
 
-    person_bounds = []
-    other_bounds = []
+    return all_bounds
 
-    for bound in bounds[
-        0
-    ]:  # model takes batch, as we only care about 1 we use the [0] idx
-        for j in range(len(bound.boxes)):
-            x1, y1, x2, y2 = bound.boxes.xyxy[j].tolist()
 
-            image_class = int(bound.boxes.cls[j])
+def get_pixels(image):
+    # (height, width, channels) array of the colours compared when trimming borders
+    if image.mode == "1":
+        image = image.convert("L")  # Bilevel pixels read as 0/255, not booleans
 
-            x1, x2, y1, y2 = clean_corners(image, (x1, x2, y1, y2))
+    pixels = np.asarray(image)
+    if pixels.ndim == 2:  # Grayscale handling
+        pixels = pixels[..., None]
 
-            if image_class == 0:
-                person_bounds.append((x1, x2, y1, y2))
-            else:
-                other_bounds.append((x1, x2, y1, y2))
+    return pixels
 
-    return person_bounds + other_bounds
+
+def move_edge(pixels, start, stop, o1, o2):
+    # Steps d from start towards stop, returning the first d where at most half of
+    # pixels[o1:o2, d] match the colour at the middle of the edge, or stop if none do.
+    # Edges are quantized and compared in chunks, so a border that stops early is
+    # found without reading the rest of the box
+    delta = 1 if start <= stop else -1
+    steps = range(start, stop, delta)
+
+    if not steps:
+        return stop
+
+    if o2 <= o1:
+        return start  # No pixels to match, so the first edge never matches
+
+    middle = pixels[(o1 + o2) // 2] // FLOOR_DIVISION
+    max_matches = o2 - o1 + 1
+
+    for i in range(0, len(steps), MOVE_CHUNK_SIZE):
+        chunk = steps[i : i + MOVE_CHUNK_SIZE]
+        low, high = min(chunk[0], chunk[-1]), max(chunk[0], chunk[-1]) + 1
+
+        edges = pixels[o1:o2, low:high] // FLOOR_DIVISION
+        matches = np.all(edges == middle[low:high], axis=-1)
+        current_matches = np.count_nonzero(matches, axis=0)
+
+        if delta < 0:
+            current_matches = current_matches[::-1]
+
+        stopped = np.flatnonzero(current_matches <= max_matches // 2)
+        if len(stopped):
+            return chunk[stopped[0]]
+
+    return stop
 
 
 def clean_corners(image, corners):  # (x1, x2, y1, y2)
@@ -69,42 +166,17 @@ def clean_corners(image, corners):  # (x1, x2, y1, y2)
 
     # Move inwards where all co-ordinates are the same colour
     # o1, o2 refer to the unused axes bounds
+    # Only the box is read, so bounds are moved relative to its top left corner
+    pixels = get_pixels(image.crop((x1, y1, x2, y2)))
+    columns = pixels.swapaxes(0, 1)  # Indexed [x, y], for moving the y bounds
+    width, height = x2 - x1, y2 - y1
 
-    def get_smoothed(color):
-        # Grayscale handling
-        if isinstance(color, int):
-            color = (color,)
-
-        color = list(c // FLOOR_DIVISION for c in color)
-        return color
-
-    def move(start, stop, o1, o2, data_type="x"):
-        delta = 1 if start <= stop else -1
-
-        for d in range(start, stop, delta):
-            cords = (d, (o1 + o2) // 2) if data_type == "x" else ((o1 + o2) // 2, d)
-
-            color = get_smoothed(image.getpixel(cords))
-
-            current_matches = 0
-            max_matches = o2 - o1 + 1
-
-            for o in range(o1, o2):
-                cords = (d, o) if data_type == "x" else (o, d)
-                checked_color = get_smoothed(image.getpixel(cords))
-
-                if color == checked_color:
-                    current_matches += 1
-
-            if current_matches <= max_matches // 2:
-                return d
-
-        return stop
+    left = move_edge(pixels, 0, width, 0, height)
+    right = move_edge(pixels, width - 1, left - 1, 0, height)
+    top = move_edge(columns, 0, height, left, right)
+    bottom = move_edge(columns, height - 1, top - 1, left, right)
 
-    x1 = move(x1, x2, y1, y2, data_type="x")
-    x2 = move(x2 - 1, x1 - 1, y1, y2, data_type="x")
-    y1 = move(y1, y2, x1, x2, data_type="y")
-    y2 = move(y2 - 1, y1 - 1, x1, x2, data_type="y")
+    x1, x2, y1, y2 = x1 + left, x1 + right, y1 + top, y1 + bottom
 
     def process_pair(p1, p2, max_value):
         # Tightening bounds
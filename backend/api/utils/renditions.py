@@ -0,0 +1,60 @@
+import os
+
+from PIL import Image, features
+
+# Encoders for downscaled copies of images, tuned for photos on phones.
+# Kept free of Django so worker processes start quickly
+
+RENDITION_FORMATS = {
+    "webp": {
+        "format": "WEBP",
+        "feature": "webp",
+        "mime_type": "image/webp",
+        "options": {"quality": 80, "method": 4},
+    },
+    "avif": {
+        "format": "AVIF",
+        "feature": "avif",
+        "mime_type": "image/avif",
+        "options": {"quality": 60, "speed": 8},
+    },
+    "jpeg": {
+        "format": "JPEG",
+        "feature": "jpg",
+        "mime_type": "image/jpeg",
+        "options": {"quality": 85, "progressive": True},
+    },
+}
+
+# Formats this build of Pillow can write
+SUPPORTED_FORMATS = {
+    name: settings
+    for name, settings in RENDITION_FORMATS.items()
+    if features.check(settings["feature"])
+}
+
+
+def encode_rendition(source_path, path, width, format_name):
+    # Run in a worker process. Writes the source shrunk to at most width wide, through
+    # a temporary file so readers never see a partial image
+    settings = SUPPORTED_FORMATS[format_name]
+
+    with Image.open(source_path) as image:
+        has_alpha = "A" in image.mode or "transparency" in image.info
+        image = image.convert(
+            "RGBA" if has_alpha and settings["format"] != "JPEG" else "RGB"
+        )
+
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        image.save(temp_path, format=settings["format"], **settings["options"])
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
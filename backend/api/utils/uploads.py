@@ -0,0 +1,168 @@
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from threading import Lock
+
+from django.core.files import temp as tempfile
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from api.utils.key_paths import UPLOADS_PATH
+
+# Fewer writes than Django's 64KB default, larger chunks slow its multipart parser
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+RESUMABLE_UPLOAD_EXPIRY = (
+    24 * 60 * 60
+)  # Seconds before an idle resumable upload is removed
+
+
+class StreamingUploadedFile(TemporaryUploadedFile):
+    # A temporary upload kept under the media path, so it can be renamed into place.
+    # Django's NamedTemporaryFile, as the stdlib one can't be renamed on Windows
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        os.makedirs(UPLOADS_PATH, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix=".upload" + ext, dir=UPLOADS_PATH)
+        UploadedFile.__init__(
+            self, file, name, content_type, size, charset, content_type_extra
+        )
+
+
+class StreamingUploadHandler(TemporaryFileUploadHandler):
+    # Writes every upload to disk as it arrives, however small, instead of
+    # buffering it in memory first
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = StreamingUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+
+
+class ResumableUploads:
+    """
+    Uploads sent in pieces over several requests, so a dropped connection only loses
+    the piece in flight. Each upload is a .part file beside a .json of its name and
+    size, and its offset is the size of the .part file, so they survive restarts.
+    """
+
+    path = UPLOADS_PATH
+    expiry = RESUMABLE_UPLOAD_EXPIRY
+    lock = Lock()
+    upload_locks = {}
+
+    @classmethod
+    def get_paths(cls, upload_id):
+        # Ids come from the client, only ones we could have made are accepted
+        if not isinstance(upload_id, str) or not upload_id.isalnum():
+            raise KeyError(upload_id)
+        return f"{cls.path}/{upload_id}.part", f"{cls.path}/{upload_id}.json"
+
+    @classmethod
+    def create(cls, name, size):
+        cls.remove_expired()
+
+        upload_id = uuid.uuid4().hex
+        part_path, info_path = cls.get_paths(upload_id)
+        os.makedirs(cls.path, exist_ok=True)
+
+        open(part_path, "wb").close()
+        with open(info_path, "w") as file:
+            json.dump({"name": name, "size": size}, file)
+
+        return upload_id
+
+    @classmethod
+    def get(cls, upload_id):
+        # {"name", "size", "offset"}, raising KeyError for unknown uploads
+        part_path, info_path = cls.get_paths(upload_id)
+
+        try:
+            with open(info_path) as file:
+                info = json.load(file)
+            info["offset"] = os.path.getsize(part_path)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+
+        return info
+
+    @classmethod
+    def append(cls, upload_id, offset, stream):
+        # Writes the stream at offset, returning (new offset, path). path is set once
+        # the upload is complete, for the caller to move into place, and only for the
+        # request that completed it. Raises KeyError for unknown or finished uploads,
+        # and ValueError with the current offset if the offset isn't where the upload
+        # got to, or the data runs past its size
+        with cls.lock:
+            upload_lock = cls.upload_locks.setdefault(upload_id, Lock())
+
+        with upload_lock:
+            info = cls.get(upload_id)
+            if offset != info["offset"]:
+                raise ValueError(
+                    f"Upload is at offset {info['offset']}, not {offset}",
+                    info["offset"],
+                )
+
+            part_path, _ = cls.get_paths(upload_id)
+
+            # Whatever arrives before a dropped connection is kept
+            with open(part_path, "ab") as file:
+                while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+                    if file.tell() + len(chunk) > info["size"]:
+                        file.truncate(info["size"])
+                        raise ValueError(
+                            "Upload is larger than its declared size", info["size"]
+                        )
+                    file.write(chunk)
+
+                offset = file.tell()
+
+            # Finished under the lock, so a retried final piece finds no upload
+            if offset < info["size"]:
+                return offset, None
+            return offset, cls.finish(upload_id, info["name"])
+
+    @classmethod
+    def finish(cls, upload_id, name):
+        # Ends a complete upload, returning its path. Called with its lock held
+        part_path, _ = cls.get_paths(upload_id)
+
+        path = f"{cls.path}/{upload_id}{os.path.splitext(name)[1]}"
+        os.replace(part_path, path)
+        cls.remove(upload_id)
+
+        return path
+
+    @classmethod
+    def remove(cls, upload_id):
+        for path in cls.get_paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        with cls.lock:
+            cls.upload_locks.pop(upload_id, None)
+
+    @classmethod
+    def remove_expired(cls):
+        # Uploads that haven't received data within the expiry are abandoned
+        cutoff = time.time() - cls.expiry
+
+        for path in Path(cls.path).glob("*.json"):
+            part_path = path.with_suffix(".part")
+            try:
+                modified_time = max(
+                    os.path.getmtime(path),
+                    os.path.getmtime(part_path) if part_path.exists() else 0,
+                )
+            except FileNotFoundError:
+                continue
+
+            if modified_time < cutoff:
+                cls.remove(path.stem)
@@ -0,0 +1,83 @@
+import os
+import subprocess
+from threading import get_ident
+
+import imageio_ffmpeg
+
+# Derived media for videos, made with the ffmpeg moviepy already depends on: a full
+# size poster frame, and a short animated WebP that grids can loop in place of the
+# video. WebP rather than an MP4 so Qt's QMovie and browser <img> tags play it
+# without a video decoder per tile
+
+POSTER_TIME = 0.5  # Seconds in, past any fade from black
+PREVIEW_SECONDS = 3
+PREVIEW_WIDTH = 320
+PREVIEW_FPS = 10
+PREVIEW_QUALITY = 50
+
+
+def run_ffmpeg(arguments, path):
+    # Writes through a temporary file so readers never see a partial file. Returns
+    # False if ffmpeg had nothing to write, like a seek past the end
+    # Named per thread, as thumbnail loaders and the CLIP pool can make the same
+    # poster, and hidden from the glob in invalidate. ffmpeg picks the format from
+    # the extension, so it's kept
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    directory, name = os.path.split(path)
+    extension = os.path.splitext(name)[1]
+    temp_path = f"{directory}/.{name}.{os.getpid()}.{get_ident()}.tmp{extension}"
+
+    try:
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-y"]
+            + arguments
+            + [temp_path],
+            check=True,
+            capture_output=True,
+            stdin=subprocess.DEVNULL,
+        )
+        if not os.path.exists(temp_path):
+            return False
+        os.replace(temp_path, path)
+        return True
+    except subprocess.CalledProcessError as e:
+        # The last line of ffmpeg's output says what went wrong
+        lines = e.stderr.decode(errors="replace").strip().splitlines()
+        raise OSError(lines[-1] if lines else f"ffmpeg failed on {path}") from e
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def extract_poster(source_path, path):
+    # Seeking before the input skips to the nearest keyframe rather than decoding
+    # from the start. Clips shorter than POSTER_TIME get their first frame
+    for time in (POSTER_TIME, 0):
+        if run_ffmpeg(
+            ["-ss", str(time), "-i", source_path, "-frames:v", "1", "-q:v", "2"],
+            path,
+        ):
+            return
+    raise OSError(f"No frames in {source_path}")
+
+
+def encode_preview(source_path, path):
+    # The first PREVIEW_SECONDS, silent, downscaled and at a low frame rate
+    run_ffmpeg(
+        [
+            "-t",
+            str(PREVIEW_SECONDS),
+            "-i",
+            source_path,
+            "-an",
+            "-vf",
+            f"fps={PREVIEW_FPS},scale='min({PREVIEW_WIDTH},iw)':-2",
+            "-c:v",
+            "libwebp_anim",
+            "-loop",
+            "0",
+            "-quality",
+            str(PREVIEW_QUALITY),
+        ],
+        path,
+    )
@@ -0,0 +1,115 @@
+import os
+import struct
+
+# Reads video dimensions from the boxes of an MP4/MOV file without decoding it.
+# Only the box headers and the few boxes on the path to the track headers are
+# read, so a large mdat is skipped over with a seek.
+
+# Sample entry header, data reference index and reserved fields before the size
+SAMPLE_ENTRY_SIZE_OFFSET = 32
+
+
+def read_boxes(file, start, end):
+    # Yields (type, payload start, payload end) for each box in [start, end)
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        header = file.read(8)
+        if len(header) < 8:
+            return
+
+        size, box_type = struct.unpack(">I4s", header)
+        payload = position + 8
+
+        if size == 1:
+            # 64 bit size after the type
+            large = file.read(8)
+            if len(large) < 8:
+                return
+            size = struct.unpack(">Q", large)[0]
+            payload += 8
+        elif size == 0:
+            # Box runs to the end of the file
+            size = end - position
+
+        if size < payload - position:
+            return
+
+        yield box_type, payload, min(position + size, end)
+        position += size
+
+
+def read_track(file, start, end):
+    # Returns the handler type, tkhd matrix and stsd sample entry size of a trak
+    track = {"handler": None, "rotated": False, "size": None}
+
+    def walk(start, end, parent):
+        for box_type, payload, box_end in read_boxes(file, start, end):
+            if box_type in (b"mdia", b"minf", b"stbl"):
+                walk(payload, box_end, box_type)
+
+            elif box_type == b"hdlr" and parent == b"mdia":
+                # QuickTime also has a data handler in minf
+                file.seek(payload + 8)
+                track["handler"] = file.read(4)
+
+            elif box_type == b"tkhd":
+                file.seek(payload)
+                version = file.read(1)
+                if not version:
+                    continue
+                # Times and durations are 64 bit in version 1
+                matrix_offset = (32 if version[0] == 1 else 20) + 4 + 16
+                file.seek(payload + matrix_offset)
+                matrix = file.read(36)
+                if len(matrix) < 36:
+                    continue
+                a, b, _, c, d = struct.unpack(">5i", matrix[:20])
+                # 90 and 270 degree rotations have zeroes on the diagonal
+                track["rotated"] = a == 0 and d == 0 and b != 0 and c != 0
+
+            elif box_type == b"stsd":
+                # Version, flags and entry count, then the first sample entry
+                file.seek(payload + 8 + SAMPLE_ENTRY_SIZE_OFFSET)
+                size = file.read(4)
+                if len(size) == 4:
+                    track["size"] = struct.unpack(">HH", size)
+
+    walk(start, end, b"trak")
+    return track
+
+
+def probe_mp4_dimensions(path):
+    # Returns the (width, height) of the first video track, or None if the file
+    # isn't an ISO base media file or has no video track.
+    # Rotated tracks are swapped, matching the size moviepy reports.
+    end = os.path.getsize(path)
+
+    with open(path, "rb") as file:
+        header = file.read(8)
+        if len(header) < 8 or header[4:8] not in (b"ftyp", b"moov", b"mdat", b"wide"):
+            return None
+
+        for box_type, payload, box_end in read_boxes(file, 0, end):
+            if box_type != b"moov":
+                continue
+
+            for inner_type, inner_payload, inner_end in read_boxes(
+                file, payload, box_end
+            ):
+                if inner_type != b"trak":
+                    continue
+
+                track = read_track(file, inner_payload, inner_end)
+                if track["handler"] != b"vide" or not track["size"]:
+                    continue
+
+                width, height = track["size"]
+                if not width or not height:
+                    continue
+
+                if track["rotated"]:
+                    return height, width
+                return width, height
+
+    return None
@@ -8,20 +8,38 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.tokens import AccessToken
-from PIL import Image
-import random
+import os
 from collections import defaultdict
 from api.views_extension import (
     upload_image,
     upload_video,
+    upload_files,
     delete_items,
-    get_items_and_paths_from_tags,
+    RandomSampler,
+    RandomQueues,
+    get_item_data,
+    get_rendition_data,
+    parse_rendition_request,
     TAG_STYLE_OPTIONS,
 )
-from api.models import FileState, FileType, TagConditions
-from django.http import FileResponse, HttpResponseBadRequest
+from api.models import FileState, FileType, TagConditions, get_filetype
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseBadRequest,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.urls import reverse
+from urllib.parse import urlencode
 from api.utils.overrides import override_random_item
-from collections import Counter
+from api.utils.uploads import ResumableUploads, StreamingUploadHandler
+
+
+RANDOM_ITEMS_DEFAULT = 5  # Items per batch when the viewer doesn't ask for a count
+RANDOM_ITEMS_MAX = 50
+MEDIA_CHUNK_SIZE = 256 * 1024  # Bytes read at a time for partial responses
 
 
 class CookieTokenObtainPairView(TokenObtainPairView):
@@ -104,13 +122,16 @@ class FileUpload(APIView):
 
     def post(self, request):
         try:
+            # Stream files to disk beside the media, so they're moved into place
+            # rather than held in memory and copied
+            request.upload_handlers = [StreamingUploadHandler(request)]
             data = request.FILES
 
             possible_image = data.get("image", None)
             possible_video = data.get("video", None)
 
             if possible_image is not None:
-                upload_image(Image.open(possible_image))
+                upload_image(possible_image)
 
             if possible_video is not None:
                 upload_video(possible_video)
@@ -122,114 +143,297 @@ class FileUpload(APIView):
             raise e
 
 
-class RandomItem(APIView):
+class BatchFileUpload(APIView):
     authentication_classes = [CookieTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         try:
-            filetype = request.data.get("type")
-            tags_data = request.data.get("tags")
-
-            tags = defaultdict(list)
-            random_selection_method = "uniform"
-
-            for tag in tags_data:
-                name = tag["name"].strip().lower()
-                condition = tag["condition"]
-                value = tag["value"].strip().lower()
-
-                if condition not in TAG_STYLE_OPTIONS:
-                    raise Exception("Condition not recognised")
-
-                tags[(name, condition)].append(value)
-
-            tags[("state", TagConditions.Is.value)] += [
-                int(FileState.NeedsLabel),
-                int(FileState.NeedsTags),
-                int(FileState.NeedsClip),
-                int(FileState.Complete),
-            ]
-
-            tags = override_random_item(tags, filetype)
-            random_strength = 2
-
-            for k, v in tags.items():
-                # Gathering distinct
-                v = list(set(v))
-                tags[k] = v
-
-            for k, v in list(tags.items()):
-                # With the keyword all we remove all conditions for that tag
-                if "all" in v:
-                    tags.pop(k)
-                # On the "play" keyword we start auto-queueing images
-                elif k[0] == "play":
-                    tags.pop(k)
-                elif k[0] == "random":
-                    tags.pop(k)
-                    random_selection_method = v[0]
-                elif k[0] == "randomstrength":
-                    tags.pop(k)
-                    random_strength = float(v[0])
-
-            items = get_items_and_paths_from_tags(tags)
-
-            keys = list(items.keys())
-
-            if len(keys) == 0:
-                return HttpResponseBadRequest("No IDs match the given criteria.")
+            request.upload_handlers = [StreamingUploadHandler(request)]
+            files = request.FILES.getlist("files")
+
+            if len(files) == 0:
+                return HttpResponseBadRequest("No files uploaded.")
+
+            results = upload_files(
+                [(file.temporary_file_path(), file.name) for file in files]
+            )
+
+            return Response({"results": results})
+
+        except Exception as e:
+            print(e)
+            raise e
+
+
+class ResumableUpload(APIView):
+    authentication_classes = [CookieTokenAuthentication]
+    permission_classes = [IsAuthenticated]
 
-            weights = [1 for _ in range(len(keys))]
+    # Starts an upload sent in pieces to ResumableUploadPart
+    def post(self, request):
+        try:
+            name = str(request.data.get("name", ""))
+            size = int(request.data.get("size", 0))
+            get_filetype(os.path.splitext(name)[1][1:])
+        except Exception as e:
+            return HttpResponseBadRequest(str(e))
 
-            if random_selection_method == "recent":
-                # Take 10,000 items
-                # The most recent has score 1/5000
-                # The least recent has score 1/15000 - a 3x decrease
-                # for random strength 2.
-                # For random strength 4, we have 1/2500 and 1/12500 so a 5x decrease.
+        if size <= 0:
+            return HttpResponseBadRequest("Size must be positive.")
 
-                weights = [
-                    1 / ((random_strength + 1) * len(keys) / random_strength - i)
-                    for i in range(len(keys))
-                ]
+        upload_id = ResumableUploads.create(name, size)
 
-            elif random_selection_method == "sparse":
-                # Want to assign smaller weights to items from large classes
-                # Use 1/sqrt(x) for this
+        return Response({"upload_id": upload_id, "offset": 0})
 
-                item_values = list(items.values())
-                class_sizes = Counter(item["label"] for item in item_values)
-                weights = [class_sizes[item["label"]] ** (-0.5) for item in item_values]
 
-            elif random_selection_method == "dense":
-                # Assign larger weights to items from large classes
-                # Use sqrt(x) for this
+class ResumableUploadPart(APIView):
+    authentication_classes = [CookieTokenAuthentication]
+    permission_classes = [IsAuthenticated]
 
-                item_values = list(items.values())
-                class_sizes = Counter(item["label"] for item in item_values)
-                weights = [class_sizes[item["label"]] ** 0.5 for item in item_values]
+    # Where the upload got to, for the client to continue from after a dropped connection
+    def get(self, request, upload_id):
+        try:
+            info = ResumableUploads.get(upload_id)
+        except KeyError:
+            return Response({"message": "Upload not found"}, status=404)
+
+        return Response({"upload_id": upload_id, **info})
 
-            random_id = random.choices(keys, weights=weights, k=1)[0]
+    # The body is written at the Upload-Offset header, the upload is ingested once complete
+    def put(self, request, upload_id):
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            return HttpResponseBadRequest("Upload-Offset header required.")
 
-            item_info = items[random_id]
+        try:
+            info = ResumableUploads.get(upload_id)
+            offset, path = ResumableUploads.append(upload_id, offset, request)
+        except KeyError:
+            # Also a retry of the final piece, once the upload has been ingested
+            return Response({"message": "Upload not found"}, status=404)
+        except ValueError as e:
+            message, current_offset = e.args
+            return Response({"message": message, "offset": current_offset}, status=409)
+
+        if path is None:
+            return Response({"offset": offset})
 
-            path = item_info["path"]
-            mime_type = item_info["mime_type"]
+        try:
+            result = upload_files([(path, info["name"])])[0]
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        return Response({"offset": offset, "result": result})
+
+
+def get_random_item_query(data):
+    # The tags, selection method and strength of a random item request
+    filetype = data.get("type")
+    tags_data = data.get("tags")
+
+    tags = defaultdict(list)
+    random_selection_method = "uniform"
+
+    for tag in tags_data:
+        name = tag["name"].strip().lower()
+        condition = tag["condition"]
+        value = tag["value"].strip().lower()
+
+        if condition not in TAG_STYLE_OPTIONS:
+            raise Exception("Condition not recognised")
+
+        tags[(name, condition)].append(value)
+
+    tags[("state", TagConditions.Is.value)] += [
+        int(FileState.NeedsLabel),
+        int(FileState.NeedsTags),
+        int(FileState.NeedsClip),
+        int(FileState.Complete),
+    ]
+
+    tags = override_random_item(tags, filetype)
+    random_strength = 2
+
+    for k, v in tags.items():
+        # Gathering distinct
+        v = list(set(v))
+        tags[k] = v
+
+    for k, v in list(tags.items()):
+        # With the keyword all we remove all conditions for that tag
+        if "all" in v:
+            tags.pop(k)
+        # On the "play" keyword we start auto-queueing images
+        elif k[0] == "play":
+            tags.pop(k)
+        elif k[0] == "random":
+            tags.pop(k)
+            random_selection_method = v[0]
+        elif k[0] == "randomstrength":
+            tags.pop(k)
+            random_strength = float(v[0])
+
+    return tags, random_selection_method, random_strength
+
+
+def get_media_url(item_id, width=None, format_name=None):
+    # The ItemMedia URL, asking for a rendition when a width or format is given
+    url = reverse("item_media", args=[item_id])
+    query = {
+        key: value
+        for key, value in (("width", width), ("image_format", format_name))
+        if value is not None
+    }
+    return f"{url}?{urlencode(query)}" if query else url
+
+
+def item_file_response(item_info, response=None):
+    if response is None:
+        path = item_info["path"]
+        mime_type = item_info["mime_type"]
+
+        # Open the file as a stream
+        file_handle = open(path, "rb")
+
+        response = FileResponse(file_handle, content_type=mime_type)
+
+    # Add metadata to headers (must be strings)
+    response["X-Item-ID"] = str(item_info["id"])
+    response["X-Label"] = item_info["label"]
+    response["X-Width"] = str(item_info["width"])
+    response["X-Height"] = str(item_info["height"])
+    response["X-Media-Type"] = (
+        "image" if item_info["filetype"] == int(FileType.Image) else "video"
+    )
+
+    return response
+
+
+def get_byte_range(range_header, size):
+    # (start, end) of a single "bytes=" range, end inclusive. None when there's no
+    # range to honour: missing, malformed or several ranges, which get the whole file
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+
+    ranges = range_header[len("bytes=") :].split(",")
+    if len(ranges) != 1:
+        return None
+
+    start, _, end = ranges[0].strip().partition("-")
+    try:
+        if start == "":
+            # A suffix, the last n bytes
+            return max(size - int(end), 0), size - 1
+
+        start = int(start)
+        if end == "":
+            return start, size - 1
+
+        # A last byte before the first is an invalid range, ignored like a malformed one
+        end = int(end)
+        if end < start:
+            return None
+        return start, min(end, size - 1)
+    except ValueError:
+        return None
+
+
+def read_file_range(path, start, length):
+    with open(path, "rb") as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(MEDIA_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def item_media_response(request, item_info):
+    # item_file_response for GETs, with validators so browsers revalidate rather than
+    # download again, and byte ranges so videos can seek
+    path = item_info["path"]
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        # An item whose file was removed outside the app
+        return Response({"message": "Item file not found"}, status=404)
+
+    # The file is replaced, not edited in place, whenever an item changes
+    etag = f'"{item_info["id"]}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = http_date(stat.st_mtime)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+
+    if response is None:
+        byte_range = get_byte_range(request.headers.get("Range"), stat.st_size)
+
+        # A range is only for the version of the file the client already has part of
+        if_range = request.headers.get("If-Range")
+        if if_range is not None and if_range not in (etag, last_modified):
+            byte_range = None
+
+        if byte_range is None:
+            response = item_file_response(item_info)
+
+        elif byte_range[0] >= stat.st_size:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+
+        else:
+            start, end = byte_range
+            response = item_file_response(
+                item_info,
+                StreamingHttpResponse(
+                    read_file_range(path, start, end - start + 1),
+                    status=206,
+                    content_type=item_info["mime_type"],
+                ),
+            )
+            response["Content-Length"] = str(end - start + 1)
+            response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
+    response["Accept-Ranges"] = "bytes"
+    # Cached by the browser, and checked with If-None-Match before each use
+    response["Cache-Control"] = "private, no-cache"
+
+    return response
+
+
+class RandomItem(APIView):
+    authentication_classes = [CookieTokenAuthentication]
+    permission_classes = [IsAuthenticated]
 
-            # Open the file as a stream
-            file_handle = open(path, "rb")
+    def post(self, request):
+        try:
+            tags, random_selection_method, random_strength = get_random_item_query(
+                request.data
+            )
 
-            response = FileResponse(file_handle, content_type=mime_type)
-            # Add metadata to headers (must be strings)
-            response["X-Item-ID"] = str(random_id)
-            response["X-Label"] = item_info["label"]
-            response["X-Width"] = str(item_info["width"])
-            response["X-Height"] = str(item_info["height"])
-            response["X-Media-Type"] = (
-                "image" if item_info["filetype"] == int(FileType.Image) else "video"
+            item_info = RandomSampler.choose(
+                tags, random_selection_method, random_strength
             )
 
+            if item_info is None:
+                return HttpResponseBadRequest("No IDs match the given criteria.")
+
+            width = request.data.get("width")
+            format_name = request.data.get("image_format")
+            try:
+                media_info = get_rendition_data(item_info, width, format_name)
+            except ValueError as e:
+                return HttpResponseBadRequest(str(e))
+
+            response = item_file_response(media_info)
+            # A GET-able, cacheable and seekable URL for the same file
+            response["X-Media-URL"] = get_media_url(item_info["id"], width, format_name)
             return response
 
         except Exception as e:
@@ -237,6 +441,89 @@ class RandomItem(APIView):
             raise e
 
 
+class RandomItems(APIView):
+    authentication_classes = [CookieTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    # The next few random items for the viewer, as metadata and a URL to load each
+    # from, so it can fetch ahead while one is on screen
+    def post(self, request):
+        try:
+            tags, random_selection_method, random_strength = get_random_item_query(
+                request.data
+            )
+            count = int(request.data.get("count", RANDOM_ITEMS_DEFAULT))
+
+            if not 0 < count <= RANDOM_ITEMS_MAX:
+                return HttpResponseBadRequest(
+                    f"Count must be between 1 and {RANDOM_ITEMS_MAX}."
+                )
+
+            # Checked here, rather than when each URL is loaded
+            width = request.data.get("width")
+            format_name = request.data.get("image_format")
+            try:
+                parse_rendition_request(width, format_name)
+            except ValueError as e:
+                return HttpResponseBadRequest(str(e))
+
+            # Each viewer tab sends its own session, so tabs don't share a queue
+            session = (request.user.id, str(request.data.get("session", "")))
+            items = RandomQueues.next(
+                session, tags, count, random_selection_method, random_strength
+            )
+
+            if len(items) == 0:
+                return HttpResponseBadRequest("No IDs match the given criteria.")
+
+            # Renditions are made when each URL is first loaded, not here
+            return Response(
+                {
+                    "items": [
+                        {
+                            "id": item_info["id"],
+                            "label": item_info["label"],
+                            "width": item_info["width"],
+                            "height": item_info["height"],
+                            "media_type": "image"
+                            if item_info["filetype"] == int(FileType.Image)
+                            else "video",
+                            "mime_type": item_info["mime_type"],
+                            "url": get_media_url(item_info["id"], width, format_name),
+                        }
+                        for item_info in items
+                    ]
+                }
+            )
+
+        except Exception as e:
+            print(e)
+            raise e
+
+
+class ItemMedia(APIView):
+    authentication_classes = [CookieTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, item_id):
+        item_info = get_item_data(item_id)
+
+        if item_info is None:
+            return Response({"message": "Item not found"}, status=404)
+
+        # ?width=&image_format= ask for a smaller copy of an image (DRF owns ?format=)
+        try:
+            item_info = get_rendition_data(
+                item_info,
+                request.query_params.get("width"),
+                request.query_params.get("image_format"),
+            )
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+        return item_media_response(request, item_info)
+
+
 class DeleteItem(APIView):
     authentication_classes = [CookieTokenAuthentication]
     permission_classes = [IsAuthenticated]
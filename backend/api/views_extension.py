@@ -1,40 +1,70 @@
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from functools import reduce
 import operator
-from django.db.models import Q
+import time
+from django.db import DatabaseError, transaction
+from django.db.models import Min, Q
 from collections import defaultdict
-from PIL import ImageFile, Image
+from PIL import ImageFile, Image, features
 import numpy as np
 import base64
 import io
 import random
-from heapq import heappush, heappop
+import uuid
 from api.models import (
     Item,
     FileState,
     FileType,
     create_item,
     Tags,
+    EmbeddingJobs,
     get_file_properties,
+    get_filetype,
+    CompiledRules,
     Rules,
     TagConditions,
 )
 import os
 from api.utils.process_images import (
     get_crop_image_and_bounds,
+    get_bounds_batch,
     crop_and_resize_image,
     apply_rgb_curves,
     rotate_image_90,
+    get_bounding_box_model,
     MEDIA_HEIGHT,
 )
-from api.utils.key_paths import UNPROCESSED_PATH
-import torch
-from transformers import CLIPProcessor, CLIPModel
+from api.utils.key_paths import (
+    UNPROCESSED_PATH,
+    EMBEDDING_INDEX_PATH,
+    INFERENCE_BACKEND,
+    THUMBNAILS_PATH,
+    RENDITIONS_PATH,
+    PREVIEWS_PATH,
+    THUMBNAIL_CACHE_MB,
+    QUERY_DEBUG,
+)
+from api.utils.ann_index import IVFIndex
+from api.utils.video_probe import probe_mp4_dimensions
+from api.utils.renditions import SUPPORTED_FORMATS, encode_rendition
+from api.utils.video_previews import encode_preview, extract_poster
+from api.utils.inference import (
+    ONNX_BACKEND,
+    create_session,
+    export_clip_image_model,
+    get_clip_image_features,
+    get_model_path,
+)
 from pathlib import Path
 from api.utils.overrides import add_tag_override
-from collections import deque
+from collections import deque, OrderedDict
+from threading import Lock, RLock, Event, Thread, get_ident
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 
 TAG_STYLE_OPTIONS = (
     TagConditions.Is.value,
@@ -46,7 +76,38 @@ TAG_STYLE_OPTIONS = (
 )
 
 DEFAULT_THUMBNAIL_SIZE = 200
-THUMBNAIL_CACHE_SIZE = 1000
+THUMBNAIL_CACHE_BYTES = THUMBNAIL_CACHE_MB * 1024 * 1024
+THUMBNAIL_BUCKETS = (200, 400, 800)  # Sizes stored on disk, larger requests decode
+THUMBNAIL_QUALITY = 90
+RENDITION_WIDTHS = (320, 480, 720, 1080)  # Widths stored, requests round up to one
+RENDITION_WORKERS = 2  # Processes encoding renditions
+RENDITION_TIMEOUT = (
+    20  # Seconds a request waits for an encode before getting the original
+)
+EMBEDDING_DTYPE = np.float32
+
+ANN_MIN_ITEMS = 20000  # Below this, similarity queries scan every embedding
+ANN_PROBE_LISTS = 16  # IVF lists scanned per approximate query
+ANN_RETRAIN_GROWTH = 2  # Retrain the IVF index once the data doubles
+COMPARISON_SHORTLIST_SIZE = 500
+
+CLIP_BATCH_SIZE = 32  # Images per CLIP forward pass
+CLIP_LOAD_WORKERS = 4  # Threads decoding and resizing images for CLIP
+EMBEDDING_WORKER_INTERVAL = 5  # Seconds between checks of the embedding job queue
+EMBEDDING_CLAIM_TIMEOUT = (
+    600  # Seconds before a claimed job is retried, the worker may have died
+)
+EMBEDDING_REFRESH_INTERVAL = (
+    5  # Seconds between checks for embeddings changed by another process
+)
+CROP_PREFETCH_ITEMS = 8  # NeedsCrop items kept ready ahead of the crop application
+CROP_BATCH_SIZE = 4  # Images per bounding box forward pass when prefetching
+FILE_WORKERS = 8  # Threads resizing, moving and ingesting files
+SAMPLER_CACHE_QUERIES = 32  # Tag queries whose matches are kept for random draws
+SAMPLER_REFRESH_INTERVAL = 5  # Seconds before matches are queried again
+RANDOM_QUEUE_SIZE = 50  # Random items drawn ahead for each viewer session
+RANDOM_QUEUE_TTL = 60  # Seconds before a viewer's queue is drawn again
+RANDOM_QUEUE_SESSIONS = 64  # Viewer queues kept, least recently used dropped first
 
 
 def get_next_crop_item(crop_max_height):
@@ -55,11 +116,151 @@ def get_next_crop_item(crop_max_height):
     if not item:
         return None
 
-    image, bounds = get_crop_image_and_bounds(item.getpath(), crop_max_height)
+    prefetched = CropPrefetcher.take(item.id, item.getpath(), crop_max_height)
+
+    if prefetched is None:
+        image, bounds = get_crop_image_and_bounds(item.getpath(), crop_max_height)
+    else:
+        image, bounds = prefetched
 
     return image, bounds, item.id
 
 
+def get_modified_time(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class CropPrefetcher:
+    """
+    Keeps the resized images and bounds of the next NeedsCrop items ready on a
+    background thread, so the crop application doesn't wait on the bounding box
+    model between items. Entries are keyed by item id and checked against the
+    file's modified time when taken.
+    """
+
+    prefetched = {}  # item_id -> (modified_time, crop_max_height, image, bounds)
+    current_id = None  # Item being shown, which is not prefetched
+    crop_max_height = None
+
+    lock = Lock()
+    wake = Event()
+    thread = None
+
+    @classmethod
+    def start(cls, crop_max_height):
+        with cls.lock:
+            cls.crop_max_height = crop_max_height
+
+            if cls.thread is None:
+                cls.thread = Thread(target=cls.run, daemon=True)
+                cls.thread.start()
+
+        cls.wake.set()
+
+    @classmethod
+    def run(cls):
+        while True:
+            cls.wake.wait()
+            cls.wake.clear()
+
+            try:
+                cls.fill()
+            except Exception as e:
+                print(f"Crop prefetch failed: {e}")
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.prefetched = {}
+            cls.current_id = None
+
+    @classmethod
+    def take(cls, item_id, path, crop_max_height):
+        # Returns (image, bounds) if the item is ready and unchanged, else None
+        with cls.lock:
+            cls.current_id = item_id
+            entry = cls.prefetched.pop(item_id, None)
+
+        # Refill behind the item being taken
+        cls.wake.set()
+
+        if entry is None:
+            return None
+
+        modified_time, prefetched_height, image, bounds = entry
+        if modified_time != get_modified_time(path):
+            return None
+        if prefetched_height != crop_max_height:
+            return None
+
+        return image, bounds
+
+    @classmethod
+    def fill(cls):
+        with cls.lock:
+            crop_max_height = cls.crop_max_height
+            current_id = cls.current_id
+
+        if crop_max_height is None:
+            return
+
+        items = list(
+            Item.objects.filter(state=int(FileState.NeedsCrop))
+            .exclude(id=current_id)
+            .order_by("id")[:CROP_PREFETCH_ITEMS]
+        )
+        paths = {item.id: item.getpath() for item in items}
+
+        with cls.lock:
+            # Drop items that have been cropped, deleted or fallen out of the window
+            cls.prefetched = {
+                item_id: entry
+                for item_id, entry in cls.prefetched.items()
+                if item_id in paths
+                and entry[0] == get_modified_time(paths[item_id])
+                and entry[1] == crop_max_height
+            }
+            missing = [item_id for item_id in paths if item_id not in cls.prefetched]
+
+        def load(item_id):
+            path = paths[item_id]
+            modified_time = get_modified_time(path)
+            try:
+                image = get_crop_image_and_bounds(
+                    path, crop_max_height, include_bounds=False
+                )
+            except Exception as e:
+                print(f"Could not prefetch item {item_id}: {e}")
+                return None
+            return item_id, modified_time, image
+
+        with ThreadPoolExecutor(max_workers=CLIP_LOAD_WORKERS) as pool:
+            for start in range(0, len(missing), CROP_BATCH_SIZE):
+                loaded = [
+                    result
+                    for result in pool.map(
+                        load, missing[start : start + CROP_BATCH_SIZE]
+                    )
+                    if result is not None
+                ]
+                all_bounds = get_bounds_batch([image for _, _, image in loaded])
+
+                with cls.lock:
+                    for (item_id, modified_time, image), bounds in zip(
+                        loaded, all_bounds
+                    ):
+                        if item_id != cls.current_id:
+                            cls.prefetched[item_id] = (
+                                modified_time,
+                                crop_max_height,
+                                image,
+                                bounds,
+                            )
+
+
 def get_next_tag_item(else_tag_random=False):
     item = (
         Item.objects.all()
@@ -112,6 +313,7 @@ def crop_and_resize_from_view(
 
     if save_or_new == "save":
         resized_image.save(old_path)
+        ThumbnailCache.invalidate((item_id,))
 
         edit_item(
             item_id=item_id,
@@ -148,6 +350,13 @@ def delete_items(item_ids):
 
         item.delete()
 
+    EmbeddingStore.remove(item_ids)
+    ThumbnailStore.invalidate(item_ids)
+    RenditionStore.invalidate(item_ids)
+    VideoPreviewStore.invalidate(item_ids)
+    ThumbnailCache.invalidate(item_ids)
+    RandomSampler.invalidate()
+
 
 def delete_items_desktop(item_ids):
     for item_id in item_ids:
@@ -162,6 +371,22 @@ def delete_items_desktop(item_ids):
 
             item.delete()
 
+    EmbeddingStore.remove(item_ids)
+    ThumbnailStore.invalidate(item_ids)
+    RenditionStore.invalidate(item_ids)
+    VideoPreviewStore.invalidate(item_ids)
+    ThumbnailCache.invalidate(item_ids)
+    RandomSampler.invalidate()
+
+
+ITEM_DATA_FIELDS = ("id", "state", "label", "filetype", "width", "height")
+
+
+def get_item_data(item_id):
+    # item_data of a single item, None if it doesn't exist
+    item = Item.objects.only(*ITEM_DATA_FIELDS).filter(id=item_id).first()
+    return None if item is None else item_data(item)[1]
+
 
 def item_data(item):
     return item.id, {
@@ -181,7 +406,34 @@ def item_data(item):
 def get_items_and_paths_from_tags(tags, order_by=None):
     response_results = {}
 
-    objects = Item.objects.all()
+    for item in get_items_from_tags(tags, order_by=order_by):
+        item_id, item_info = item_data(item)
+
+        response_results[item_id] = item_info
+
+    return response_results
+
+
+def has_tag(name, condition=None):
+    # Items with a matching tag, as an "id IN (subquery)" semi-join. Unlike filtering
+    # across the tags relation this never joins, so items aren't repeated. SQLite
+    # runs the subquery once rather than per item, as it would for a correlated EXISTS
+    tags = Tags.objects.filter(name=name)
+    if condition is not None:
+        tags = tags.filter(condition)
+    return Q(id__in=tags.values("item_id"))
+
+
+def explain_query(objects):
+    print(f"SQL: {objects.query}")
+    print(f"Query plan:\n{objects.explain()}")
+
+
+def get_items_from_tags(tags, order_by=None):
+    # Compiles the tags into a single statement over Item, with one IN or NOT IN
+    # subquery per tag condition. Only the columns used by item_data and getpath
+    # are loaded
+    objects = Item.objects.only(*ITEM_DATA_FIELDS)
 
     for z, tagList in tags.items():
         tagName, tagCondition = z
@@ -221,13 +473,7 @@ def get_items_and_paths_from_tags(tags, order_by=None):
         elif tagName == "label":
             if tagCondition == TagConditions.Is.value:
                 objects = objects.filter(
-                    reduce(
-                        operator.or_,
-                        (
-                            Q(label__in=tagList),
-                            Q(tags__name="labelplus", tags__value__in=tagList),
-                        ),
-                    )
+                    Q(label__in=tagList) | has_tag("labelplus", Q(value__in=tagList))
                 )  # Labelplus support
             elif tagCondition == TagConditions.IsNot.value:
                 objects = objects.exclude(label__in=tagList)
@@ -300,43 +546,267 @@ def get_items_and_paths_from_tags(tags, order_by=None):
         else:
             # Generic tags
             if tagCondition == TagConditions.Is.value:
-                objects = objects.filter(tags__name=tagName, tags__value__in=tagList)
+                objects = objects.filter(has_tag(tagName, Q(value__in=tagList)))
             elif tagCondition == TagConditions.IsNot.value:
-                objects = objects.exclude(tags__name=tagName, tags__value__in=tagList)
+                objects = objects.filter(~has_tag(tagName, Q(value__in=tagList)))
             elif tagCondition == TagConditions.Contains.value:
                 objects = objects.filter(
-                    reduce(
-                        operator.or_,
-                        (
-                            Q(tags__name=tagName, tags__value__contains=t)
-                            for t in tagList
-                        ),
+                    has_tag(
+                        tagName,
+                        reduce(operator.or_, (Q(value__contains=t) for t in tagList)),
                     )
                 )
             elif tagCondition == TagConditions.DoesNotContain.value:
-                objects = objects.exclude(
-                    reduce(
-                        operator.or_,
-                        (
-                            Q(tags__name=tagName, tags__value__contains=t)
-                            for t in tagList
-                        ),
+                objects = objects.filter(
+                    ~has_tag(
+                        tagName,
+                        reduce(operator.or_, (Q(value__contains=t) for t in tagList)),
                     )
                 )
             elif tagCondition == TagConditions.IsNull.value:
-                objects = objects.filter(tags__name=tagName, tags__value__isnull=True)
+                objects = objects.filter(has_tag(tagName, Q(value__isnull=True)))
             elif tagCondition == TagConditions.IsNotNull.value:
-                objects = objects.exclude(tags__name=tagName)
+                objects = objects.filter(~has_tag(tagName))
 
     if order_by is not None:
         objects = objects.order_by(*order_by)
 
-    for item in objects:
-        item_id, item_info = item_data(item)
+    if QUERY_DEBUG:
+        explain_query(objects)
 
-        response_results[item_id] = item_info
+    return objects
 
-    return response_results
+
+class RandomSampler:
+    """
+    The matches of recent random item queries, kept as arrays of ids and label
+    codes ordered by id, with cumulative weights per selection method. A draw is a
+    binary search over the weights, and only the chosen item is loaded. Cleared by
+    writes in this process, and re-queried after SAMPLER_REFRESH_INTERVAL to pick
+    up writes from the desktop applications.
+    """
+
+    entries = OrderedDict()  # Normalised query -> candidates, most recent last
+    generation = 0  # Bumped on every write, entries from older generations are stale
+    rng = np.random.default_rng()
+
+    lock = Lock()
+
+    @classmethod
+    def get_key(cls, tags):
+        # The same query whatever the order of its conditions and values
+        return tuple(
+            sorted(
+                (name, condition, tuple(sorted({str(value) for value in values})))
+                for (name, condition), values in tags.items()
+            )
+        )
+
+    @classmethod
+    def get_candidates(cls, tags):
+        key = cls.get_key(tags)
+
+        with cls.lock:
+            candidates = cls.entries.get(key)
+            if (
+                candidates is not None
+                and candidates["generation"] == cls.generation
+                and time.monotonic() - candidates["created_at"]
+                <= SAMPLER_REFRESH_INTERVAL
+            ):
+                cls.entries.move_to_end(key)
+                return candidates
+            generation = cls.generation
+
+        rows = list(
+            get_items_from_tags(tags, order_by=("id",)).values_list("id", "label")
+        )
+        ids, labels = zip(*rows) if rows else ((), ())
+        _, label_codes = np.unique(np.array(labels, dtype=str), return_inverse=True)
+
+        candidates = {
+            "ids": np.array(ids, dtype=np.int64),
+            "label_codes": label_codes.reshape(-1),
+            "cumulative_weights": {},
+            "generation": generation,
+            "created_at": time.monotonic(),
+        }
+
+        with cls.lock:
+            # A write while querying leaves the result usable for this draw only
+            if generation == cls.generation:
+                cls.entries[key] = candidates
+                cls.entries.move_to_end(key)
+                while len(cls.entries) > SAMPLER_CACHE_QUERIES:
+                    cls.entries.popitem(last=False)
+
+        return candidates
+
+    @classmethod
+    def get_weights(cls, candidates, method="uniform", strength=2):
+        # Weights by position, None for uniform. Unknown methods are uniform
+        n = len(candidates["ids"])
+
+        if method == "recent":
+            # The newest item is weighted 1 + strength times the oldest, so for
+            # strength 2 the most recent of 10,000 has 1/5000 and the least 1/15000
+            return 1 / ((strength + 1) * n / strength - np.arange(n))
+
+        if method in ("sparse", "dense"):
+            # Items from large classes are weighted by 1/sqrt(size) for sparse, so
+            # small classes come up more often, or sqrt(size) for dense
+            class_sizes = np.bincount(candidates["label_codes"])
+            exponent = -0.5 if method == "sparse" else 0.5
+            return class_sizes[candidates["label_codes"]] ** exponent
+
+        return None
+
+    @classmethod
+    def draw(cls, candidates, method="uniform", strength=2):
+        ids = candidates["ids"]
+        key = (method, strength)
+
+        with cls.lock:
+            cumulative_weights = candidates["cumulative_weights"].get(key)
+
+        if cumulative_weights is None:
+            weights = cls.get_weights(candidates, method, strength)
+            cumulative_weights = None if weights is None else np.cumsum(weights)
+            with cls.lock:
+                candidates["cumulative_weights"][key] = cumulative_weights
+
+        with cls.lock:
+            if cumulative_weights is None:
+                return int(ids[cls.rng.integers(len(ids))])
+
+            target = cls.rng.random() * cumulative_weights[-1]
+
+        index = np.searchsorted(cumulative_weights, target, side="right")
+        return int(ids[min(index, len(ids) - 1)])
+
+    @classmethod
+    def draw_many(cls, candidates, count, method="uniform", strength=2, exclude=()):
+        # Up to count distinct ids, leaving out those in exclude
+        ids = candidates["ids"]
+        weights = cls.get_weights(candidates, method, strength)
+        weights = np.ones(len(ids)) if weights is None else weights.astype(np.float64)
+
+        if exclude:
+            weights[np.isin(ids, list(exclude))] = 0
+
+        count = min(count, np.count_nonzero(weights))
+        if count == 0:
+            return []
+
+        with cls.lock:
+            indices = cls.rng.choice(
+                len(ids), size=count, replace=False, p=weights / weights.sum()
+            )
+
+        return [int(item_id) for item_id in ids[indices]]
+
+    @classmethod
+    def choose(cls, tags, method="uniform", strength=2):
+        # item_data of a random match, None if nothing matches
+        for _ in range(3):
+            candidates = cls.get_candidates(tags)
+            if len(candidates["ids"]) == 0:
+                return None
+
+            item_info = get_item_data(cls.draw(candidates, method, strength))
+            if item_info is not None:
+                return item_info
+
+            # Deleted by another process since the matches were cached
+            cls.invalidate()
+
+        return None
+
+    @classmethod
+    def invalidate(cls):
+        with cls.lock:
+            cls.generation += 1
+            cls.entries.clear()
+
+
+class RandomQueues:
+    """
+    Random items drawn ahead for each viewer session and query, so asking for the
+    next few items only loads them. Queues are refilled without repeating what they
+    hold, and dropped after RANDOM_QUEUE_TTL or when the sampler sees a write.
+    """
+
+    queues = OrderedDict()  # (session, query, method, strength) -> queue
+    lock = Lock()
+
+    @classmethod
+    def get_queue(cls, key):
+        now = time.monotonic()
+
+        with cls.lock:
+            queue = cls.queues.get(key)
+            if (
+                queue is None
+                or queue["generation"] != RandomSampler.generation
+                or now - queue["created_at"] > RANDOM_QUEUE_TTL
+            ):
+                queue = {
+                    "ids": deque(),
+                    "generation": RandomSampler.generation,
+                    "created_at": now,
+                    "lock": Lock(),
+                }
+                cls.queues[key] = queue
+
+            cls.queues.move_to_end(key)
+            while len(cls.queues) > RANDOM_QUEUE_SESSIONS:
+                cls.queues.popitem(last=False)
+
+            return queue
+
+    @classmethod
+    def next(cls, session, tags, count, method="uniform", strength=2):
+        # item_data of up to count distinct random matches, in draw order
+        queue = cls.get_queue((session, RandomSampler.get_key(tags), method, strength))
+        items = []
+
+        with queue["lock"]:
+            # Items deleted since they were queued are skipped, with a few refills
+            for _ in range(3):
+                needed = count - len(items)
+                if len(queue["ids"]) < needed:
+                    queue["ids"].extend(
+                        RandomSampler.draw_many(
+                            RandomSampler.get_candidates(tags),
+                            max(RANDOM_QUEUE_SIZE, needed) - len(queue["ids"]),
+                            method,
+                            strength,
+                            exclude=set(queue["ids"]) | {item["id"] for item in items},
+                        )
+                    )
+
+                item_ids = [
+                    queue["ids"].popleft()
+                    for _ in range(min(needed, len(queue["ids"])))
+                ]
+                if not item_ids:
+                    break
+
+                found = Item.objects.only(*ITEM_DATA_FIELDS).in_bulk(item_ids)
+                items += [
+                    item_data(found[item_id])[1]
+                    for item_id in item_ids
+                    if item_id in found
+                ]
+                if len(items) == count:
+                    break
+
+        return items
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.queues.clear()
 
 
 def add_tags(id_to_tag_dictionary):
@@ -355,29 +825,45 @@ def add_tags(id_to_tag_dictionary):
     """
 
     id_to_tag_dictionary = add_tag_override(id_to_tag_dictionary)
+    check_tag_names(id_to_tag_dictionary)
+
+    # Ordered, so tags are added in the order given
+    triples = dict.fromkeys(
+        (int(item_id), tag_name, value)
+        for item_id, tag_dict in id_to_tag_dictionary.items()
+        for tag_name, tag_values in tag_dict.items()
+        for value in tag_values
+    )
+    if not triples:
+        return
 
-    for item_id, tag_dict in id_to_tag_dictionary.items():
-        for tag_name, tag_values in tag_dict.items():
-            # Can't add these tags
-            if tag_name in ("state", "label", "filetype"):
-                raise Exception(f"Tag forbidden: {tag_name} {tag_values}")
+    item_ids = {item_id for item_id, _, _ in triples}
+    tag_names = {tag_name for _, tag_name, _ in triples}
 
-            for value in tag_values:
-                # Only add tag if it doesn't exist already
-                if (
-                    len(
-                        Item.objects.filter(
-                            id=item_id, tags__name=tag_name, tags__value=value
-                        )
-                    )
-                    > 0
-                ):
-                    continue
-                Tags.objects.create(
-                    item_id=Item.objects.filter(id=item_id).get(),
-                    name=tag_name,
-                    value=value,
-                )
+    with transaction.atomic():
+        found_ids = set(
+            Item.objects.filter(id__in=item_ids).values_list("id", flat=True)
+        )
+        if found_ids != item_ids:
+            raise Item.DoesNotExist(f"Items not found: {sorted(item_ids - found_ids)}")
+
+        existing = set(
+            Tags.objects.filter(item_id__in=item_ids, name__in=tag_names).values_list(
+                "item_id", "name", "value"
+            )
+        )
+
+        # Conflicts are still ignored, in case another thread adds the same tag
+        Tags.objects.bulk_create(
+            (
+                Tags(item_id_id=item_id, name=tag_name, value=value)
+                for item_id, tag_name, value in triples
+                if (item_id, tag_name, value) not in existing
+            ),
+            ignore_conflicts=True,
+        )
+
+    RandomSampler.invalidate()
 
 
 def remove_tags(id_to_tag_dictionary):
@@ -394,109 +880,282 @@ def remove_tags(id_to_tag_dictionary):
         },
     }
     """
+    check_tag_names(id_to_tag_dictionary)
+
+    # Items removing the same values share one condition, keeping the query short
+    item_ids_by_tag = defaultdict(set)
     for item_id, tag_dict in id_to_tag_dictionary.items():
         for tag_name, tag_values in tag_dict.items():
+            if tag_values:
+                item_ids_by_tag[(tag_name, frozenset(tag_values))].add(item_id)
+
+    if not item_ids_by_tag:
+        return
+
+    with transaction.atomic():
+        Tags.objects.filter(
+            reduce(
+                operator.or_,
+                (
+                    Q(item_id__in=item_ids, name=tag_name, value__in=tag_values)
+                    for (tag_name, tag_values), item_ids in item_ids_by_tag.items()
+                ),
+            )
+        ).delete()
+
+    RandomSampler.invalidate()
+
+
+def check_tag_names(id_to_tag_dictionary):
+    for tag_dict in id_to_tag_dictionary.values():
+        for tag_name, tag_values in tag_dict.items():
+            # Can't add or remove these tags
             if tag_name in ("state", "label", "filetype"):
                 raise Exception(f"Tag forbidden: {tag_name} {tag_values}")
 
-            for value in tag_values:
-                tag_item = Tags.objects.filter(
-                    item_id=item_id, name=tag_name, value=value
-                )
-                tag_item.delete()
+
+def add_rule(label, tag_name, tag_value):
+    tag_name = tag_name.strip()
+    tag_value = tag_value.strip()
+
+    # A rule add_tags would refuse is never stored
+    check_tag_names({None: {tag_name: [tag_value]}})
+
+    if Rules.objects.filter(
+        label=label, tag_name=tag_name, tag_value=tag_value
+    ).exists():
+        return
+
+    Rules.objects.create(
+        label=label,
+        tag_name=tag_name,
+        tag_value=tag_value,
+    )
+    CompiledRules.invalidate()
+
+    # Existing items with the label are tagged too
+    reapply_rules(labels=[label])
+
+
+def reapply_rules(labels=None):
+    # Adds every rule's tags that labelled items are missing, returning the number
+    # added. The missing (item, tag) pairs are one set difference, inserted in bulk
+    table = CompiledRules.get_table()
+    if labels is not None:
+        table = {label: table[label] for label in labels if label in table}
+
+    tag_names = {tag_name for tags in table.values() for tag_name in tags}
+    if not tag_names:
+        return 0
+
+    wanted = {
+        (item_id, tag_name, tag_value)
+        for item_id, label in Item.objects.filter(label__in=table)
+        .exclude(label="")
+        .values_list("id", "label")
+        for tag_name, tag_values in table[label].items()
+        for tag_value in tag_values
+    }
+    existing = set(
+        Tags.objects.filter(name__in=tag_names, item_id__label__in=table).values_list(
+            "item_id", "name", "value"
+        )
+    )
+
+    # The same override and checks as tags added through add_tags
+    id_to_tag_dictionary = defaultdict(lambda: defaultdict(list))
+    for item_id, tag_name, tag_value in sorted(wanted - existing):
+        id_to_tag_dictionary[item_id][tag_name].append(tag_value)
+    id_to_tag_dictionary = add_tag_override(
+        {item_id: dict(tags) for item_id, tags in id_to_tag_dictionary.items()}
+    )
+    check_tag_names(id_to_tag_dictionary)
+
+    missing = [
+        triple
+        for triple in dict.fromkeys(
+            (int(item_id), tag_name, tag_value)
+            for item_id, tags in id_to_tag_dictionary.items()
+            for tag_name, tag_values in tags.items()
+            for tag_value in tag_values
+        )
+        if triple not in existing
+    ]
+    if not missing:
+        return 0
+
+    Tags.objects.bulk_create(
+        (
+            Tags(item_id_id=item_id, name=tag_name, value=tag_value)
+            for item_id, tag_name, tag_value in missing
+        ),
+        batch_size=5000,
+        ignore_conflicts=True,
+    )
+    RandomSampler.invalidate()
+
+    return len(missing)
 
 
 def edit_item(item_id, new_state=None, new_label=None, new_width=None, new_height=None):
-    item = Item.objects.all().filter(id=item_id).get()
+    edit_items(
+        (item_id,),
+        new_state=new_state,
+        new_label=new_label,
+        new_width=new_width,
+        new_height=new_height,
+    )
 
-    # If the embedding already exists, and the width or height has changed, or we are in the needsmodify state, we re-embed the item
-    if (
-        (new_width is not None and new_width != item.width)
-        or (new_height is not None and new_height != item.height)
-        or item.state == int(FileState.NeedsModify)
-    ) and item.embedding is not None:
-        np_embedding = ClipModel.process_item(item.id)
-        b64string = ClipModel.np_to_base64(np_embedding)
-        item.embedding = b64string
-        item.save()
 
-    old_path = item.getpath()
+def edit_items(
+    item_ids, new_state=None, new_label=None, new_width=None, new_height=None
+):
+    # Applies the same edit to every item. Database writes share one transaction,
+    # rules are applied once per label, and files are resized and moved on a pool
+    item_ids = list(dict.fromkeys(int(item_id) for item_id in item_ids))
+    items_by_id = Item.objects.defer("embedding").in_bulk(item_ids)
+
+    missing_ids = [item_id for item_id in item_ids if item_id not in items_by_id]
+    if missing_ids:
+        raise Item.DoesNotExist(f"Items not found: {missing_ids}")
+
+    items = [items_by_id[item_id] for item_id in item_ids]
+    embedded_ids = set(
+        Item.objects.filter(id__in=item_ids, embedding__isnull=False).values_list(
+            "id", flat=True
+        )
+    )
 
-    if new_state is not None:
-        # If we're in a labelled state but there's no label, raise an exception
+    old_paths = {}
+    old_dimensions = {}
+    needs_embedding = []
+
+    for item in items:
+        label = new_label
+
+        # If the embedding already exists, and the width or height has changed, or we are in the needsmodify state, we re-embed the item
+        # This is queued for the embedding worker, once the item has been saved and moved below
         if (
-            new_state
-            in (
-                int(FileState.NeedsClip),
-                int(FileState.NeedsTags),
-                int(FileState.Complete),
-            )
-            and item.label == ""
-            and new_label is None
-        ):
-            raise Exception(
-                f"File state error: label not provided. {item.id} {item.state} {item.label} {new_state}"
-            )
+            (new_width is not None and new_width != item.width)
+            or (new_height is not None and new_height != item.height)
+            or item.state == int(FileState.NeedsModify)
+        ) and item.id in embedded_ids:
+            needs_embedding.append(item.id)
+
+        old_paths[item.id] = item.getpath()
+        old_dimensions[item.id] = (item.width, item.height)
+
+        if new_state is not None:
+            # If we're in a labelled state but there's no label, raise an exception
+            if (
+                new_state
+                in (
+                    int(FileState.NeedsClip),
+                    int(FileState.NeedsTags),
+                    int(FileState.Complete),
+                )
+                and item.label == ""
+                and label is None
+            ):
+                raise Exception(
+                    f"File state error: label not provided. {item.id} {item.state} {item.label} {new_state}"
+                )
 
-        # If we're moving to an unlabelled state, remove the label
-        if new_state in (
-            int(FileState.NeedsLabel),
-            int(FileState.NeedsCrop),
-            int(FileState.NeedsModify),
-        ):
-            new_label = ""
+            # If we're moving to an unlabelled state, remove the label
+            if new_state in (
+                int(FileState.NeedsLabel),
+                int(FileState.NeedsCrop),
+                int(FileState.NeedsModify),
+            ):
+                label = ""
 
-        item.state = new_state
+            item.state = new_state
 
-    # Assign a labelplus label of the new label
-    if new_label is not None:
-        item.label = new_label
-        if new_label != "":
-            add_tags(
-                {
-                    item.id: {
-                        "labelplus": [
-                            new_label,
-                        ]
-                    }
-                }
-            )
+        if label is not None:
+            item.label = label
 
-    if new_width is not None:
-        item.width = new_width
+        if new_width is not None:
+            item.width = new_width
 
-    if new_height is not None:
-        item.height = new_height
+        if new_height is not None:
+            item.height = new_height
 
     # If we find an incorrectly-sized image, resize it to the correct height. It should have already been embedded, and this is resize-agnostic.
-    if (
-        item.height != MEDIA_HEIGHT
-        and item.filetype == int(FileType.Image)
-        and item.state >= int(FileState.NeedsClip)
-    ):
+    def resize(item):
+        if (
+            item.height == MEDIA_HEIGHT
+            or item.filetype != int(FileType.Image)
+            or item.state < int(FileState.NeedsClip)
+        ):
+            return
+
+        old_path = old_paths[item.id]
         resize_path = old_path if os.path.exists(old_path) else item.getpath()
         image = Image.open(resize_path)
 
-        new_width = int(image.width * MEDIA_HEIGHT / image.height)
+        width = int(image.width * MEDIA_HEIGHT / image.height)
 
-        image = image.resize((new_width, MEDIA_HEIGHT))
+        image = image.resize((width, MEDIA_HEIGHT))
 
         image.save(resize_path)
 
         item.height = MEDIA_HEIGHT
-        item.width = new_width
+        item.width = width
+
+    with ThreadPoolExecutor(max_workers=FILE_WORKERS) as pool:
+        list(pool.map(resize, items))
+
+    with transaction.atomic():
+        Item.objects.bulk_update(
+            items, ["state", "label", "width", "height"], batch_size=500
+        )
 
-    item.save()
-    new_path = item.getpath()
+        # Assign a labelplus label of the new label
+        if new_label is not None:
+            add_tags(
+                {
+                    item.id: {
+                        "labelplus": [
+                            item.label,
+                        ]
+                    }
+                    for item in items
+                    if item.label != ""
+                }
+            )
 
-    # Creating new folder if needed
-    if not os.path.exists(item.getparent()):
-        os.makedirs(item.getparent())
+    # Creating new folders if needed
+    for parent in {item.getparent() for item in items}:
+        os.makedirs(parent, exist_ok=True)
+
+    def move(item):
+        old_path, new_path = old_paths[item.id], item.getpath()
+        if old_path != new_path and os.path.exists(old_path):
+            os.rename(old_path, new_path)
+
+    with ThreadPoolExecutor(max_workers=FILE_WORKERS) as pool:
+        list(pool.map(move, items))
+
+    # New thumbnails are keyed by the new dimensions, so the old ones are removed
+    resized_ids = [
+        item.id
+        for item in items
+        if (item.width, item.height) != old_dimensions[item.id]
+    ]
+    ThumbnailStore.invalidate(resized_ids)
+    RenditionStore.invalidate(resized_ids)
+    VideoPreviewStore.invalidate(resized_ids)
+    ThumbnailCache.invalidate(item_ids)
+    RandomSampler.invalidate()
+
+    for item in items:
+        if item.id in embedded_ids:
+            EmbeddingStore.update(item.id, item.label, item.filetype)
 
-    if old_path != new_path and os.path.exists(old_path):
-        os.rename(old_path, new_path)
+    if needs_embedding:
+        EmbeddingWorker.enqueue(needs_embedding)
 
-    apply_rules(item.id)
+    apply_rules_to_items(items)
 
 
 def upload_item(path):
@@ -511,36 +1170,48 @@ def upload_item(path):
 
 def upload_image(image):
     old_path = None
+    convert = False
 
-    # If the image is a path
+    # If the image is a path, or an upload streamed to a temporary file
     if isinstance(image, str):
         old_path = image
-        image = Image.open(image)
+    elif isinstance(image, TemporaryUploadedFile):
+        old_path = image.temporary_file_path()
 
-    state = int(FileState.NeedsCrop)
-    width, height = get_dimensions(image)
+    if old_path is not None:
+        # Opening is lazy, only the header is read for the dimensions
+        with Image.open(old_path) as opened:
+            width, height = opened.width, opened.height
 
+            # Items are stored as PNG, other uploads are converted as they're placed
+            convert = not isinstance(image, str) and opened.format != "PNG"
+    else:
+        width, height = get_dimensions(image)
+
+    state = int(FileState.NeedsCrop)
     filetype = int(FileType.Image)
     label = ""
 
     item = create_item(
         label=label, state=state, width=width, filetype=filetype, height=height
     )
+    RandomSampler.invalidate()
 
     if old_path is not None:
-        image.close()
-        parent = Path(item.getpath()).parent
-        os.makedirs(parent, exist_ok=True)
-        os.rename(old_path, item.getpath())
+        place_upload(old_path, item, convert)
     else:
         image.save(item.getpath())
 
+    ThumbnailStore.pregenerate(item)
+
 
 def upload_video(video_object):
-    # If the video is a path
+    # If the video is a path, or an upload streamed to a temporary file
     if isinstance(video_object, str):
         old_path = video_object
-    elif type(video_object) in (InMemoryUploadedFile, TemporaryUploadedFile):
+    elif isinstance(video_object, TemporaryUploadedFile):
+        old_path = video_object.temporary_file_path()
+    elif isinstance(video_object, InMemoryUploadedFile):
         # Save to unprocessed
         old_path = f"{UNPROCESSED_PATH}/{video_object.name}"
         FileSystemStorage(location=f"{UNPROCESSED_PATH}").save(
@@ -549,22 +1220,132 @@ def upload_video(video_object):
     else:
         print(f"Warning: videeo uploaded with unrecognised type: {type(video_object)}")
 
-    video = VideoFileClip(old_path)
-    try:
-        state = int(FileState.NeedsLabel)
-        width, height = get_dimensions(video)
-        filetype = int(FileType.Video)
-        label = ""
-    finally:
-        video.close()
+    state = int(FileState.NeedsLabel)
+    width, height = get_video_dimensions(old_path)
+    filetype = int(FileType.Video)
+    label = ""
 
     item = create_item(
         label=label, state=state, width=width, filetype=filetype, height=height
     )
+    RandomSampler.invalidate()
+
+    place_upload(old_path, item)
+
+    VideoPreviewStore.pregenerate(item)
+    ThumbnailStore.pregenerate(item)
+
+
+def place_upload(path, item, convert=False):
+    # Renames a file into place in one step. Images that aren't PNG are converted
+    # beside it first, on the same filesystem
+    converted_path = None
+
+    try:
+        if convert:
+            converted_path = f"{path}.png"
+            with Image.open(path) as image:
+                image.save(converted_path, format="PNG")
 
-    parent = Path(item.getpath()).parent
-    os.makedirs(parent, exist_ok=True)
-    os.rename(old_path, item.getpath())
+        parent = Path(item.getpath()).parent
+        os.makedirs(parent, exist_ok=True)
+        os.replace(converted_path or path, item.getpath())
+        converted_path = None
+
+        # Temporary files are private, items get the permissions FileSystemStorage
+        # would have given them
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.chmod(item.getpath(), settings.FILE_UPLOAD_PERMISSIONS)
+
+    finally:
+        if converted_path is not None and os.path.exists(converted_path):
+            os.remove(converted_path)
+
+
+def read_upload(path, name):
+    # The filetype, dimensions and whether an upload needs converting, from headers
+    filetype = get_filetype(os.path.splitext(name)[1][1:])
+
+    if filetype == int(FileType.Image):
+        with Image.open(path) as image:
+            return filetype, image.width, image.height, image.format != "PNG"
+
+    width, height = get_video_dimensions(path)
+    return filetype, width, height, False
+
+
+def upload_files(files):
+    # Ingests (path, name) uploads together. Headers are read and files placed on a
+    # thread pool, and the items are created in one transaction.
+    # Returns a result per file, in order, with the new item's id or an error
+    results = [{"name": name} for _, name in files]
+
+    with ThreadPoolExecutor(max_workers=FILE_WORKERS) as pool:
+        futures = [pool.submit(read_upload, path, name) for path, name in files]
+
+    uploads = {}
+    for index, future in enumerate(futures):
+        try:
+            uploads[index] = future.result()
+        except Exception as e:
+            results[index]["error"] = str(e)
+
+    state_map = {
+        int(FileType.Image): int(FileState.NeedsCrop),
+        int(FileType.Video): int(FileState.NeedsLabel),
+    }
+
+    with transaction.atomic():
+        items = Item.objects.bulk_create(
+            Item(
+                label="",
+                state=state_map[filetype],
+                filetype=filetype,
+                width=width,
+                height=height,
+            )
+            for filetype, width, height, _ in uploads.values()
+        )
+    items = dict(zip(uploads, items))
+    RandomSampler.invalidate()
+
+    def place(index):
+        place_upload(files[index][0], items[index], convert=uploads[index][3])
+        VideoPreviewStore.pregenerate(items[index])
+        ThumbnailStore.pregenerate(items[index])
+
+    with ThreadPoolExecutor(max_workers=FILE_WORKERS) as pool:
+        futures = {index: pool.submit(place, index) for index in items}
+
+    failed = []
+    for index, future in futures.items():
+        try:
+            future.result()
+            results[index]["id"] = items[index].id
+        except Exception as e:
+            failed.append(items[index].id)
+            results[index]["error"] = str(e)
+
+    # Items whose file couldn't be placed are removed again
+    if failed:
+        Item.objects.filter(id__in=failed).delete()
+        RandomSampler.invalidate()
+
+    return results
+
+
+def get_video_dimensions(path):
+    # MP4 and MOV headers are read directly, anything else is opened with moviepy
+    dimensions = probe_mp4_dimensions(path)
+
+    if dimensions is None:
+        video = VideoFileClip(path)
+        try:
+            dimensions = video.w, video.h
+        finally:
+            video.close()
+
+    return dimensions
 
 
 def get_dimensions(item):
@@ -577,7 +1358,7 @@ def get_dimensions(item):
         if properties["type"] == 0:
             item = Image.open(item)
         elif properties["type"] == 1:
-            item = VideoFileClip(item)
+            return get_video_dimensions(item)
 
         needs_closing = True
 
@@ -649,22 +1430,374 @@ def get_untagged_ids(tag_name, tags_dict):
 def get_thumbnail(item_id, width=DEFAULT_THUMBNAIL_SIZE, height=DEFAULT_THUMBNAIL_SIZE):
     item = Item.objects.all().filter(id=item_id).get()
 
-    if item.filetype == int(FileType.Image):
+    return ThumbnailStore.get(item, width, height)
+
+
+def get_thumbnail_source(item):
+    # Full size image of an item, the poster frame for videos
+    if item.filetype == int(FileType.Image):
         image = Image.open(item.getpath())
-        image.thumbnail((width, height))
 
     elif item.filetype == int(FileType.Video):
-        clip = VideoFileClip(item.getpath())
-        try:
-            frame = clip.get_frame(0.5)
-            image = Image.fromarray(frame)
-            image.thumbnail((width, height))
-        finally:
-            clip.close()
+        image = Image.open(VideoPreviewStore.get_poster(item))
 
     return image
 
 
+class ThumbnailStore:
+    """
+    Thumbnails on disk in a few size buckets, so originals are decoded once rather
+    than on every render. Files are named by item id, the original's modified time
+    and the item's dimensions, so an edited file never serves an old thumbnail.
+    """
+
+    path = THUMBNAILS_PATH
+    buckets = THUMBNAIL_BUCKETS
+    format = "WEBP" if features.check("webp") else "JPEG"
+
+    @classmethod
+    def get_bucket(cls, width, height):
+        # Smallest stored size that can be shrunk to the request, None if too large
+        for bucket in cls.buckets:
+            if width <= bucket and height <= bucket:
+                return bucket
+        return None
+
+    @classmethod
+    def get_path(cls, item, bucket):
+        modified_time = os.stat(item.getpath()).st_mtime_ns
+        return (
+            f"{cls.path}/{bucket}/{item.getstringid()}_{modified_time}"
+            f"_{item.width}x{item.height}.{cls.format.lower()}"
+        )
+
+    @classmethod
+    def get(cls, item, width, height):
+        bucket = cls.get_bucket(width, height)
+
+        if bucket is None:
+            image = get_thumbnail_source(item)
+            image.thumbnail((width, height))
+            return image
+
+        path = cls.get_path(item, bucket)
+        image = None
+
+        # Checked up front, as ultralytics patches Image.open to raise other errors
+        if os.path.exists(path):
+            try:
+                image = Image.open(path)
+                image.load()
+            except OSError:
+                image = None
+
+        if image is None:
+            image = cls.generate(item)[bucket]
+
+        image.thumbnail((width, height))
+        return image
+
+    @classmethod
+    def generate(cls, item):
+        # Decodes the original once and writes every bucket, returning {bucket: image}
+        source = get_thumbnail_source(item)
+        has_alpha = "A" in source.mode or "transparency" in source.info
+        source = source.convert("RGBA" if has_alpha and cls.format == "WEBP" else "RGB")
+
+        cls.invalidate((item.id,))
+
+        images = {}
+        for bucket in sorted(cls.buckets, reverse=True):
+            # Each bucket is shrunk from the next largest rather than the original
+            source = source.copy()
+            source.thumbnail((bucket, bucket))
+            images[bucket] = source
+
+            path = cls.get_path(item, bucket)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Written to a temporary file first so readers never see a partial image.
+            # Named per thread, as loaders and the CLIP pool can generate the same
+            # item, and hidden from the glob in invalidate
+            directory, name = os.path.split(path)
+            temp_path = f"{directory}/.{name}.{os.getpid()}.{get_ident()}.tmp"
+            try:
+                source.save(temp_path, format=cls.format, quality=THUMBNAIL_QUALITY)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        return images
+
+    @classmethod
+    def invalidate(cls, item_ids):
+        for item_id in item_ids:
+            string_id = str(item_id).zfill(10)
+            for bucket in cls.buckets:
+                for path in Path(f"{cls.path}/{bucket}").glob(f"{string_id}_*"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    @classmethod
+    def pregenerate(cls, item):
+        # Called on ingest. Failures are left for get to retry on first render
+        try:
+            cls.generate(item)
+        except Exception as e:
+            print(f"Could not generate thumbnails for item {item.id}: {e}")
+
+
+class VideoPreviewStore:
+    """
+    A poster frame and a short animated preview per video, made once on ingest so
+    thumbnails and grids never open the video itself. Named like thumbnails, so an
+    edited file never serves an old preview.
+    """
+
+    path = PREVIEWS_PATH
+    extensions = {"poster": "jpg", "clip": "webp"}
+
+    lock = Lock()
+    item_locks = {}  # Item id -> lock held while its previews are made
+
+    @classmethod
+    def get_path(cls, item, kind):
+        modified_time = os.stat(item.getpath()).st_mtime_ns
+        return (
+            f"{cls.path}/{kind}/{item.getstringid()}_{modified_time}"
+            f"_{item.width}x{item.height}.{cls.extensions[kind]}"
+        )
+
+    @classmethod
+    def get_item_lock(cls, item_id):
+        with cls.lock:
+            return cls.item_locks.setdefault(item_id, Lock())
+
+    @classmethod
+    def get_poster(cls, item):
+        # Made here if ingest didn't, as for videos added before previews existed
+        path = cls.get_path(item, "poster")
+        if not os.path.exists(path):
+            with cls.get_item_lock(item.id):
+                # Another thread may have made it while this one waited
+                if not os.path.exists(path):
+                    extract_poster(item.getpath(), path)
+        return path
+
+    @classmethod
+    def get_clip(cls, item):
+        # Path of the preview, None if it hasn't been made. Never encodes, as this is
+        # called while building grids
+        try:
+            path = cls.get_path(item, "clip")
+        except OSError:
+            return None
+        return path if os.path.exists(path) else None
+
+    @classmethod
+    def generate(cls, item):
+        with cls.get_item_lock(item.id):
+            cls.invalidate((item.id,))
+            extract_poster(item.getpath(), cls.get_path(item, "poster"))
+            encode_preview(item.getpath(), cls.get_path(item, "clip"))
+
+    @classmethod
+    def invalidate(cls, item_ids, kinds=None):
+        for item_id in item_ids:
+            string_id = str(item_id).zfill(10)
+            for kind in kinds or cls.extensions:
+                for path in Path(f"{cls.path}/{kind}").glob(f"{string_id}_*"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    @classmethod
+    def pregenerate(cls, item):
+        # Called on ingest, before thumbnails so they're made from the poster
+        if item.filetype != int(FileType.Video):
+            return
+        try:
+            cls.generate(item)
+        except Exception as e:
+            print(f"Could not generate previews for item {item.id}: {e}")
+
+
+def get_preview_movie(item, width, height, parent):
+    # The video's looping preview as a QMovie scaled to its tile, None if it hasn't
+    # been made. Only the desktop applications call this, so the server never loads Qt
+    from PySide6 import QtCore, QtGui
+
+    path = VideoPreviewStore.get_clip(item)
+    if path is None:
+        return None
+
+    movie = QtGui.QMovie(path, parent=parent)
+    movie.setScaledSize(QtCore.QSize(width, height))
+    movie.setCacheMode(QtGui.QMovie.CacheAll)  # A few seconds of small frames
+    return movie
+
+
+class RenditionStore:
+    """
+    Downscaled WebP, AVIF or JPEG copies of images, for clients that don't need the
+    stored PNG. Made on first request in a small process pool, so encodes can't tie
+    up the server, and kept on disk named like thumbnails so edits never serve an
+    old copy. A request waits up to RENDITION_TIMEOUT, then gets the original while
+    the encode finishes for next time.
+    """
+
+    path = RENDITIONS_PATH
+    buckets = RENDITION_WIDTHS
+
+    pool = None
+    pending = {}  # Rendition path -> (future of its encode, pool running it)
+    lock = Lock()
+
+    @classmethod
+    def get_bucket(cls, width):
+        # Smallest stored width covering the request, the largest beyond that
+        for bucket in cls.buckets:
+            if width <= bucket:
+                return bucket
+        return cls.buckets[-1]
+
+    @classmethod
+    def get_path(cls, item_info, bucket, format_name):
+        modified_time = os.stat(item_info["path"]).st_mtime_ns
+        return (
+            f"{cls.path}/{bucket}/{str(item_info['id']).zfill(10)}_{modified_time}"
+            f"_{item_info['width']}x{item_info['height']}.{format_name}"
+        )
+
+    @classmethod
+    def get_pool(cls):
+        # Spawned rather than forked, as the server has threads holding locks
+        if cls.pool is None:
+            cls.pool = ProcessPoolExecutor(
+                max_workers=RENDITION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return cls.pool
+
+    @classmethod
+    def get(cls, item_info, width, format_name):
+        # Path of the rendition, None if it isn't ready in time or can't be made
+        bucket = cls.get_bucket(width)
+        try:
+            path = cls.get_path(item_info, bucket, format_name)
+        except FileNotFoundError:
+            # The original is gone, which the media response reports
+            return None
+
+        if os.path.exists(path):
+            return path
+
+        submitted = False
+        with cls.lock:
+            future, pool = cls.pending.get(path, (None, None))
+            if future is None:
+                pool = cls.get_pool()
+                try:
+                    future = pool.submit(
+                        encode_rendition, item_info["path"], path, bucket, format_name
+                    )
+                except BrokenProcessPool:
+                    cls.pool = None
+                    return None
+                cls.pending[path] = future, pool
+                submitted = True
+
+        # Outside the lock, as a future that's already done runs it straight away
+        if submitted:
+            future.add_done_callback(lambda _: cls.finished(path))
+
+        try:
+            future.result(timeout=RENDITION_TIMEOUT)
+        except TimeoutError:
+            return None
+        except BrokenProcessPool:
+            # A worker died during the encode, which breaks the whole pool
+            with cls.lock:
+                if cls.pool is pool:
+                    cls.pool = None
+            return None
+        except Exception as e:
+            print(f"Could not make a rendition of item {item_info['id']}: {e}")
+            return None
+
+        return path
+
+    @classmethod
+    def finished(cls, path):
+        with cls.lock:
+            cls.pending.pop(path, None)
+
+    @classmethod
+    def invalidate(cls, item_ids):
+        for item_id in item_ids:
+            string_id = str(item_id).zfill(10)
+            for bucket in cls.buckets:
+                for path in Path(f"{cls.path}/{bucket}").glob(f"{string_id}_*"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    @classmethod
+    def shutdown(cls):
+        with cls.lock:
+            if cls.pool is not None:
+                cls.pool.shutdown(cancel_futures=True)
+                cls.pool = None
+            cls.pending.clear()
+
+
+def parse_rendition_request(width=None, format_name=None):
+    # The requested width and format, checked and normalised. A width of None means
+    # the item's own. Raises ValueError for bad requests
+    format_name = (format_name or "webp").lower()
+    if format_name not in SUPPORTED_FORMATS:
+        raise ValueError(f"Format not supported: {format_name}")
+
+    if width is not None:
+        try:
+            width = int(width)
+        except (TypeError, ValueError):
+            raise ValueError(f"Width must be a whole number: {width}")
+        if width <= 0:
+            raise ValueError("Width must be positive")
+
+    return width, format_name
+
+
+def get_rendition_data(item_info, width=None, format_name=None):
+    # item_info pointing at a rendition when one is asked for. Videos and renditions
+    # that aren't ready are served as they are. Raises ValueError for bad requests
+    if width is None and format_name is None:
+        return item_info
+
+    width, format_name = parse_rendition_request(width, format_name)
+    if width is None:
+        width = item_info["width"]
+
+    if item_info["filetype"] != int(FileType.Image):
+        return item_info
+
+    path = RenditionStore.get(item_info, width, format_name)
+    if path is None:
+        return item_info
+
+    return {
+        **item_info,
+        "path": path,
+        "mime_type": SUPPORTED_FORMATS[format_name]["mime_type"],
+    }
+
+
 def get_tags(item_id):
     item = Item.objects.all().filter(id=item_id).get()
     filetype_map = {int(FileType.Image): "image", int(FileType.Video): "video"}
@@ -674,7 +1807,10 @@ def get_tags(item_id):
     tag_dct["label"] = [item.label]
     tag_dct["filetype"] = [filetype_map[item.filetype]]
 
-    for tag in Tags.objects.filter(item_id=item_id).values("name", "value"):
+    # In the order added, as the indexes would otherwise order by name and value
+    for tag in (
+        Tags.objects.filter(item_id=item_id).order_by("id").values("name", "value")
+    ):
         tag_dct[tag["name"]] = tag_dct.get(tag["name"], [])
         tag_dct[tag["name"]].append(tag["value"])
 
@@ -699,6 +1835,30 @@ def get_tag(item_id, tag_name):
     )
 
 
+def get_tag_values(objects, tag_name):
+    # Bulk version of get_tags for a single tag over an Item queryset, in one query.
+    # Items without the tag are left out
+    filetype_map = {int(FileType.Image): "image", int(FileType.Video): "video"}
+
+    if tag_name in ("label", "filetype", "state"):
+        values = {}
+        for item_id, value in objects.values_list("id", tag_name):
+            if tag_name == "filetype":
+                value = filetype_map[value]
+            values[item_id] = [value]
+        return values
+
+    values = defaultdict(list)
+    for item_id, value in (
+        Tags.objects.filter(item_id__in=objects.values("id"), name=tag_name)
+        .order_by("id")
+        .values_list("item_id", "value")
+    ):
+        values[item_id].append(value)
+
+    return dict(values)
+
+
 def get_latest_confirmed_item(label):
     items = Item.objects.filter(
         state__in=[
@@ -739,87 +1899,173 @@ def check_for_clips():
 class ClipModel:
     model = None
     processor = None
+    session = None  # onnxruntime session, used in place of the model when set
+    lock = Lock()  # Loading can race between a warmup thread and first use
 
     clip_model_name = "wkcn/TinyCLIP-ViT-8M-16-Text-3M-YFCC15M"
     device = "cpu"
+    backend = INFERENCE_BACKEND
 
     @classmethod
     def load_clip_model(cls):
-        with torch.no_grad():
-            model = CLIPModel.from_pretrained(cls.clip_model_name)
+        # torch and transformers are imported here rather than at module load,
+        # so commands and tests that never embed don't pay for them
+        import torch
+        from transformers import CLIPProcessor, CLIPModel
+
+        with cls.lock, torch.no_grad():
+            if cls.model is not None or cls.session is not None:
+                return
+
             processor = CLIPProcessor.from_pretrained(
                 cls.clip_model_name, use_fast=True
             )
 
+            if cls.backend == ONNX_BACKEND:
+                session = cls.load_onnx_session()
+                if session is not None:
+                    cls.processor = processor
+                    cls.session = session
+                    return
+
+            model = CLIPModel.from_pretrained(cls.clip_model_name)
+
             model.eval()
             model.to(cls.device)
 
-            cls.model = model
             cls.processor = processor
+            cls.model = model
 
     @classmethod
-    def get_clip_image_embedding(cls, image):
-        if cls.model is None:
+    def load_onnx_session(cls):
+        # Exported once from the PyTorch model, returns None to fall back to PyTorch
+        from transformers import CLIPModel
+
+        path = get_model_path(cls.clip_model_name)
+
+        try:
+            if not os.path.exists(path):
+                export_clip_image_model(
+                    CLIPModel.from_pretrained(cls.clip_model_name).eval(), path
+                )
+            return create_session(path)
+        except Exception as e:
+            print(f"Could not load ONNX CLIP model, using PyTorch: {e}")
+            return None
+
+    @classmethod
+    def get_clip_image_embeddings(cls, images):
+        if cls.model is None and cls.session is None:
             cls.load_clip_model()
 
+        if cls.session is not None:
+            # Preprocess, stacking the images into one batch
+            inputs = cls.processor(images=images, return_tensors="np")
+
+            # The exported model normalises its output
+            embeddings = cls.session.run(
+                None, {"pixel_values": inputs["pixel_values"].astype(np.float32)}
+            )[0]
+            return embeddings.astype(EMBEDDING_DTYPE, copy=False)
+
         import torch
 
         with torch.no_grad():
-            # Preprocess
+            # Preprocess, stacking the images into one batch
             inputs = cls.processor(
-                images=image,
+                images=images,
                 return_tensors="pt",
             )
 
             # Move to device
-            inputs = {k: v.to(cls.device) for k, v in inputs.items()}
+            pixel_values = inputs["pixel_values"].to(cls.device)
 
-            # Forward pass (no text, only image)
-            outputs = cls.model.get_image_features(
-                **inputs
-            )  # shape: [1, embedding_dim]
+            # Forward pass (no text, only image), normalised to unit length
+            embeddings = get_clip_image_features(
+                cls.model, pixel_values
+            )  # shape: [batch_size, embedding_dim]
 
-            # Normalize to unit-length (common for CLIP embeddings)
-            embeddings = outputs / outputs.norm(dim=-1, keepdim=True)
+            # Convert to a CPU numpy array for storage / further processing
+            return embeddings.cpu().numpy()
 
-            # Convert to 1D CPU numpy array for storage / further processing
-            return embeddings.squeeze(0).cpu().numpy()
+    @classmethod
+    def get_clip_image_embedding(cls, image):
+        return cls.get_clip_image_embeddings([image])[0]
 
     @staticmethod
     def compute_distance(embed1, embed2):
         return 1.0 - np.dot(embed1, embed2)
 
     @staticmethod
-    def np_to_base64(np_array):
-        buffer = io.BytesIO()
-        np.save(buffer, np_array, allow_pickle=False)
-        b64string = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        return b64string
+    def np_to_bytes(np_array):
+        return np.asarray(np_array, dtype=EMBEDDING_DTYPE).tobytes()
+
+    @staticmethod
+    def bytes_to_np(embedding_bytes):
+        # Read-only view over the stored buffer, no copy is made
+        return np.frombuffer(embedding_bytes, dtype=EMBEDDING_DTYPE)
 
     @staticmethod
     def base64_to_np(b64string):
+        # Legacy format: base64-encoded .npy buffer, only used by convert_legacy_embeddings
         decoded_bytes = base64.b64decode(b64string)
         buffer = io.BytesIO(decoded_bytes)
         np_array = np.load(buffer, allow_pickle=False)
         return np_array
 
+    @staticmethod
+    def get_item_image(item_id):
+        return get_thumbnail(item_id, 224, 224)
+
     @classmethod
     def process_item(cls, item_id):
-        image = get_thumbnail(item_id, 224, 224)
-        return cls.get_clip_image_embedding(image)
+        return cls.get_clip_image_embedding(cls.get_item_image(item_id))
 
     @classmethod
-    def process_unclipped_items(cls):
-        items = Item.objects.filter(
-            state__gte=int(FileState.NeedsClip), embedding__isnull=True
-        )
+    def embed_items(cls, items, batch_size=CLIP_BATCH_SIZE):
+        # Embeds and saves the given items in batches, updating the embedding store
+        batches = [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
+
+        with ThreadPoolExecutor(max_workers=CLIP_LOAD_WORKERS) as executor:
+
+            def load_images(batch):
+                return [executor.submit(cls.get_item_image, item.id) for item in batch]
+
+            next_images = load_images(batches[0]) if batches else []
+
+            for i, batch in enumerate(batches):
+                images = [future.result() for future in next_images]
+
+                # Decode the next batch in the pool while the model runs on this one
+                if i + 1 < len(batches):
+                    next_images = load_images(batches[i + 1])
 
-        for item in items:
-            embedding = ClipModel.process_item(item.id)
-            b64string = ClipModel.np_to_base64(embedding)
+                embeddings = cls.get_clip_image_embeddings(images)
 
-            item.embedding = b64string
-            item.save()
+                embedded_at = time.time()
+                for item, embedding in zip(batch, embeddings):
+                    item.embedding = cls.np_to_bytes(embedding)
+                    item.embedded_at = embedded_at
+
+                Item.objects.bulk_update(batch, ["embedding", "embedded_at"])
+
+                for item, embedding in zip(batch, embeddings):
+                    EmbeddingStore.update(item.id, item.label, item.filetype, embedding)
+
+    @classmethod
+    def process_unclipped_items(cls, batch_size=CLIP_BATCH_SIZE):
+        # Re-embeds queued items first, so every embedding is fresh for the clip application
+        EmbeddingWorker.drain(batch_size)
+
+        items = list(
+            Item.objects.filter(
+                state__gte=int(FileState.NeedsClip), embedding__isnull=True
+            ).only("id", "label", "filetype")
+        )
+        cls.embed_items(items, batch_size)
+
+        EmbeddingStore.check_index()
+        EmbeddingStore.save_index()
 
     @staticmethod
     def compute_advanced_distance(item_id1, item_id2, alpha=0.5):
@@ -827,8 +2073,8 @@ class ClipModel:
         item2 = Item.objects.get(id=item_id2)
 
         embedding_distance = ClipModel.compute_distance(
-            ClipModel.base64_to_np(item1.embedding),
-            ClipModel.base64_to_np(item2.embedding),
+            ClipModel.bytes_to_np(item1.embedding),
+            ClipModel.bytes_to_np(item2.embedding),
         )
 
         def tags_to_set(tagset):
@@ -847,6 +2093,420 @@ class ClipModel:
         return alpha * embedding_distance + (1 - alpha) * tag_distance
 
 
+def _grow_array(array, capacity):
+    grown = np.empty((capacity, *array.shape[1:]), dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class EmbeddingStore:
+    """
+    Process-wide copy of every stored embedding, held as an (N, D) float32 matrix
+    with parallel id/label/filetype arrays. Loaded from the database on first use,
+    then kept up to date by edit_item, process_unclipped_items and the delete paths.
+    Only the first `size` rows of each array are valid. Rows waiting on the
+    EmbeddingWorker are marked stale and left out of similarity queries.
+
+    The web and desktop processes each hold a store, so every
+    EMBEDDING_REFRESH_INTERVAL the rows embedded and the stale flags set by the
+    other process are read back from the database.
+
+    Once there are ANN_MIN_ITEMS embeddings, an IVF index is trained and saved to
+    EMBEDDING_INDEX_PATH, and large queries only scan the closest lists.
+    """
+
+    lock = RLock()  # Shared between the Qt thread and the watchdog thread
+    loaded = False
+    size = 0
+    checked_at = 0.0  # time.monotonic() of the last refresh
+    synced_at = 0.0  # time.time() the last refresh read the database from
+
+    ids = np.empty(0, dtype=np.int64)
+    labels = np.empty(0, dtype=object)
+    filetypes = np.empty(0, dtype=np.int64)
+    lists = np.empty(0, dtype=np.int32)  # IVF list of each row
+    stale = np.empty(0, dtype=bool)
+    matrix = np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+    rows = {}  # item id -> row index
+
+    index = None
+    dirty = False  # Row assignments changed since the index was last saved
+
+    @classmethod
+    def load(cls):
+        with cls.lock:
+            cls.checked_at = time.monotonic()
+            cls.synced_at = time.time()
+            data = list(
+                Item.objects.filter(embedding__isnull=False).values_list(
+                    "id", "label", "filetype", "embedding_stale", "embedding"
+                )
+            )
+
+            cls.size = len(data)
+            cls.ids = np.array([row[0] for row in data], dtype=np.int64)
+            cls.labels = np.array([row[1] for row in data], dtype=object)
+            cls.filetypes = np.array([row[2] for row in data], dtype=np.int64)
+            cls.lists = np.zeros(cls.size, dtype=np.int32)
+            cls.stale = np.array([row[3] for row in data], dtype=bool)
+            cls.matrix = (
+                np.stack([ClipModel.bytes_to_np(row[4]) for row in data])
+                if data
+                else np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+            )
+            cls.rows = {item_id: row for row, item_id in enumerate(cls.ids.tolist())}
+            cls.loaded = True
+
+            cls.load_index()
+
+    @classmethod
+    def load_index(cls):
+        cls.index = None
+        cls.dirty = False
+        saved = IVFIndex.load(EMBEDDING_INDEX_PATH)
+
+        if saved is not None:
+            index, saved_ids, saved_lists = saved
+            if cls.size > 0 and index.centroids.shape[1] == cls.matrix.shape[1]:
+                cls.index = index
+
+                # Reuse saved assignments, only new rows are assigned here
+                saved_rows = [cls.rows.get(item_id) for item_id in saved_ids.tolist()]
+                known = np.array([row is not None for row in saved_rows], dtype=bool)
+                assigned = np.zeros(cls.size, dtype=bool)
+                if known.any():
+                    known_rows = np.array(
+                        [row for row in saved_rows if row is not None], dtype=np.int64
+                    )
+                    cls.lists[known_rows] = saved_lists[known]
+                    assigned[known_rows] = True
+
+                missing_rows = np.flatnonzero(~assigned)
+                if len(missing_rows):
+                    cls.lists[missing_rows] = index.assign(cls.matrix[missing_rows])
+                    cls.dirty = True
+                    cls.save_index()
+
+        cls.check_index()
+
+    @classmethod
+    def check_index(cls):
+        # Train once large enough, and retrain when the data has outgrown the centroids
+        with cls.lock:
+            if cls.size < ANN_MIN_ITEMS:
+                return
+            if (
+                cls.index is not None
+                and cls.size < ANN_RETRAIN_GROWTH * cls.index.trained_size
+            ):
+                return
+
+            cls.index = IVFIndex.train(cls.matrix[: cls.size])
+            cls.lists[: cls.size] = cls.index.assign(cls.matrix[: cls.size])
+            cls.dirty = True
+            cls.save_index()
+
+    @classmethod
+    def save_index(cls):
+        # Rewrites the whole file, so only once rows were assigned or retrained
+        with cls.lock:
+            if cls.index is None or not cls.dirty:
+                return
+
+            cls.index.save(
+                EMBEDDING_INDEX_PATH, cls.ids[: cls.size], cls.lists[: cls.size]
+            )
+            cls.dirty = False
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.loaded = False
+            cls.size = 0
+            cls.ids = np.empty(0, dtype=np.int64)
+            cls.labels = np.empty(0, dtype=object)
+            cls.filetypes = np.empty(0, dtype=np.int64)
+            cls.lists = np.empty(0, dtype=np.int32)
+            cls.stale = np.empty(0, dtype=bool)
+            cls.matrix = np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+            cls.rows = {}
+            cls.index = None
+            cls.dirty = False
+            cls.checked_at = 0.0
+            cls.synced_at = 0.0
+
+    @classmethod
+    def ensure_loaded(cls):
+        with cls.lock:
+            if not cls.loaded:
+                cls.load()
+            else:
+                cls.refresh()
+
+    @classmethod
+    def refresh(cls, force=False):
+        with cls.lock:
+            now = time.monotonic()
+            if not force and now - cls.checked_at <= EMBEDDING_REFRESH_INTERVAL:
+                return
+            cls.checked_at = now
+
+            # Reads a little before the last refresh, in case a write was still committing
+            synced_at = time.time()
+            changed = Item.objects.filter(
+                embedded_at__gte=cls.synced_at - EMBEDDING_REFRESH_INTERVAL,
+                embedding__isnull=False,
+            ).values_list("id", "label", "filetype", "embedding")
+            for item_id, label, filetype, embedding in changed:
+                cls.update(item_id, label, filetype, ClipModel.bytes_to_np(embedding))
+
+            stale_ids = Item.objects.filter(embedding_stale=True).values_list(
+                "id", flat=True
+            )
+            cls.stale[: cls.size] = False
+            cls.set_stale(stale_ids, True)
+            cls.synced_at = synced_at
+
+    @classmethod
+    def _append_row(cls, item_id, dimension):
+        if cls.size == 0 and cls.matrix.shape[1] != dimension:
+            cls.matrix = np.empty((0, dimension), dtype=EMBEDDING_DTYPE)
+
+        # Amortised growth, doubling capacity when full
+        if cls.size == len(cls.ids):
+            capacity = max(2 * cls.size, 64)
+            cls.ids = _grow_array(cls.ids, capacity)
+            cls.labels = _grow_array(cls.labels, capacity)
+            cls.filetypes = _grow_array(cls.filetypes, capacity)
+            cls.lists = _grow_array(cls.lists, capacity)
+            cls.stale = _grow_array(cls.stale, capacity)
+            cls.matrix = _grow_array(cls.matrix, capacity)
+
+        row = cls.size
+        cls.ids[row] = item_id
+        cls.stale[row] = False
+        cls.rows[item_id] = row
+        cls.size += 1
+        return row
+
+    @classmethod
+    def update(cls, item_id, label, filetype, embedding=None):
+        # Passing no embedding only refreshes the label and filetype of a known row
+        with cls.lock:
+            # Not loaded yet, the row is read from the database on first use
+            if not cls.loaded:
+                return
+
+            row = cls.rows.get(item_id)
+            if row is None:
+                if embedding is None:
+                    return
+                row = cls._append_row(item_id, len(embedding))
+
+            cls.labels[row] = label
+            cls.filetypes[row] = filetype
+            if embedding is not None:
+                cls.matrix[row] = embedding
+                if cls.index is not None:
+                    cls.lists[row] = cls.index.assign(cls.matrix[row])[0]
+                    cls.dirty = True
+
+    @classmethod
+    def remove(cls, item_ids):
+        with cls.lock:
+            for item_id in item_ids:
+                row = cls.rows.pop(item_id, None)
+                if row is None:
+                    continue
+
+                # Move the last row into the gap
+                last = cls.size - 1
+                if row != last:
+                    cls.ids[row] = cls.ids[last]
+                    cls.labels[row] = cls.labels[last]
+                    cls.filetypes[row] = cls.filetypes[last]
+                    cls.lists[row] = cls.lists[last]
+                    cls.stale[row] = cls.stale[last]
+                    cls.matrix[row] = cls.matrix[last]
+                    cls.rows[int(cls.ids[row])] = row
+
+                cls.labels[last] = None
+                cls.size = last
+
+    @classmethod
+    def set_stale(cls, item_ids, stale):
+        with cls.lock:
+            for item_id in item_ids:
+                row = cls.rows.get(item_id)
+                if row is not None:
+                    cls.stale[row] = stale
+
+    @classmethod
+    def get_embedding(cls, item_id):
+        with cls.lock:
+            cls.ensure_loaded()
+            row = cls.rows.get(item_id)
+            if row is not None:
+                return cls.matrix[row].copy()
+
+        embedding_bytes = (
+            Item.objects.filter(id=item_id).values_list("embedding", flat=True).first()
+        )
+        if embedding_bytes is None:
+            return None
+        return ClipModel.bytes_to_np(embedding_bytes)
+
+    @classmethod
+    def _get_mask(cls, label=None, filetype=None, exclude_ids=()):
+        # Stale rows no longer match their item, skip them until re-embedded
+        mask = ~cls.stale[: cls.size]
+
+        if label is not None:
+            mask &= cls.labels[: cls.size] == label
+        if filetype is not None:
+            mask &= cls.filetypes[: cls.size] == filetype
+
+        for item_id in exclude_ids:
+            row = cls.rows.get(item_id)
+            if row is not None:
+                mask[row] = False
+
+        return mask
+
+    @classmethod
+    def _row_distances(cls, embedding, rows):
+        if len(rows) == 0:
+            return np.empty(0, dtype=EMBEDDING_DTYPE)
+
+        # A single matrix-vector product over the selected rows
+        return 1.0 - cls.matrix[rows] @ np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+
+    @classmethod
+    def get_ids(cls, label=None, filetype=None, exclude_ids=()):
+        with cls.lock:
+            cls.ensure_loaded()
+            mask = cls._get_mask(label, filetype, exclude_ids)
+            return cls.ids[: cls.size][mask]
+
+    @classmethod
+    def distances(cls, embedding, item_ids):
+        # Returns (ids, distances) for the given ids, skipping any without an embedding
+        with cls.lock:
+            cls.ensure_loaded()
+            found_rows = [cls.rows.get(int(item_id)) for item_id in item_ids]
+            found_rows = np.array(
+                [row for row in found_rows if row is not None], dtype=np.int64
+            )
+
+            return cls.ids[found_rows], cls._row_distances(embedding, found_rows)
+
+    @classmethod
+    def nearest(
+        cls, embedding, k=1, label=None, filetype=None, exclude_ids=(), exact=False
+    ):
+        # Returns up to k (id, distance) pairs, closest first
+        with cls.lock:
+            cls.ensure_loaded()
+            mask = cls._get_mask(label, filetype, exclude_ids)
+
+            # Only scan the closest IVF lists for large candidate sets, falling back
+            # to the exact search if the filters leave too few items in those lists
+            if not exact and cls.index is not None and mask.sum() >= ANN_MIN_ITEMS:
+                probed_lists = cls.index.probe(embedding, ANN_PROBE_LISTS)
+                probed_mask = mask & np.isin(cls.lists[: cls.size], probed_lists)
+                if probed_mask.sum() >= k:
+                    mask = probed_mask
+
+            rows = np.flatnonzero(mask)
+            item_ids = cls.ids[rows]
+            distances = cls._row_distances(embedding, rows)
+
+        k = min(k, len(item_ids))
+        if k == 0:
+            return []
+
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind="stable")]
+
+        return list(zip(item_ids[top].tolist(), distances[top].tolist()))
+
+
+def get_tag_sets(item_ids):
+    # Bulk version of get_tags, as sets of (name, value) pairs
+    filetype_map = {int(FileType.Image): "image", int(FileType.Video): "video"}
+    tag_sets = {}
+
+    for item_id, label, filetype in Item.objects.filter(id__in=item_ids).values_list(
+        "id", "label", "filetype"
+    ):
+        tag_sets[item_id] = {("label", label), ("filetype", filetype_map[filetype])}
+
+    for item_id, name, value in Tags.objects.filter(item_id__in=item_ids).values_list(
+        "item_id", "name", "value"
+    ):
+        tag_sets[item_id].add((name, value))
+
+    return tag_sets
+
+
+def get_advanced_distances(item_id, other_ids, embedding_distances, alpha=0.5):
+    # Vectorised ClipModel.compute_advanced_distance against many items at once
+    other_ids = [int(other_id) for other_id in other_ids]
+    tag_sets = get_tag_sets([item_id, *other_ids])
+    tagset = tag_sets[item_id]
+
+    tag_distances = np.array(
+        [
+            1 / (len(tagset.intersection(tag_sets[other_id])) + 1)
+            for other_id in other_ids
+        ]
+    )
+
+    return alpha * embedding_distances + (1 - alpha) * tag_distances
+
+
+def convert_legacy_embeddings():
+    # Embeddings used to be stored as base64 .npy text, rewrite any remaining rows as raw float32 bytes
+    legacy_items = Item.objects.extra(where=["typeof(embedding) = 'text'"]).only(
+        "id", "embedding"
+    )
+
+    converted_items = []
+    for item in legacy_items:
+        item.embedding = ClipModel.np_to_bytes(ClipModel.base64_to_np(item.embedding))
+        converted_items.append(item)
+
+    Item.objects.bulk_update(converted_items, ["embedding"], batch_size=500)
+
+    return len(converted_items)
+
+
+def remove_duplicate_tags():
+    # Older databases could hold the same tag twice on an item, which the unique
+    # constraint on Tags won't allow. Keeps the first of each
+    try:
+        first_ids = (
+            Tags.objects.values("item_id", "name", "value")
+            .annotate(first_id=Min("id"))
+            .values("first_id")
+        )
+        removed, _ = Tags.objects.exclude(id__in=first_ids).delete()
+    except DatabaseError:
+        return 0  # No tags table yet
+
+    return removed
+
+
+def warmup_models():
+    # Loads the CLIP and bounding box models ahead of their first use
+    ClipModel.load_clip_model()
+    get_bounding_box_model()
+
+
+def start_model_warmup():
+    Thread(target=warmup_models, daemon=True).start()
+
+
 def get_next_clip_item():
     item = (
         Item.objects.all()
@@ -862,39 +2522,25 @@ def get_next_clip_item():
 
 
 def get_nearest_item(item_id, label, filetype):
-    b64_embedding = Item.objects.get(id=item_id).embedding
-    np_embedding = ClipModel.base64_to_np(b64_embedding)
+    np_embedding = EmbeddingStore.get_embedding(item_id)
 
-    other_items = Item.objects.filter(label=label, filetype=filetype).exclude(
-        id=item_id
+    nearest = EmbeddingStore.nearest(
+        np_embedding, label=label, filetype=filetype, exclude_ids=(item_id,)
     )
 
-    nearest_item_id = -1
-    smallest_distance = 2
-
-    for other_item in other_items:
-        if other_item.embedding is None:
-            continue
-
-        other_np_embedding = ClipModel.base64_to_np(other_item.embedding)
-
-        distance = ClipModel.compute_distance(np_embedding, other_np_embedding)
-
-        if distance < smallest_distance:
-            nearest_item_id = other_item.id
-            smallest_distance = distance
+    if not nearest:
+        return -1
 
+    nearest_item_id, _ = nearest[0]
     return nearest_item_id
 
 
 def apply_rules(item_id):
-    item = Item.objects.get(id=item_id)
-    tags_to_add = {}
+    apply_rules_to_items([Item.objects.get(id=item_id)])
 
-    for rule in Rules.objects.filter(label=item.label):
-        tags_to_add[rule.tag_name] = [rule.tag_value]
 
-    add_tags({item.id: tags_to_add})
+def apply_rules_to_items(items):
+    add_tags({item.id: CompiledRules.get(item.label) for item in items})
 
 
 def get_random_compare_item():
@@ -904,63 +2550,52 @@ def get_random_compare_item():
 
 def get_comparison_items(item_id, num_items=10):
     item = Item.objects.get(id=item_id)
-    distance_max_heap = []
+    embedding = EmbeddingStore.get_embedding(item.id)
+    comparisons = []  # (-distance, item_id)
 
     # 1: add any comparisons from class
 
-    same_label_items = Item.objects.filter(label=item.label).exclude(id=item.id)
+    # Scored on the closest embeddings only, for load speed on large labels
+    same_label_items = EmbeddingStore.nearest(
+        embedding,
+        k=COMPARISON_SHORTLIST_SIZE,
+        label=item.label,
+        exclude_ids=(item.id,),
+    )
 
     nearest_item_id = -1
-    smallest_distance = 2
 
-    for other_item in same_label_items:
-        if other_item.embedding is None:
-            continue
+    if same_label_items:
+        same_label_ids = [other_id for other_id, _ in same_label_items]
+        same_label_distances = np.array([distance for _, distance in same_label_items])
 
-        distance = ClipModel.compute_advanced_distance(
-            item.id, other_item.id, alpha=0.3
+        distances = get_advanced_distances(
+            item.id, same_label_ids, same_label_distances, alpha=0.3
         )
-
-        if distance < smallest_distance:
-            nearest_item_id = other_item.id
-            smallest_distance = distance
-
-    if nearest_item_id != -1:
-        distance_max_heap.append((0, nearest_item_id))
+        nearest_item_id = same_label_ids[int(np.argmin(distances))]
+        comparisons.append((0, nearest_item_id))
 
     # 2: get at most K good comparisons
 
-    global_items = Item.objects.exclude(
-        id__in=[item.id] if nearest_item_id < 0 else [item.id, nearest_item_id]
-    ).values_list("id", flat=True)
-    global_items = list(global_items)
+    global_items = EmbeddingStore.get_ids(
+        exclude_ids=[item.id] if nearest_item_id < 0 else [item.id, nearest_item_id]
+    ).tolist()
     random.shuffle(global_items)
 
     # Randomness and load speed
-    global_items = global_items[:500]
-
-    for global_item_id in global_items:
-        global_item = Item.objects.get(id=global_item_id)
+    global_items = global_items[:COMPARISON_SHORTLIST_SIZE]
 
-        if global_item.embedding is None:
-            continue
+    global_ids, global_distances = EmbeddingStore.distances(embedding, global_items)
+    k = min(num_items - len(comparisons), len(global_ids))
 
-        distance = ClipModel.compute_advanced_distance(
-            item.id, global_item.id, alpha=0.2
+    if k > 0:
+        distances = get_advanced_distances(
+            item.id, global_ids, global_distances, alpha=0.2
         )
+        top = np.argpartition(distances, k - 1)[:k]
+        comparisons += [(-float(distances[i]), int(global_ids[i])) for i in top]
 
-        if len(distance_max_heap) < num_items:
-            heappush(distance_max_heap, (-distance, global_item.id))
-
-        else:
-            smallest_distance, smallest_id = distance_max_heap[0]
-            smallest_distance = -smallest_distance
-
-            if distance < smallest_distance:
-                heappop(distance_max_heap)
-                heappush(distance_max_heap, (-distance, global_item.id))
-
-    return list(item_id for _, item_id in sorted(distance_max_heap))[::-1]
+    return list(item_id for _, item_id in sorted(comparisons))[::-1]
 
 
 def start_file(item_id):
@@ -968,22 +2603,113 @@ def start_file(item_id):
 
 
 class ThumbnailCache:
-    cache = {}
-    cache_queue = deque()
-    cache_size = THUMBNAIL_CACHE_SIZE
+    """
+    In-memory LRU cache of decoded thumbnails shared by the desktop applications,
+    keyed by (item_id, width, height) and bounded by an estimate of their size in
+    bytes. Safe to use from the watchdog and Qt threads at once.
+    """
+
+    cache = OrderedDict()  # (item_id, width, height) -> (image, size in bytes)
+    keys_by_item = defaultdict(set)
+    size_bytes = 0
+    max_bytes = THUMBNAIL_CACHE_BYTES
+
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    lock = Lock()
+
+    @classmethod
+    def get(cls, item_id, width=DEFAULT_THUMBNAIL_SIZE, height=DEFAULT_THUMBNAIL_SIZE):
+        key = (item_id, width, height)
+
+        with cls.lock:
+            entry = cls.cache.get(key)
+            if entry is not None:
+                cls.cache.move_to_end(key)
+                cls.hits += 1
+                return entry[0]
+
+            cls.misses += 1
+
+        # Decoded outside the lock so other threads aren't held up
+        thumbnail = get_thumbnail(item_id, width, height)
+        size_bytes = thumbnail.width * thumbnail.height * len(thumbnail.getbands())
+
+        with cls.lock:
+            cls._remove(key)
+            cls.cache[key] = (thumbnail, size_bytes)
+            cls.keys_by_item[item_id].add(key)
+            cls.size_bytes += size_bytes
+
+            # Least recently used first, always keeping the newest entry
+            while cls.size_bytes > cls.max_bytes and len(cls.cache) > 1:
+                oldest_key = next(iter(cls.cache))
+                cls._remove(oldest_key)
+                cls.evictions += 1
+
+        return thumbnail
+
+    @classmethod
+    def peek(cls, item_id, width=DEFAULT_THUMBNAIL_SIZE, height=DEFAULT_THUMBNAIL_SIZE):
+        # Cached thumbnail or None, never decoding on the caller's thread
+        key = (item_id, width, height)
+
+        with cls.lock:
+            entry = cls.cache.get(key)
+            if entry is None:
+                return None
+
+            cls.cache.move_to_end(key)
+            cls.hits += 1
+            return entry[0]
 
     @classmethod
     def __getitem__(cls, item_id):
-        if item_id in cls.cache:
-            return cls.cache[item_id]
+        return cls.get(item_id)
 
-        while len(cls.cache_queue) >= cls.cache_size:
-            cls.cache.pop(cls.cache_queue.popleft())
+    @classmethod
+    def _remove(cls, key):
+        # Caller holds the lock
+        entry = cls.cache.pop(key, None)
+        if entry is None:
+            return
 
-        thumbnail = get_thumbnail(item_id)
-        cls.cache[item_id] = thumbnail
-        cls.cache_queue.append(item_id)
-        return thumbnail
+        cls.size_bytes -= entry[1]
+        item_keys = cls.keys_by_item[key[0]]
+        item_keys.discard(key)
+        if not item_keys:
+            cls.keys_by_item.pop(key[0])
+
+    @classmethod
+    def invalidate(cls, item_ids):
+        # Called whenever an item's file is edited or deleted
+        with cls.lock:
+            for item_id in item_ids:
+                for key in list(cls.keys_by_item.get(item_id, ())):
+                    cls._remove(key)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.cache.clear()
+            cls.keys_by_item.clear()
+            cls.size_bytes = 0
+            cls.hits = cls.misses = cls.evictions = 0
+
+    @classmethod
+    def stats(cls):
+        with cls.lock:
+            lookups = cls.hits + cls.misses
+            return {
+                "hits": cls.hits,
+                "misses": cls.misses,
+                "evictions": cls.evictions,
+                "entries": len(cls.cache),
+                "bytes": cls.size_bytes,
+                "hit_rate": cls.hits / lookups if lookups else 0.0,
+            }
 
 
 class VideoRemover:
@@ -999,6 +2725,10 @@ class VideoRemover:
         item = Item.objects.get(id=item_id)
         path = item.getpath()
         item.delete()
+        EmbeddingStore.remove((item_id,))
+        ThumbnailStore.invalidate((item_id,))
+        RenditionStore.invalidate((item_id,))
+        VideoPreviewStore.invalidate((item_id,))
 
         if not os.path.exists(path):
             return
@@ -1021,4 +2751,104 @@ class VideoRemover:
                 cls.videos_to_remove.append(path)
 
 
+class EmbeddingWorker:
+    """
+    Drains the EmbeddingJobs table in the background, so edits never wait on a
+    CLIP forward pass. Items with pending jobs are marked `embedding_stale`.
+    """
+
+    wake = Event()
+    lock = Lock()  # One drain at a time, between the worker and the clip application
+
+    @classmethod
+    def enqueue(cls, item_ids):
+        Item.objects.filter(id__in=item_ids).update(embedding_stale=True)
+        EmbeddingStore.set_stale(item_ids, True)
+        EmbeddingJobs.objects.bulk_create(
+            [EmbeddingJobs(item_id_id=item_id) for item_id in item_ids]
+        )
+        cls.wake.set()
+
+    @classmethod
+    def process(cls, batch_size=CLIP_BATCH_SIZE):
+        # Embeds the items of the oldest batch_size jobs, returning the number of jobs handled
+        with cls.lock:
+            return cls._process(batch_size)
+
+    @classmethod
+    def _process(cls, batch_size):
+        # The web and desktop processes both run a worker, claim the jobs in one
+        # update so no two of them embed the same job
+        claim = uuid.uuid4().hex
+        claimed_at = time.time()
+        claimable = (
+            EmbeddingJobs.objects.filter(
+                Q(claimed_by__isnull=True)
+                | Q(claimed_at__lt=claimed_at - EMBEDDING_CLAIM_TIMEOUT)
+            )
+            .order_by("id")
+            .values("id")[:batch_size]
+        )
+        EmbeddingJobs.objects.filter(id__in=claimable).update(
+            claimed_by=claim, claimed_at=claimed_at
+        )
+
+        jobs = list(
+            EmbeddingJobs.objects.filter(claimed_by=claim).values_list("id", "item_id")
+        )
+        if not jobs:
+            return 0
+
+        job_ids = [job_id for job_id, _ in jobs]
+        item_ids = {item_id for _, item_id in jobs}
+        items = list(
+            Item.objects.filter(id__in=item_ids, embedding__isnull=False).only(
+                "id", "label", "filetype"
+            )
+        )
+
+        failed_ids = set()
+
+        try:
+            ClipModel.embed_items(items, batch_size)
+        except Exception as e:
+            # Retry one at a time, so a single unreadable file can't block the queue
+            print(f"Embedding batch failed, retrying items individually: {e}")
+            for item in items:
+                try:
+                    ClipModel.embed_items([item])
+                except Exception as item_error:
+                    print(f"Embedding failed for item {item.id}: {item_error}")
+                    failed_ids.add(item.id)
+
+        # Jobs added for these items while they were being embedded stay queued,
+        # and items that failed to embed stay marked as stale
+        EmbeddingJobs.objects.filter(id__in=job_ids).delete()
+        fresh_ids = list(
+            Item.objects.filter(id__in=item_ids - failed_ids)
+            .exclude(embeddingjobs__isnull=False)
+            .values_list("id", flat=True)
+        )
+        Item.objects.filter(id__in=fresh_ids).update(embedding_stale=False)
+        EmbeddingStore.set_stale(fresh_ids, False)
+
+        return len(jobs)
+
+    @classmethod
+    def drain(cls, batch_size=CLIP_BATCH_SIZE):
+        while cls.process(batch_size):
+            pass
+
+    @classmethod
+    def run(cls):
+        while True:
+            cls.wake.wait(EMBEDDING_WORKER_INTERVAL)
+            cls.wake.clear()
+
+            try:
+                cls.drain()
+            except Exception as e:
+                print(e)
+
+
 thumbnail_cache = ThumbnailCache()
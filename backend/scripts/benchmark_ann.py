@@ -0,0 +1,84 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.utils.ann_index import IVFIndex, normalise  # noqa: E402
+
+
+def synthetic_embeddings(n_items, dimension, n_clusters, seed):
+    # Clustered unit vectors, roughly shaped like CLIP embeddings of a labelled library
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_clusters, dimension))
+    vectors = centres[rng.integers(n_clusters, size=n_items)]
+    vectors += 1.5 * rng.normal(size=vectors.shape)
+    return normalise(vectors).astype(np.float32)
+
+
+def exact_top_k(matrix, query, k):
+    distances = 1.0 - matrix @ query
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top])]
+
+
+def ivf_top_k(index, matrix, lists, query, k, n_probe):
+    rows = np.flatnonzero(np.isin(lists, index.probe(query, n_probe)))
+    distances = 1.0 - matrix[rows] @ query
+    k = min(k, len(rows))
+    top = np.argpartition(distances, k - 1)[:k]
+    return rows[top[np.argsort(distances[top])]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--probes", type=int, nargs="+", default=[4, 8, 16, 32], help="Lists scanned."
+    )
+    args = parser.parse_args()
+
+    matrix = synthetic_embeddings(args.items, args.dimension, args.clusters, seed=0)
+    queries = matrix[np.random.default_rng(1).choice(args.items, args.queries)]
+
+    start = time.perf_counter()
+    index = IVFIndex.train(matrix)
+    lists = index.assign(matrix)
+    print(
+        f"Trained {index.n_lists} lists over {args.items} items "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+    start = time.perf_counter()
+    exact = [exact_top_k(matrix, query, args.k) for query in queries]
+    exact_ms = 1000 * (time.perf_counter() - start) / args.queries
+    print(f"{'exact':>10}: {exact_ms:7.3f} ms/query, recall@{args.k} 1.000")
+
+    for n_probe in args.probes:
+        start = time.perf_counter()
+        approximate = [
+            ivf_top_k(index, matrix, lists, query, args.k, n_probe) for query in queries
+        ]
+        ivf_ms = 1000 * (time.perf_counter() - start) / args.queries
+
+        recall = np.mean(
+            [
+                len(set(a.tolist()) & set(e.tolist())) / args.k
+                for a, e in zip(approximate, exact)
+            ]
+        )
+        print(
+            f"{f'nprobe={n_probe}':>10}: {ivf_ms:7.3f} ms/query, "
+            f"recall@{args.k} {recall:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.utils.process_images import (  # noqa: E402
+    FLOOR_DIVISION,
+    MEDIA_HEIGHT,
+    clamp,
+    clean_corners,
+)
+
+
+def clean_corners_pixel_walk(image, corners):
+    # The previous getpixel implementation, kept to compare speed and results
+    x1, x2, y1, y2 = corners
+
+    x1, x2 = sorted([x1, x2])
+    y1, y2 = sorted([y1, y2])
+
+    x1, x2, y1, y2 = map(int, list((x1 - 5, x2 + 5, y1 - 5, y2 + 5)))
+
+    x1, x2 = clamp(x1, 0, image.width), clamp(x2, 0, image.width)
+    y1, y2 = clamp(y1, 0, image.height), clamp(y2, 0, image.height)
+
+    def get_smoothed(color):
+        if isinstance(color, int):
+            color = (color,)
+
+        color = list(c // FLOOR_DIVISION for c in color)
+        return color
+
+    def move(start, stop, o1, o2, data_type="x"):
+        delta = 1 if start <= stop else -1
+
+        for d in range(start, stop, delta):
+            cords = (d, (o1 + o2) // 2) if data_type == "x" else ((o1 + o2) // 2, d)
+
+            color = get_smoothed(image.getpixel(cords))
+
+            current_matches = 0
+            max_matches = o2 - o1 + 1
+
+            for o in range(o1, o2):
+                cords = (d, o) if data_type == "x" else (o, d)
+                checked_color = get_smoothed(image.getpixel(cords))
+
+                if color == checked_color:
+                    current_matches += 1
+
+            if current_matches <= max_matches // 2:
+                return d
+
+        return stop
+
+    x1 = move(x1, x2, y1, y2, data_type="x")
+    x2 = move(x2 - 1, x1 - 1, y1, y2, data_type="x")
+    y1 = move(y1, y2, x1, x2, data_type="y")
+    y2 = move(y2 - 1, y1 - 1, x1, x2, data_type="y")
+
+    def process_pair(p1, p2, max_value):
+        p1, p2 = p1 + 2, p2 - 2
+        p1, p2 = sorted([p1, p2])
+
+        if p1 == p2:
+            p1 = max(p1 - 1, 0)
+            p2 = min(p2 + 1, max_value)
+
+        return clamp(p1, 0, max_value), clamp(p2, 0, max_value)
+
+    x1, x2 = process_pair(x1, x2, image.width)
+    y1, y2 = process_pair(y1, y2, image.height)
+
+    return x1, x2, y1, y2
+
+
+def synthetic_image(width, height, n_boxes, border, rng):
+    # Flat background with noisy boxes, each padded by a flat border to trim
+    pixels = np.full((height, width, 3), 200, dtype=np.uint8)
+    boxes = []
+
+    for _ in range(n_boxes):
+        box_width, box_height = (
+            rng.integers(width // 8, width // 2),
+            rng.integers(height // 8, height // 2),
+        )
+        x1, y1 = (
+            rng.integers(0, width - box_width),
+            rng.integers(0, height - box_height),
+        )
+        x2, y2 = x1 + box_width, y1 + box_height
+
+        pixels[y1 + border : y2 - border, x1 + border : x2 - border] = rng.integers(
+            0, 255, (box_height - 2 * border, box_width - 2 * border, 3)
+        )
+        boxes.append((float(x1), float(x2), float(y1), float(y2)))
+
+    return Image.fromarray(pixels), boxes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--boxes", type=int, default=5)
+    parser.add_argument("--width", type=int, default=600)
+    parser.add_argument("--height", type=int, default=MEDIA_HEIGHT)
+    parser.add_argument("--border", type=int, default=30, help="Flat pixels per box.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    samples = [
+        synthetic_image(args.width, args.height, args.boxes, args.border, rng)
+        for _ in range(args.images)
+    ]
+    n_boxes = args.images * args.boxes
+
+    timings = {}
+    results = {}
+    for name, function in (
+        ("pixel walk", clean_corners_pixel_walk),
+        ("numpy", clean_corners),
+    ):
+        start = time.perf_counter()
+        results[name] = [
+            function(image, box) for image, boxes in samples for box in boxes
+        ]
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>10}: {1000 * timings[name] / n_boxes:8.2f} ms/box")
+
+    print(f"   speedup: {timings['pixel walk'] / timings['numpy']:.1f}x")
+    print(f" identical: {results['pixel walk'] == results['numpy']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmark_tag_queries import populate, setup_database
+
+# The indexes declared on Item, Tags and Rules. The unique constraint on Tags is
+# part of the table in SQLite, so it can't be dropped and is left in both runs
+INDEX_NAMES = (
+    "item_state_label_id",
+    "tags_name_value_item",
+    "rules_label",
+)
+
+
+def workflow_queries():
+    from api.models import FileState, Item, Rules, TagConditions
+    from api.views_extension import (
+        get_items_and_paths_from_tags,
+        get_next_clip_item,
+        get_next_tag_item,
+        get_tags,
+        get_untagged_ids,
+    )
+
+    item_id = Item.objects.filter(state=int(FileState.Complete)).first().id
+
+    return {
+        "next tag item": get_next_tag_item,
+        "next clip item": get_next_clip_item,
+        "untagged ids": lambda: get_untagged_ids(
+            "colour", {("label", "label1"): TagConditions.Is.value}
+        ),
+        "rules for label": lambda: list(Rules.objects.filter(label="label1")),
+        "item tags": lambda: get_tags(item_id),
+        "tag search": lambda: get_items_and_paths_from_tags(
+            {("colour", TagConditions.Is.value): ["value1", "value2"]}
+        ),
+    }
+
+
+def time_queries(repeats):
+    timings = {}
+    for name, query in workflow_queries().items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            query()
+        timings[name] = (time.perf_counter() - start) / repeats
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--tags-per-item", type=int, default=10)
+    parser.add_argument("--labels", type=int, default=500)
+    parser.add_argument("--values", type=int, default=200)
+    parser.add_argument("--rules-per-label", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        setup_database(os.path.join(work_dir, "benchmark.sqlite3"))
+
+        from django.db import connection
+
+        from api.models import FileState, Item, Rules
+
+        populate(args.items, args.tags_per_item, args.labels, args.values, seed=0)
+
+        # A tenth of the items waiting on each of the tag and CLIP stages
+        tenth = args.items // 10
+        Item.objects.filter(id__lte=tenth).update(state=int(FileState.NeedsTags))
+        Item.objects.filter(id__gt=tenth, id__lte=2 * tenth).update(
+            state=int(FileState.NeedsClip)
+        )
+        Rules.objects.bulk_create(
+            Rules(label=f"label{label}", tag_name=f"rule{rule}", tag_value="1")
+            for label in range(args.labels)
+            for rule in range(args.rules_per_label)
+        )
+
+        with_indexes = time_queries(args.repeats)
+
+        with connection.cursor() as cursor:
+            for name in INDEX_NAMES:
+                cursor.execute(f'DROP INDEX "{name}"')
+
+        without_indexes = time_queries(args.repeats)
+
+        for name, seconds in with_indexes.items():
+            print(
+                f"{name:>16}: without indexes {without_indexes[name] * 1000:8.2f}ms, "
+                f"with indexes {seconds * 1000:8.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
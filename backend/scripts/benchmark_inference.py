@@ -0,0 +1,130 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.utils.inference import (  # noqa: E402
+    OnnxYOLO,
+    create_session,
+    export_clip_image_model,
+    export_yolo_model,
+    get_clip_image_features,
+)
+
+CLIP_MODEL_NAME = "wkcn/TinyCLIP-ViT-8M-16-Text-3M-YFCC15M"
+
+
+def random_images(count, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+        for _ in range(count)
+    ]
+
+
+def report(name, backend, count, seconds):
+    print(f"{name:>5} {backend:>6}: {count / seconds:8.1f} images/s")
+
+
+def benchmark_clip(args, work_dir):
+    import torch
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel
+
+    if args.random_weights:
+        # Default CLIP sizes, for machines without the pretrained download
+        model = CLIPModel(CLIPConfig()).eval()
+        processor = CLIPImageProcessor()
+    else:
+        model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+        processor = CLIPImageProcessor.from_pretrained(CLIP_MODEL_NAME)
+
+    path = os.path.join(work_dir, "clip.onnx")
+    export_clip_image_model(model, path)
+    session = create_session(path, args.threads)
+
+    images = random_images(args.batch_size, 224, 224)
+    count = args.batch_size * args.batches
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        with torch.no_grad():
+            pixel_values = processor(images=images, return_tensors="pt")["pixel_values"]
+            get_clip_image_features(model, pixel_values).numpy()
+    report("clip", "torch", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        pixel_values = processor(images=images, return_tensors="np")["pixel_values"]
+        session.run(None, {"pixel_values": pixel_values.astype(np.float32)})
+    report("clip", "onnx", count, time.perf_counter() - start)
+
+
+def benchmark_yolo(args, work_dir):
+    import shutil
+    import torch
+    from ultralytics import YOLO
+
+    # Exported from a copy so the .onnx file isn't written next to the real weights
+    weights_path = os.path.join(work_dir, "yolo.pt")
+    shutil.copy(args.yolo_weights, weights_path)
+
+    model = YOLO(weights_path, verbose=False)
+    onnx_model = OnnxYOLO(export_yolo_model(weights_path), args.threads)
+
+    images = random_images(args.batch_size, 640, 480)
+    count = args.batch_size * args.batches
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # The first torch call sets up the predictor, so it isn't timed
+    model(images[0], verbose=False)
+
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        for image in images:
+            model(image, verbose=False)
+    report("yolo", "torch", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        for image in images:
+            onnx_model(image)
+    report("yolo", "onnx", count, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["clip", "yolo"])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batches", type=int, default=5)
+    parser.add_argument(
+        "--threads", type=int, default=0, help="Intra-op threads, 0 for the default."
+    )
+    parser.add_argument("--yolo-weights", default="yolov8n.pt")
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="Benchmark an untrained CLIP model instead of downloading the weights.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if "clip" in args.models:
+            benchmark_clip(args, work_dir)
+        if "yolo" in args.models:
+            benchmark_yolo(args, work_dir)
+
+
+if __name__ == "__main__":
+    main()
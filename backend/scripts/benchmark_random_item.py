@@ -0,0 +1,75 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from benchmark_tag_queries import populate, setup_database
+
+
+def choose_with_dict(tags, method):
+    # The previous draw, kept to compare: every match loaded with its path, then
+    # weighted with random.choices
+    from api.views_extension import get_items_and_paths_from_tags
+
+    items = get_items_and_paths_from_tags(tags)
+    keys = list(items.keys())
+    weights = [1 for _ in range(len(keys))]
+
+    if method in ("sparse", "dense"):
+        exponent = -0.5 if method == "sparse" else 0.5
+        class_sizes = Counter(item["label"] for item in items.values())
+        weights = [class_sizes[item["label"]] ** exponent for item in items.values()]
+
+    return items[random.choices(keys, weights=weights, k=1)[0]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--tags-per-item", type=int, default=10)
+    parser.add_argument("--labels", type=int, default=500)
+    parser.add_argument("--values", type=int, default=200)
+    parser.add_argument("--draws", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        setup_database(os.path.join(work_dir, "benchmark.sqlite3"))
+
+        from api.models import TagConditions
+        from api.views_extension import RandomSampler
+
+        populate(args.items, args.tags_per_item, args.labels, args.values, seed=0)
+
+        searches = {
+            "everything": {},
+            "tag is": {("colour", TagConditions.Is.value): ["value1", "value2"]},
+        }
+
+        for name, tags in searches.items():
+            for method in ("uniform", "sparse"):
+                start = time.perf_counter()
+                for _ in range(args.draws):
+                    choose_with_dict(tags, method)
+                previous = (time.perf_counter() - start) / args.draws
+
+                RandomSampler.invalidate()
+                start = time.perf_counter()
+                RandomSampler.choose(tags, method)
+                first = time.perf_counter() - start
+
+                start = time.perf_counter()
+                for _ in range(args.draws):
+                    RandomSampler.choose(tags, method)
+                cached = (time.perf_counter() - start) / args.draws
+
+                print(
+                    f"{name:>10} {method:>7}: previous {previous * 1000:8.2f}ms, "
+                    f"sampler first draw {first * 1000:8.2f}ms, "
+                    f"cached {cached * 1000:6.3f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
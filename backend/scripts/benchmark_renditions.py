@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.utils.renditions import SUPPORTED_FORMATS, encode_rendition  # noqa: E402
+
+
+def build_image(path, width, height):
+    # Smooth gradients with noise, closer to a photo than a flat colour
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width)[None, :, None]
+    y = np.linspace(0, 255, height)[:, None, None]
+    pixels = np.concatenate((x + 0 * y, y + 0 * x, (x + y) / 2), axis=2)
+    pixels += rng.normal(0, 12, pixels.shape)
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--targets", type=int, nargs="+", default=[480, 1080])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, "source.png")
+        build_image(source, args.width, args.height)
+        print(f"original png: {os.path.getsize(source) / 1024:9.1f}KB")
+
+        for width in args.targets:
+            for format_name in SUPPORTED_FORMATS:
+                path = os.path.join(work_dir, f"{width}.{format_name}")
+                start = time.perf_counter()
+                encode_rendition(source, path, width, format_name)
+                seconds = time.perf_counter() - start
+                print(
+                    f"{width:>5} {format_name:>4}: {os.path.getsize(path) / 1024:9.1f}KB, "
+                    f"encoded in {seconds:.2f}s"
+                )
+
+
+if __name__ == "__main__":
+    main()
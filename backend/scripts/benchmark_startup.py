@@ -0,0 +1,93 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_PATH = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("torch", "transformers", "ultralytics")
+
+
+def run_command(command, extra_args=()):
+    return subprocess.run(
+        [sys.executable, *extra_args, "manage.py", command, "--help"],
+        cwd=BACKEND_PATH,
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+    )
+
+
+def time_command(command, runs):
+    # Wall time of a cold interpreter starting the command and exiting after --help
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = run_command(command)
+        times.append(time.perf_counter() - start)
+
+        if result.returncode != 0:
+            raise Exception(f"manage.py {command} failed:\n{result.stderr}")
+
+    return times
+
+
+def import_times(command):
+    # Cumulative import time in seconds of each top-level package from -X importtime,
+    # and the set of every module imported
+    result = run_command(command, extra_args=("-X", "importtime"))
+
+    totals = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+
+        modules.add(name.strip())
+
+        # Only count top-level imports so nested modules aren't counted twice
+        if not name.startswith("  "):
+            package = name.strip().split(".")[0]
+            totals[package] = totals.get(package, 0) + int(cumulative) / 1e6
+
+    return totals, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--commands", nargs="+", default=["desktop", "web", "setup", "cleandb"]
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--top", type=int, default=0, help="Show the slowest imported packages."
+    )
+    args = parser.parse_args()
+
+    for command in args.commands:
+        times = time_command(command, args.runs)
+        print(
+            f"{command:>10}: median {statistics.median(times):6.3f}s, "
+            f"min {min(times):6.3f}s over {args.runs} runs"
+        )
+
+        if args.top:
+            totals, modules = import_times(command)
+            for package in HEAVY_MODULES:
+                if package in modules:
+                    print(f"{'':>12}warning: {package} imported at startup")
+
+            for package, seconds in sorted(
+                totals.items(), key=lambda item: item[1], reverse=True
+            )[: args.top]:
+                print(f"{'':>12}{package:<24}{seconds:6.3f}s")
+
+
+if __name__ == "__main__":
+    main()
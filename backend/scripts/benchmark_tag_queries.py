@@ -0,0 +1,156 @@
+import argparse
+import operator
+import os
+import sys
+import tempfile
+import time
+from functools import reduce
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def setup_database(path):
+    # A throwaway database, set before django reads the settings
+    os.environ["DATABASE_PATH"] = path
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "filestoragebackend.settings")
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+
+def populate(n_items, tags_per_item, n_labels, n_values, seed):
+    from api.models import FileState, FileType, Item, Tags
+
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(n_labels, size=n_items)
+
+    Item.objects.bulk_create(
+        (
+            Item(
+                state=int(FileState.Complete),
+                label=f"label{label}",
+                filetype=int(FileType.Image),
+                width=100,
+                height=100,
+            )
+            for label in labels
+        ),
+        batch_size=5000,
+    )
+    item_ids = np.array(Item.objects.values_list("id", flat=True))
+
+    names = ["colour", "size", "place", "labelplus"]
+    n_tags = n_items * tags_per_item
+    tag_items = rng.choice(item_ids, n_tags)
+    tag_names = rng.integers(len(names), size=n_tags)
+    tag_values = rng.integers(n_values, size=n_tags)
+
+    Tags.objects.bulk_create(
+        (
+            Tags(item_id_id=int(item_id), name=names[name], value=f"value{value}")
+            for item_id, name, value in zip(tag_items, tag_names, tag_values)
+        ),
+        batch_size=5000,
+        ignore_conflicts=True,  # Repeated random tags
+    )
+
+
+def get_items_with_joins(tags):
+    # The previous filter/exclude per condition, kept to compare speed and results
+    from django.db.models import Q
+
+    from api.models import Item, TagConditions
+
+    objects = Item.objects.all()
+
+    for (name, condition), values in tags.items():
+        if name == "label" and condition == TagConditions.Is.value:
+            objects = objects.filter(
+                Q(label__in=values) | Q(tags__name="labelplus", tags__value__in=values)
+            )
+        elif condition == TagConditions.Is.value:
+            objects = objects.filter(tags__name=name, tags__value__in=values)
+        elif condition == TagConditions.IsNot.value:
+            objects = objects.exclude(tags__name=name, tags__value__in=values)
+        elif condition == TagConditions.Contains.value:
+            objects = objects.filter(
+                reduce(
+                    operator.or_,
+                    (Q(tags__name=name, tags__value__contains=t) for t in values),
+                )
+            )
+
+    return {item.id for item in objects}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--tags-per-item", type=int, default=10)
+    parser.add_argument("--labels", type=int, default=500)
+    parser.add_argument("--values", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--explain", action="store_true", help="Print each query's plan."
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        setup_database(os.path.join(work_dir, "benchmark.sqlite3"))
+
+        from api.models import TagConditions
+        from api.views_extension import explain_query, get_items_from_tags
+
+        start = time.perf_counter()
+        populate(args.items, args.tags_per_item, args.labels, args.values, seed=0)
+        print(
+            f"Created {args.items} items and {args.items * args.tags_per_item} tags "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+        searches = {
+            "label is": {("label", TagConditions.Is.value): ["label1", "value1"]},
+            "tag is": {("colour", TagConditions.Is.value): ["value1", "value2"]},
+            "tag contains": {("place", TagConditions.Contains.value): ["value1"]},
+            "is and is not": {
+                ("colour", TagConditions.Is.value): ["value1"],
+                ("size", TagConditions.IsNot.value): ["value2"],
+            },
+            "three tags": {
+                ("colour", TagConditions.Is.value): ["value1", "value2"],
+                ("size", TagConditions.Is.value): ["value3", "value4"],
+                ("place", TagConditions.Contains.value): ["value1"],
+            },
+        }
+
+        for name, tags in searches.items():
+            timings = {}
+            for method, search in (
+                ("joins", get_items_with_joins),
+                (
+                    "subquery",
+                    lambda tags: {item.id for item in get_items_from_tags(tags)},
+                ),
+            ):
+                start = time.perf_counter()
+                for _ in range(args.repeats):
+                    results = search(tags)
+                timings[method] = (time.perf_counter() - start) / args.repeats
+
+            if args.explain:
+                explain_query(get_items_from_tags(tags))
+
+            print(
+                f"{name:>14}: joins {timings['joins'] * 1000:8.1f}ms, "
+                f"subquery {timings['subquery'] * 1000:8.1f}ms, {len(results)} items"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark_tag_queries import setup_database
+
+BOUNDARY = "benchmarkboundary"
+CHUNK_SIZE = 1024 * 1024
+
+
+def build_video(path, size_mb):
+    # A short real clip padded with a free box, so it's a valid MP4 of any size
+    import imageio_ffmpeg
+
+    subprocess.run(
+        [
+            imageio_ffmpeg.get_ffmpeg_exe(),
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc=size=1280x720:rate=30",
+            "-t",
+            "2",
+            "-pix_fmt",
+            "yuv420p",
+            path,
+        ],
+        check=True,
+    )
+
+    padding = size_mb * CHUNK_SIZE - os.path.getsize(path)
+    with open(path, "ab") as file:
+        file.write((padding + 8).to_bytes(4, "big") + b"free")
+        chunk = bytes(CHUNK_SIZE)
+        while padding > 0:
+            file.write(chunk[: min(padding, CHUNK_SIZE)])
+            padding -= CHUNK_SIZE
+
+
+def build_request_body(video_path, body_path):
+    # The multipart body is written to disk, so the client side holds nothing
+    with open(body_path, "wb") as body, open(video_path, "rb") as video:
+        body.write(
+            (
+                f"--{BOUNDARY}\r\n"
+                'Content-Disposition: form-data; name="video"; filename="clip.mp4"\r\n'
+                "Content-Type: video/mp4\r\n\r\n"
+            ).encode()
+        )
+        shutil.copyfileobj(video, body, CHUNK_SIZE)
+        body.write(f"\r\n--{BOUNDARY}--\r\n".encode())
+
+
+def previous_post(self, request):
+    # The previous upload, kept to compare: Django's default handlers, a copy
+    # into unprocessed and moviepy to read the dimensions
+    from django.core.files.storage import FileSystemStorage
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    from rest_framework.response import Response
+
+    from api.models import FileState, FileType, create_item
+    from api.utils.key_paths import UNPROCESSED_PATH
+
+    video_object = request.FILES["video"]
+    old_path = f"{UNPROCESSED_PATH}/{video_object.name}"
+    FileSystemStorage(location=UNPROCESSED_PATH).save(video_object.name, video_object)
+
+    video = VideoFileClip(old_path)
+    try:
+        width, height = video.w, video.h
+    finally:
+        video.close()
+
+    item = create_item(
+        label="",
+        state=int(FileState.NeedsLabel),
+        width=width,
+        filetype=int(FileType.Video),
+        height=height,
+    )
+    os.makedirs(os.path.dirname(item.getpath()), exist_ok=True)
+    os.rename(old_path, item.getpath())
+    return Response({"message": "Files successfully uploaded!"})
+
+
+def run(mode, work_dir, body_path):
+    # One upload through the WSGI handler, in its own process for a clean peak RSS
+    os.environ["MEDIA_PATH"] = os.path.join(work_dir, f"media_{mode}")
+    setup_database(os.path.join(work_dir, f"{mode}.sqlite3"))
+
+    from unittest.mock import patch
+
+    from django.contrib.auth.models import User
+    from django.core.handlers.wsgi import WSGIHandler
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api import views, views_extension
+    from api.models import Item
+
+    token = AccessToken.for_user(User.objects.create_user(username="benchmark"))
+    handler = WSGIHandler()
+    statuses = []
+
+    with open(body_path, "rb") as body:
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "PATH_INFO": "/api/upload",
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "443",
+            "HTTP_X_FORWARDED_PROTO": "https",
+            "HTTP_COOKIE": f"access_token={token}",
+            "CONTENT_TYPE": f"multipart/form-data; boundary={BOUNDARY}",
+            "CONTENT_LENGTH": str(os.path.getsize(body_path)),
+            "wsgi.input": body,
+            "wsgi.url_scheme": "https",
+            "wsgi.errors": sys.stderr,
+        }
+
+        with (
+            patch.object(views_extension.ThumbnailStore, "pregenerate"),
+            patch.object(
+                views.FileUpload,
+                "post",
+                previous_post if mode == "previous" else views.FileUpload.post,
+            ),
+        ):
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # moviepy probes for ffplay on import, so only a larger child counts
+            children_baseline = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            start = time.perf_counter()
+            response = handler(environ, lambda status, headers: statuses.append(status))
+            seconds = time.perf_counter() - start
+            b"".join(response)
+            response.close()
+
+    item = Item.objects.get()
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "status": statuses[0],
+                "seconds": seconds,
+                "baseline_mb": baseline / 1024,
+                "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                "children_peak_mb": (
+                    children_peak / 1024 if children_peak > children_baseline else 0
+                ),
+                "dimensions": [item.width, item.height],
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=500)
+    parser.add_argument("--mode", choices=("previous", "streaming"))
+    parser.add_argument("--work-dir")
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.work_dir, os.path.join(args.work_dir, "body"))
+        return
+
+    # Kept beside the media, the streaming upload is renamed within one filesystem
+    with tempfile.TemporaryDirectory(dir=".") as work_dir:
+        video_path = os.path.join(work_dir, "clip.mp4")
+        build_video(video_path, args.size_mb)
+        build_request_body(video_path, os.path.join(work_dir, "body"))
+        os.remove(video_path)
+
+        for mode in ("previous", "streaming"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--work-dir", work_dir],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{mode:>9}: {result['status']}, {result['seconds']:6.2f}s, "
+                f"peak RSS {result['peak_mb']:7.1f}MB "
+                f"(+{result['peak_mb'] - result['baseline_mb']:.1f}MB), "
+                f"child processes {result['children_peak_mb']:.1f}MB, "
+                f"{result['dimensions'][0]}x{result['dimensions'][1]}"
+            )
+
+
+if __name__ == "__main__":
+    main()